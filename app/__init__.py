@@ -12,6 +12,11 @@ def create_app(config_class=Config):
     app.config.from_object(config_class)
     
     db.init_app(app)
+    
+    # Tune SQLite connections for concurrent loads and readers
+    from app.sqlite_tuning import configure_sqlite
+    with app.app_context():
+        configure_sqlite(db.engine, app.config.get('SQLITE_PRAGMAS'))
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     
@@ -19,6 +24,18 @@ def create_app(config_class=Config):
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
         os.makedirs(app.config['UPLOAD_FOLDER'])
     
+    # Background executor for ETL runs
+    from app.etl.executor import executor
+    executor.init_app(app)
+    
+    # Scheduler for jobs with a cron or interval schedule
+    from app.etl.scheduler import scheduler
+    scheduler.init_app(app)
+    
+    # Request timing and the /metrics endpoint
+    from app.monitoring import monitoring
+    monitoring.init_app(app)
+    
     # Register blueprints
     from app.routes import auth, main, jobs, etl
     app.register_blueprint(auth.bp)
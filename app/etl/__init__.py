@@ -2,5 +2,6 @@
 from app.etl.extract import extract_data
 from app.etl.transform import transform_data
 from app.etl.load import load_data
+from app.etl.pipeline import run_pipeline
 
-__all__ = ['extract_data', 'transform_data', 'load_data']
+__all__ = ['extract_data', 'transform_data', 'load_data', 'run_pipeline']
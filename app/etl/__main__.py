@@ -0,0 +1,158 @@
+"""
+ETL Batch Runner
+Runs ETL jobs from the command line, without the web app, on a pool of
+worker processes. Each run is recorded like a run started from the web UI.
+
+Usage: python -m app.etl [JOB_ID ...] [--user USERNAME] [--all] [--workers 4] [--force]
+"""
+
+import argparse
+import sys
+import time
+from concurrent.futures import as_completed
+from datetime import datetime
+
+from sqlalchemy import or_
+
+OK_STATUSES = ('success', 'unchanged')
+
+
+def select_jobs(job_ids=(), username=None, all_jobs=False):
+    """Jobs picked by id, by owner and/or all of them, ordered by id.
+
+    Raises ValueError for unknown job ids or users.
+    """
+    from app.models import Job, User
+
+    query = Job.query
+    if not all_jobs:
+        conditions = []
+        if job_ids:
+            conditions.append(Job.id.in_(job_ids))
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                raise ValueError(f'Unknown user: {username}')
+            conditions.append(Job.user_id == user.id)
+        query = query.filter(or_(*conditions))
+    jobs = query.order_by(Job.id.asc()).all()
+
+    missing = sorted(set(job_ids) - {job.id for job in jobs})
+    if missing:
+        raise ValueError(f'Unknown job id(s): {", ".join(str(job_id) for job_id in missing)}')
+    return jobs
+
+
+def run_jobs(jobs, force=False):
+    """Queue a run for each job on the executor and yield each ETLRun as it finishes"""
+    from app import db
+    from app.models import ETLRun
+    from app.etl.executor import executor
+
+    runs = []
+    for job in jobs:
+        etl_run = ETLRun(job_id=job.id, status='queued', queued_at=datetime.utcnow(),
+                         force=force, trigger='cli')
+        db.session.add(etl_run)
+        runs.append(etl_run)
+    db.session.commit()
+
+    futures = {}
+    for etl_run in runs:
+        future = executor.submit(etl_run.id)
+        if future is None:
+            # Ran inline ('sync' executor)
+            yield etl_run
+        else:
+            futures[future] = etl_run
+
+    for future in as_completed(futures):
+        etl_run = futures[future]
+        db.session.refresh(etl_run)
+        db.session.commit()
+        yield etl_run
+
+
+def _run_seconds(etl_run):
+    if etl_run.started_at and etl_run.completed_at:
+        return (etl_run.completed_at - etl_run.started_at).total_seconds()
+    return 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.etl', description='Run ETL jobs without the web app')
+    parser.add_argument('job_ids', nargs='*', type=int, metavar='JOB_ID', help='Jobs to run')
+    parser.add_argument('--user', help='Run all jobs of this user')
+    parser.add_argument('--all', action='store_true', dest='all_jobs', help='Run all jobs')
+    parser.add_argument('--workers', type=int, default=4, help='Jobs run in parallel (default: 4)')
+    parser.add_argument('--executor', choices=('process', 'thread', 'sync'), default='process',
+                        help='Worker pool (default: process)')
+    parser.add_argument('--force', action='store_true', help='Load sources even if they are unchanged')
+    args = parser.parse_args(argv)
+
+    if not (args.job_ids or args.user or args.all_jobs):
+        parser.error('give job ids, --user or --all')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    from app import create_app
+    from app.etl.executor import executor
+    from config import Config
+
+    BatchConfig = type('BatchConfig', (Config,), {
+        'ETL_EXECUTOR': args.executor,
+        'ETL_MAX_WORKERS': args.workers,
+        'ETL_SCHEDULER_ENABLED': False,
+    })
+    app = create_app(BatchConfig)
+
+    with app.app_context():
+        try:
+            jobs = select_jobs(args.job_ids, args.user, args.all_jobs)
+        except ValueError as e:
+            parser.error(str(e))
+        if not jobs:
+            print("No jobs to run.")
+            return 0
+
+        print("=" * 92)
+        print(f"ETL BATCH RUN ({len(jobs)} job{'s' if len(jobs) != 1 else ''}, {args.workers} {args.executor} workers)")
+        print("=" * 92)
+        print(f"{'Done':<8}{'Run':>7}  {'Job':<30}{'Status':<11}{'Rows':>12}{'Seconds':>10}{'Rows/s':>12}")
+
+        names = {job.id: job.name for job in jobs}
+        runs = []
+        started = time.perf_counter()
+        try:
+            for etl_run in run_jobs(jobs, force=args.force):
+                runs.append(etl_run)
+                seconds = _run_seconds(etl_run)
+                rate = (etl_run.rows_loaded or 0) / seconds if seconds > 0 else 0
+                print(f"{f'{len(runs)}/{len(jobs)}':<8}{f'#{etl_run.id}':>7}  {names[etl_run.job_id][:28]:<30}"
+                      f"{etl_run.status:<11}{etl_run.rows_loaded or 0:>12,}{seconds:>10.2f}{rate:>12,.0f}", flush=True)
+                if etl_run.status not in OK_STATUSES and etl_run.error_message:
+                    print(f"{'':<17}{etl_run.error_message}", flush=True)
+        finally:
+            executor.shutdown()
+        elapsed = time.perf_counter() - started
+
+        counts = {}
+        for etl_run in runs:
+            counts[etl_run.status] = counts.get(etl_run.status, 0) + 1
+        rows_extracted = sum(etl_run.rows_extracted or 0 for etl_run in runs)
+        rows_loaded = sum(etl_run.rows_loaded or 0 for etl_run in runs)
+        busy_seconds = sum(_run_seconds(etl_run) for etl_run in runs)
+
+        print("=" * 92)
+        print("Runs: " + ", ".join(f"{count} {status}" for status, count in sorted(counts.items())))
+        print(f"Rows: {rows_extracted:,} extracted, {rows_loaded:,} loaded")
+        print(f"Time: {elapsed:.2f}s wall, {busy_seconds:.2f}s in runs "
+              f"({busy_seconds / elapsed if elapsed > 0 else 0:.1f}x parallel)")
+        print(f"Throughput: {rows_loaded / elapsed if elapsed > 0 else 0:,.0f} rows/s")
+        print("=" * 92)
+
+    return 0 if all(etl_run.status in OK_STATUSES for etl_run in runs) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,309 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update, func
+import os
+import threading
+import time
+
+from app.models import ETLRun, PipelineRun
+from app.etl.errors import StageError
+from app.etl.runlog import get_run_logger
+
+
+class RunCancelled(StageError):
+    """Raised at a cancellation check point once a run was cancelled or timed out"""
+
+
+# Controls of the runs executing in this process, by run id
+_active_controls = {}
+_active_lock = threading.Lock()
+
+
+class RunControl:
+    """Heartbeats, cancellation and the timeout of one executing run.
+
+    While the run executes, a background thread touches the run's heartbeat
+    file, writes ``heartbeat_at`` (and renews the run's table lease) every
+    ``interval`` seconds and reads the run's ``cancel_requested`` flag, so a
+    cancel from another process (or the run's deadline passing) is noticed
+    within one interval; ``request_cancel()`` stops a run of this process
+    straight away. The pipeline calls ``check()`` between stages and chunks;
+    it raises RunCancelled, which rolls back any load in progress.
+    Cancellation is cooperative: a stage is never interrupted in the middle
+    of a single blocking call.
+    """
+
+    def __init__(self, etl_run, db, timeout=None, interval=None):
+        from app.etl.locks import lock_ttl
+
+        self.etl_run_id = etl_run.id
+        self.engine = db.engine
+        self.timeout = timeout
+        if interval is None:
+            interval = current_app.config.get('ETL_HEARTBEAT_INTERVAL', 10)
+        self.interval = interval
+        self.lease_ttl = lock_ttl()
+        self.heartbeat_file = heartbeat_path(etl_run.id)
+        self.reason = None  # 'cancelled' or 'timeout' once the run should stop
+        self._deadline = time.monotonic() + timeout if timeout else None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        with _active_lock:
+            _active_controls[self.etl_run_id] = self
+        touch_heartbeat(self.heartbeat_file)
+        self._thread = threading.Thread(target=self._watch, name=f'etl-heartbeat-{self.etl_run_id}',
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Not joined: a heartbeat waiting for the write lock must not hold up the run
+        self._stop.set()
+        with _active_lock:
+            _active_controls.pop(self.etl_run_id, None)
+        try:
+            os.remove(self.heartbeat_file)
+        except OSError:
+            pass
+
+    @property
+    def message(self):
+        if self.reason == 'timeout':
+            return f'Run timed out after {self.timeout} seconds'
+        if self.reason == 'cancelled':
+            return 'Run cancelled by user'
+        return None
+
+    def check(self, stage):
+        """Raise RunCancelled if the run has been cancelled or has timed out"""
+        if self.reason is None and self._deadline is not None and time.monotonic() >= self._deadline:
+            self.reason = 'timeout'
+        if self.reason is not None:
+            raise RunCancelled(stage, self.message)
+
+    def _beat(self):
+        from app.etl.locks import renew_table_locks
+
+        table = ETLRun.__table__
+        # Read the flag first: a read never waits for another run's write lock
+        with self.engine.connect() as conn:
+            cancel_requested = conn.execute(select(table.c.cancel_requested)
+                                            .where(table.c.id == self.etl_run_id)).scalar()
+        if cancel_requested and self.reason is None:
+            self.reason = 'cancelled'
+        # A load (of this run or another) may hold SQLite's write lock, so only
+        # wait one interval for it before trying again; the file heartbeat is already written
+        with self.engine.connect() as conn, busy_timeout(conn, self.interval):
+            conn.execute(update(table).where(table.c.id == self.etl_run_id)
+                         .values(heartbeat_at=datetime.utcnow()))
+            renew_table_locks(conn, self.etl_run_id, self.lease_ttl)
+            conn.commit()
+
+    def _watch(self):
+        while True:
+            wait = self.interval
+            if self._deadline is not None:
+                wait = max(0, min(wait, self._deadline - time.monotonic()))
+            if self._stop.wait(wait):
+                return
+            if self._deadline is not None and time.monotonic() >= self._deadline and self.reason is None:
+                self.reason = 'timeout'
+            touch_heartbeat(self.heartbeat_file)
+            try:
+                self._beat()
+            except Exception:
+                # The database was locked by a load; try again next interval
+                pass
+
+
+@contextmanager
+def busy_timeout(conn, seconds):
+    """Wait at most seconds for SQLite's write lock on conn"""
+    sqlite = conn.dialect.name == 'sqlite'
+    if sqlite:
+        previous = conn.exec_driver_sql('PRAGMA busy_timeout').scalar()
+        conn.exec_driver_sql(f'PRAGMA busy_timeout = {int(seconds * 1000)}')
+    try:
+        yield conn
+    finally:
+        if sqlite:
+            conn.exec_driver_sql(f'PRAGMA busy_timeout = {previous}')
+
+
+def touch_heartbeat(path):
+    """Write a file heartbeat, which never waits for the database"""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a'):
+            pass
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def beat_queued_runs(engine, run_ids, interval):
+    """Heartbeat runs waiting in this process's queue, so sweeps elsewhere keep them"""
+    for run_id in run_ids:
+        touch_heartbeat(heartbeat_path(run_id))
+    table = ETLRun.__table__
+    with engine.connect() as conn, busy_timeout(conn, interval):
+        conn.execute(update(table).where(table.c.id.in_(run_ids), table.c.status == 'queued')
+                     .values(heartbeat_at=datetime.utcnow()))
+        conn.commit()
+
+
+def heartbeat_path(run_id):
+    """File an executing run touches on every heartbeat"""
+    folder = current_app.config.get('ETL_HEARTBEAT_FOLDER') or \
+        os.path.join(current_app.config['UPLOAD_FOLDER'], 'heartbeats')
+    return os.path.join(folder, f'run_{run_id}')
+
+
+def heartbeat_seen_at(run_id):
+    """When the run last touched its heartbeat file (UTC), or None"""
+    try:
+        return datetime.utcfromtimestamp(os.path.getmtime(heartbeat_path(run_id)))
+    except OSError:
+        return None
+
+
+def beating_runs(run_ids, since):
+    """The runs among run_ids whose heartbeat file was touched at or after since"""
+    beating = []
+    for run_id in run_ids:
+        seen_at = heartbeat_seen_at(run_id)
+        if seen_at is not None and seen_at >= since:
+            beating.append(run_id)
+    return beating
+
+
+def request_cancel(run_id):
+    """Stop a run executing in this process at its next check point.
+
+    Returns False if the run is not executing here; it then has to be
+    cancelled through its ``cancel_requested`` flag.
+    """
+    with _active_lock:
+        control = _active_controls.get(run_id)
+    if control is None:
+        return False
+    if control.reason is None:
+        control.reason = 'cancelled'
+    return True
+
+
+def run_timeout(job):
+    """Seconds a run of job may take (None = no limit)"""
+    return job.timeout_seconds or current_app.config.get('ETL_RUN_TIMEOUT')
+
+
+def check_cancelled(etl_run, stage):
+    """Cancellation check point; a no-op for runs not started by the executor"""
+    control = getattr(etl_run, '_run_control', None)
+    if control is not None:
+        control.check(stage)
+
+
+def checked_chunks(etl_run, stage, chunks):
+    """Pass chunks through, checking for cancellation before each one"""
+    for chunk in chunks:
+        check_cancelled(etl_run, stage)
+        yield chunk
+
+
+def fail_stale_runs(db, query=None, stale_after=None, now=None):
+    """Fail queued and running runs whose worker has stopped sending heartbeats.
+
+    A run is stale when neither its heartbeat nor its start (or, while it is
+    queued, its queueing) is more recent than ``stale_after`` seconds
+    (``ETL_HEARTBEAT_TIMEOUT``), which means the process holding it died or
+    restarted. Executors heartbeat the runs waiting in their queue as well.
+    The heartbeat file is checked as well as ``heartbeat_at``: writing the
+    column waits for SQLite's write lock, the file never does. Runs this
+    process still holds are never touched. ``query`` narrows the runs
+    checked. Returns the runs that were failed.
+    """
+    from app.etl.executor import executor
+
+    if stale_after is None:
+        stale_after = current_app.config.get('ETL_HEARTBEAT_TIMEOUT', 300)
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=stale_after)
+    query = query if query is not None else ETLRun.query
+    last_beat = func.coalesce(ETLRun.heartbeat_at, ETLRun.started_at, ETLRun.queued_at)
+    candidates = [run for run in query.filter(ETLRun.status.in_(ETLRun.ACTIVE_STATUSES), last_beat < cutoff).all()
+                  if not executor.is_active(run.id)]
+    beating = beating_runs([run.id for run in candidates], cutoff)
+    stale_runs = [run for run in candidates if run.id not in beating]
+    for run in stale_runs:
+        last_seen = max(filter(None, (run.heartbeat_at, run.started_at, run.queued_at, heartbeat_seen_at(run.id))))
+        try:
+            os.remove(heartbeat_path(run.id))
+        except OSError:
+            pass
+        was = 'while it was queued ' if run.status == 'queued' else ''
+        run.status = 'failed'
+        run.completed_at = now
+        run.error_message = (f'Worker stopped responding {was}'
+                             f'(last heartbeat {last_seen.strftime("%Y-%m-%d %H:%M:%S")} UTC)')
+        get_run_logger(run, db).error('general', run.error_message)
+    db.session.commit()
+    return stale_runs
+
+
+def fail_stale_pipeline_runs(db, query=None, stale_after=None, now=None, swept=()):
+    """Fail queued and running pipeline runs whose coordinator has died.
+
+    A coordinator only waits while one of its runs is queued or running, and
+    queues the next ones as soon as a run finishes. A pipeline run that is not
+    coordinated by this process, has no active run and has not started or
+    finished a run within ``stale_after`` seconds has therefore lost its
+    coordinator. ``swept`` holds ids of runs fail_stale_runs just failed:
+    their last heartbeat counts, not their completion. Returns the pipeline
+    runs that were failed.
+    """
+    from app.etl.executor import executor
+
+    if stale_after is None:
+        stale_after = current_app.config.get('ETL_HEARTBEAT_TIMEOUT', 300)
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=stale_after)
+    query = query if query is not None else PipelineRun.query
+    candidates = query.filter(PipelineRun.status.in_(ETLRun.ACTIVE_STATUSES),
+                              func.coalesce(PipelineRun.started_at, PipelineRun.queued_at) < cutoff).all()
+    stale_pipeline_runs = []
+    for pipeline_run in candidates:
+        if executor.is_pipeline_active(pipeline_run.id):
+            continue
+        runs = pipeline_run.etl_runs
+        if any(run.status in ETLRun.ACTIVE_STATUSES for run in runs):
+            continue
+        seen = [pipeline_run.started_at, pipeline_run.queued_at]
+        for run in runs:
+            finished_at = None if run.id in swept else run.completed_at
+            seen.append(finished_at or run.heartbeat_at or run.started_at or run.queued_at)
+        last_seen = max(filter(None, seen))
+        if last_seen >= cutoff:
+            continue
+        pipeline_run.status = 'failed'
+        pipeline_run.completed_at = now
+        pipeline_run.error_message = (f'Pipeline coordinator stopped responding '
+                                      f'(last activity {last_seen.strftime("%Y-%m-%d %H:%M:%S")} UTC)')
+        stale_pipeline_runs.append(pipeline_run)
+    db.session.commit()
+    return stale_pipeline_runs
+
+
+def sweep_abandoned_runs(db, now=None):
+    """Fail abandoned runs, then the pipeline runs left without a coordinator.
+
+    Run at scheduler start-up and on every refresh, so runs queued by a
+    process that crashed or restarted do not stay active forever. Returns
+    (failed runs, failed pipeline runs).
+    """
+    stale_runs = fail_stale_runs(db, now=now)
+    stale_pipeline_runs = fail_stale_pipeline_runs(db, now=now, swept={run.id for run in stale_runs})
+    return stale_runs, stale_pipeline_runs
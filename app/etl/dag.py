@@ -0,0 +1,107 @@
+class CycleError(ValueError):
+    """Raised when job dependencies form a cycle"""
+
+    def __init__(self, cycle, names=None):
+        self.cycle = cycle
+        names = names or {}
+        path = ' -> '.join(str(names.get(node, node)) for node in cycle)
+        super().__init__(f'Dependency cycle: {path}')
+
+
+def find_cycle(graph):
+    """Return one cycle of graph ({node: upstream nodes}) as a list of nodes, or None"""
+    visiting, done = set(), set()
+    for start in graph:
+        if start in done:
+            continue
+        # Iterative depth-first search; path holds the nodes being visited
+        path = [start]
+        stack = [iter(graph.get(start, ()))]
+        visiting.add(start)
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                finished = path.pop()
+                visiting.discard(finished)
+                done.add(finished)
+            elif node in visiting:
+                return path[path.index(node):] + [node]
+            elif node not in done:
+                path.append(node)
+                stack.append(iter(graph.get(node, ())))
+                visiting.add(node)
+    return None
+
+
+def topological_levels(graph, names=None):
+    """Group the nodes of graph ({node: upstream nodes}) into levels.
+
+    Every node comes after all of its upstream nodes; the nodes of one level
+    do not depend on each other and can run in parallel. Raises CycleError.
+    """
+    waiting = {node: set(upstream) & graph.keys() for node, upstream in graph.items()}
+    levels = []
+    while waiting:
+        level = sorted(node for node, upstream in waiting.items() if not upstream)
+        if not level:
+            raise CycleError(find_cycle(waiting), names)
+        levels.append(level)
+        for node in level:
+            del waiting[node]
+        for upstream in waiting.values():
+            upstream.difference_update(level)
+    return levels
+
+
+def downstream_graph(graph):
+    """Invert {node: upstream nodes} into {node: downstream nodes}"""
+    downstream = {node: set() for node in graph}
+    for node, upstream in graph.items():
+        for parent in upstream:
+            downstream.setdefault(parent, set()).add(node)
+    return downstream
+
+
+def descendants(downstream, node):
+    """All nodes that depend on node, directly or indirectly"""
+    found = set()
+    stack = [node]
+    while stack:
+        for child in downstream.get(stack.pop(), ()):
+            if child not in found:
+                found.add(child)
+                stack.append(child)
+    return found
+
+
+def pipeline_graph(job, upstream_jobs=None):
+    """Collect job and everything upstream of it.
+
+    Returns (jobs, graph): jobs maps job id to Job and graph maps job id to the
+    ids of its upstream jobs. upstream_jobs replaces job's own upstream jobs,
+    which lets a dependency change be checked before it is saved.
+    """
+    jobs = {job.id: job}
+    graph = {}
+    stack = [job]
+    while stack:
+        current = stack.pop()
+        parents = upstream_jobs if current is job and upstream_jobs is not None else current.upstream_jobs
+        graph[current.id] = {parent.id for parent in parents}
+        for parent in parents:
+            if parent.id not in jobs:
+                jobs[parent.id] = parent
+                stack.append(parent)
+    return jobs, graph
+
+
+def build_pipeline(job, upstream_jobs=None):
+    """Order job and its upstream jobs for execution.
+
+    Returns (jobs, graph, levels); raises CycleError if the dependencies
+    form a cycle.
+    """
+    jobs, graph = pipeline_graph(job, upstream_jobs)
+    levels = topological_levels(graph, {job_id: upstream.name for job_id, upstream in jobs.items()})
+    return jobs, graph, levels
@@ -0,0 +1,7 @@
+class StageError(Exception):
+    """Raised inside a streaming pipeline to report which stage failed"""
+
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+        self.message = message
@@ -0,0 +1,433 @@
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import wait as futures_wait
+from datetime import datetime
+from flask import current_app
+import os
+import threading
+
+from app import db
+from app.models import ETLRun, PipelineRun
+from app.etl.dag import build_pipeline, downstream_graph, descendants, CycleError
+from app.etl.pipeline import run_pipeline
+from app.etl.runlog import get_run_logger
+from app.etl.retention import apply_retention
+from app.etl.control import RunControl, run_timeout, beat_queued_runs, heartbeat_path
+from app.etl.locks import wait_for_table_lock, release_table_lock
+from app.monitoring import record_run
+
+
+def execute_run(run_id, recorder=record_run, block=True):
+    """Execute a queued ETL run. Must be called inside an app context.
+
+    A run that finishes is passed to ``recorder(etl_run, failed_stage)``,
+    which counts it in this process's metrics by default. With block=False a
+    run whose table is leased by another run is left queued and 'queued' is
+    returned, for the caller to retry it later.
+    """
+    etl_run = db.session.get(ETLRun, run_id)
+    if etl_run is None or etl_run.status != 'queued':
+        return None
+
+    # One run at a time loads a target table; wait behind (or reject on) its holder
+    table_name = etl_run.job.table_name
+    if not wait_for_table_lock(db, etl_run, block=block):
+        if etl_run.status == 'rejected':
+            recorder(etl_run, None)
+        return etl_run.status
+
+    etl_run.status = 'running'
+    etl_run.started_at = etl_run.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+
+    # Heartbeats, cancel requests and the job's timeout are watched while the pipeline runs
+    control = RunControl(etl_run, db, timeout=run_timeout(etl_run.job))
+    etl_run._run_control = control
+    failed_stage = None
+    try:
+        with control:
+            stage, error = run_pipeline(etl_run.job, etl_run, db, force=bool(etl_run.force))
+        if error and control.reason is not None:
+            # The run was stopped at a check point and its load rolled back
+            failed_stage = stage
+            etl_run.status = 'cancelled' if control.reason == 'cancelled' else 'failed'
+            etl_run.error_message = control.message
+        elif error:
+            failed_stage = stage
+            etl_run.status = 'failed'
+            etl_run.error_message = error
+        elif etl_run.status == 'running':
+            # The pipeline may already have set a final status such as 'unchanged'
+            etl_run.status = 'success'
+        etl_run.completed_at = datetime.utcnow()
+        db.session.commit()
+
+    except Exception as e:
+        db.session.rollback()
+        failed_stage = 'general'
+        etl_run.status = 'failed'
+        etl_run.error_message = str(e)
+        etl_run.completed_at = datetime.utcnow()
+        get_run_logger(etl_run, db).error('general', f'Unexpected error: {str(e)}')
+
+    try:
+        release_table_lock(db, table_name, etl_run.id)
+    except Exception as e:
+        # The lease is freed by the next run that finds this run finished
+        current_app.logger.warning(f'Could not release the lock on {table_name}: {e}')
+
+    recorder(etl_run, failed_stage)
+
+    # Compact the detailed logs of the job's runs that are past retention
+    try:
+        apply_retention(db, etl_run.job_id)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f'Log retention failed for job {etl_run.job_id}: {e}')
+
+    return etl_run.status
+
+
+def execute_pipeline_run(pipeline_run_id):
+    """Run a job and all of its upstream jobs in dependency order.
+
+    Each job is queued on the executor as soon as all of its upstream jobs
+    have finished, so independent branches run in parallel. When a job fails,
+    every job downstream of it is recorded as skipped. Must be called inside
+    an app context.
+    """
+    pipeline_run = db.session.get(PipelineRun, pipeline_run_id)
+    if pipeline_run is None or pipeline_run.status != 'queued':
+        return None
+
+    pipeline_run.status = 'running'
+    pipeline_run.started_at = datetime.utcnow()
+    try:
+        jobs, graph, levels = build_pipeline(pipeline_run.job)
+    except CycleError as e:
+        pipeline_run.status = 'failed'
+        pipeline_run.error_message = str(e)
+        pipeline_run.completed_at = datetime.utcnow()
+        db.session.commit()
+        return pipeline_run.status
+    db.session.commit()
+
+    downstream = downstream_graph(graph)
+    waiting = {job_id: set(upstream) for job_id, upstream in graph.items()}
+    ready = list(levels[0])
+    in_flight = {}  # run id -> (job id, future or None when run inline)
+    failed = skipped = 0
+
+    while ready or in_flight:
+        for job_id in ready:
+            del waiting[job_id]
+            etl_run = ETLRun(job_id=job_id, status='queued', queued_at=datetime.utcnow(),
+                             force=pipeline_run.force, trigger='pipeline', pipeline_run_id=pipeline_run.id)
+            db.session.add(etl_run)
+            db.session.commit()
+            in_flight[etl_run.id] = (job_id, executor.submit(etl_run.id))
+        ready = []
+
+        futures = [future for _, future in in_flight.values() if future is not None]
+        if len(futures) == len(in_flight):
+            wait(futures, return_when=FIRST_COMPLETED)
+
+        for run_id, (job_id, future) in list(in_flight.items()):
+            if future is not None and not future.done():
+                continue
+            del in_flight[run_id]
+            etl_run = db.session.get(ETLRun, run_id)
+            db.session.refresh(etl_run)
+            if future is not None and future.exception() is not None and etl_run.status in ETLRun.ACTIVE_STATUSES:
+                etl_run.status = 'failed'
+                etl_run.error_message = f'Worker error: {future.exception()}'
+                etl_run.completed_at = datetime.utcnow()
+
+            if etl_run.status in ('success', 'unchanged'):
+                for child in downstream[job_id]:
+                    if child in waiting:
+                        waiting[child].discard(job_id)
+                        if not waiting[child]:
+                            ready.append(child)
+            else:
+                failed += 1
+                for child in sorted(descendants(downstream, job_id) & waiting.keys()):
+                    del waiting[child]
+                    skipped += 1
+                    now = datetime.utcnow()
+                    db.session.add(ETLRun(job_id=child, status='skipped', trigger='pipeline',
+                                          pipeline_run_id=pipeline_run.id, queued_at=now,
+                                          started_at=now, completed_at=now,
+                                          error_message=f'Skipped because upstream job "{jobs[job_id].name}" failed'))
+            db.session.commit()
+
+    pipeline_run.status = 'failed' if failed else 'success'
+    if failed:
+        pipeline_run.error_message = f'{failed} job(s) failed, {skipped} skipped'
+    pipeline_run.completed_at = datetime.utcnow()
+    db.session.commit()
+    return pipeline_run.status
+
+
+_worker_app = None
+
+
+def _init_worker(config):
+    """Create a Flask app inside a pool worker process"""
+    global _worker_app
+    from app import create_app
+
+    config = dict(config, ETL_EXECUTOR='sync', ETL_SCHEDULER_ENABLED=False)
+    _worker_app = create_app(type('WorkerConfig', (), config))
+
+
+def _execute_in_worker(run_id):
+    """Execute a run in a pool worker process.
+
+    Metrics counted here would stay in the worker's own registry, so the
+    outcome is returned for the parent to record: the run's status and a
+    list holding the failed stage (None when nothing failed), empty if the
+    run did not finish.
+    """
+    outcome = []
+    with _worker_app.app_context():
+        status = execute_run(run_id, recorder=lambda etl_run, failed_stage: outcome.append(failed_stage),
+                             block=False)
+    return status, outcome
+
+
+class RunExecutor:
+    """Runs queued ETL runs on a background thread or process pool.
+
+    ``ETL_EXECUTOR`` selects the pool: ``'thread'`` (default), ``'process'``
+    or ``'sync'`` to run inline in the caller (useful for tests and scripts).
+    ``ETL_MAX_WORKERS`` caps how many runs execute in parallel.
+
+    A run whose target table is leased by another run does not wait in a
+    worker: it is deferred and tried again when a run of this executor
+    finishes, or after ``ETL_TABLE_LOCK_POLL`` seconds, so runs of other
+    jobs keep the workers. The future returned by ``submit()`` completes
+    once the run has really finished. Runs waiting in the queue are
+    heartbeated every ``ETL_HEARTBEAT_INTERVAL`` seconds, so stale-run sweeps
+    in other processes leave them alone.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.mode = 'sync'
+        self._pool = None
+        self._futures = {}  # run id -> future handed out by submit()
+        self._attempts = {}  # run id -> pool future of the attempt in progress
+        self._deferred = {}  # run id -> retry timer, for runs waiting for a table lease
+        self._pipelines = {}  # pipeline run id -> thread coordinating it
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('ETL_EXECUTOR', 'thread')
+        app.extensions['etl_executor'] = self
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                workers = self.app.config.get('ETL_MAX_WORKERS', 4)
+                if self.mode == 'process':
+                    config = {key: value for key, value in self.app.config.items() if key.isupper()}
+                    self._pool = ProcessPoolExecutor(max_workers=workers,
+                                                     initializer=_init_worker,
+                                                     initargs=(config,))
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=workers,
+                                                    thread_name_prefix='etl-run')
+                self._stopped = threading.Event()
+                threading.Thread(target=self._beat_queued, args=(self._stopped,),
+                                 name='etl-queue-heartbeat', daemon=True).start()
+            return self._pool
+
+    def _beat_queued(self, stopped):
+        """Heartbeat the runs waiting for a worker or a table lease until the pool is shut down"""
+        interval = self.app.config.get('ETL_HEARTBEAT_INTERVAL', 10)
+        while not stopped.wait(interval):
+            with self._lock:
+                waiting = [run_id for run_id in self._futures
+                           if run_id not in self._attempts or not self._attempts[run_id].running()]
+            if not waiting:
+                continue
+            try:
+                with self.app.app_context():
+                    beat_queued_runs(db.engine, waiting, interval)
+            except Exception:
+                # The database was locked by a load; the file heartbeats are written
+                pass
+
+    def _execute_in_thread(self, run_id):
+        with self.app.app_context():
+            return execute_run(run_id, block=False)
+
+    def _record_from_worker(self, run_id, outcome):
+        """Count a run finished by a worker process in this process's metrics"""
+        try:
+            with self.app.app_context():
+                for failed_stage in outcome:
+                    record_run(db.session.get(ETLRun, run_id), failed_stage)
+        except Exception as e:
+            self.app.logger.warning(f'Could not record metrics for run {run_id}: {e}')
+
+    def submit(self, run_id):
+        """Queue an ETL run for execution and return its future (None when run inline)"""
+        if self.mode == 'sync':
+            execute_run(run_id)
+            return None
+
+        future = Future()
+        with self._lock:
+            self._futures[run_id] = future
+        future.add_done_callback(lambda f: self._forget(run_id))
+        self._attempt(run_id)
+        return future
+
+    def _attempt(self, run_id):
+        """Hand a run to the pool for one attempt"""
+        if self.mode == 'process':
+            attempt = self._get_pool().submit(_execute_in_worker, run_id)
+        else:
+            attempt = self._get_pool().submit(self._execute_in_thread, run_id)
+        with self._lock:
+            self._attempts[run_id] = attempt
+        attempt.add_done_callback(lambda f: self._attempt_done(run_id, f))
+
+    def _attempt_done(self, run_id, attempt):
+        with self._lock:
+            self._attempts.pop(run_id, None)
+            future = self._futures.get(run_id)
+        if future is None:
+            return
+        if attempt.cancelled():
+            future.cancel()
+            return
+        if attempt.exception() is not None:
+            future.set_exception(attempt.exception())
+            return
+
+        status = attempt.result()
+        if self.mode == 'process':
+            status, outcome = status
+            self._record_from_worker(run_id, outcome)
+        if status == 'queued':
+            self._defer(run_id)
+            return
+        future.set_result(status)
+        # The finished run may have freed the lease deferred runs are waiting for
+        with self._lock:
+            waiting = list(self._deferred)
+        for waiting_id in waiting:
+            self._retry(waiting_id)
+
+    def _defer(self, run_id):
+        """Retry a run blocked by a table lease after ETL_TABLE_LOCK_POLL seconds"""
+        timer = threading.Timer(self.app.config.get('ETL_TABLE_LOCK_POLL', 1.0), self._retry, args=(run_id,))
+        timer.daemon = True
+        with self._lock:
+            shut_down = self._pool is None
+            if not shut_down:
+                self._deferred[run_id] = timer
+        if shut_down:
+            self._futures[run_id].cancel()
+            return
+        timer.start()
+
+    def _retry(self, run_id):
+        with self._lock:
+            timer = self._deferred.pop(run_id, None)
+        if timer is None:
+            # Already retried (by its timer or by a run that finished)
+            return
+        timer.cancel()
+        try:
+            self._attempt(run_id)
+        except RuntimeError:
+            # The pool was shut down
+            future = self._futures.get(run_id)
+            if future is not None:
+                future.cancel()
+
+    def _coordinate(self, pipeline_run_id):
+        with self._lock:
+            self._pipelines[pipeline_run_id] = threading.current_thread()
+        try:
+            return execute_pipeline_run(pipeline_run_id)
+        finally:
+            with self._lock:
+                self._pipelines.pop(pipeline_run_id, None)
+
+    def _execute_pipeline_in_thread(self, pipeline_run_id):
+        with self.app.app_context():
+            return self._coordinate(pipeline_run_id)
+
+    def submit_pipeline(self, pipeline_run_id):
+        """Start a pipeline run.
+
+        The pipeline is coordinated from its own thread, which only waits on
+        the runs it hands to the pool, so it never takes up a worker.
+        """
+        if self.mode == 'sync':
+            self._coordinate(pipeline_run_id)
+            return None
+
+        thread = threading.Thread(target=self._execute_pipeline_in_thread, args=(pipeline_run_id,),
+                                  name=f'etl-pipeline-{pipeline_run_id}', daemon=True)
+        thread.start()
+        return thread
+
+    def _forget(self, run_id):
+        with self._lock:
+            self._futures.pop(run_id, None)
+        # Left by the queue heartbeats when the run never started
+        try:
+            with self.app.app_context():
+                os.remove(heartbeat_path(run_id))
+        except OSError:
+            pass
+
+    def is_active(self, run_id):
+        """Check whether a run is queued, deferred or executing in this process"""
+        with self._lock:
+            return run_id in self._futures
+
+    def is_pipeline_active(self, pipeline_run_id):
+        """Check whether a pipeline run is being coordinated in this process"""
+        with self._lock:
+            return pipeline_run_id in self._pipelines
+
+    def queue_depth(self):
+        """Number of submitted runs waiting for a worker or for their table's lease"""
+        with self._lock:
+            return len(self._futures) - sum(1 for attempt in self._attempts.values() if attempt.running())
+
+    def in_flight(self):
+        """Number of runs currently executing"""
+        with self._lock:
+            return sum(1 for attempt in self._attempts.values() if attempt.running())
+
+    def shutdown(self, wait=True):
+        if wait:
+            # Deferred runs are still owed their attempts
+            with self._lock:
+                pending = list(self._futures.values())
+            futures_wait(pending)
+        with self._lock:
+            pool, self._pool = self._pool, None
+            deferred, self._deferred = self._deferred, {}
+        self._stopped.set()
+        for run_id, timer in deferred.items():
+            timer.cancel()
+            future = self._futures.get(run_id)
+            if future is not None:
+                future.cancel()
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+executor = RunExecutor()
@@ -0,0 +1,167 @@
+from sqlalchemy import inspect, text
+import csv
+import io
+import json
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; Parquet export is unavailable without it
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def available_formats():
+    """Export formats supported in this environment"""
+    return [name for name in EXPORT_FORMATS if name != 'parquet' or pq is not None]
+
+
+def export_filename(table_name, fmt, compress=False):
+    """Download file name for an export"""
+    return f'{table_name}.{EXPORT_FORMATS[fmt][1]}{".gz" if compress else ""}'
+
+
+def iter_row_batches(conn, table_name, batch_size):
+    """Yield the column names, then lists of up to batch_size rows.
+
+    Rows are stepped from the SQLite cursor as they are fetched, so only one
+    batch is held in memory at a time.
+    """
+    result = conn.execution_options(stream_results=True).execute(
+        text(f'SELECT * FROM "{table_name}" ORDER BY rowid'))
+    yield list(result.keys())
+    while True:
+        batch = result.fetchmany(batch_size)
+        if not batch:
+            break
+        yield batch
+
+
+def _csv_chunks(batches):
+    """Encode row batches as CSV, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(next(batches))
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(batches):
+    """Encode row batches as newline-delimited JSON objects"""
+    columns = next(batches)
+    for batch in batches:
+        lines = [json.dumps(dict(zip(columns, row)), default=str) for row in batch]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to a generator"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_type(declared_type):
+    """Arrow type for a SQLite column, following SQLite's type affinity rules"""
+    declared = str(declared_type).upper()
+    if 'BOOL' in declared:
+        return pa.bool_()
+    if 'INT' in declared:
+        return pa.int64()
+    if any(name in declared for name in ('REAL', 'FLOA', 'DOUB', 'NUMERIC', 'DECIMAL')):
+        return pa.float64()
+    return pa.string()
+
+
+def _arrow_values(values, arrow_type):
+    """Coerce SQLite values to what the Arrow column type expects"""
+    if arrow_type == pa.bool_():
+        return [None if value is None else bool(value) for value in values]
+    if arrow_type == pa.string():
+        return [None if value is None else str(value) for value in values]
+    return values
+
+
+def _parquet_chunks(batches, schema):
+    """Encode row batches as a Parquet file, writing one row group per batch"""
+    next(batches)
+    sink = _ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema) as writer:
+        for batch in batches:
+            arrays = [pa.array(_arrow_values([row[i] for row in batch], field.type), type=field.type)
+                      for i, field in enumerate(schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _gzip_chunks(chunks):
+    """Gzip a stream of byte chunks incrementally"""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_table(engine, table_name, fmt='csv', compress=False, batch_size=5000):
+    """Stream a table as CSV, NDJSON or Parquet byte chunks, optionally gzipped.
+
+    The connection is opened when the generator starts and is held until it
+    finishes, so the export reads one consistent snapshot of the table even if
+    a load replaces it meanwhile. Raises ValueError for an unsupported format.
+    """
+    if fmt not in available_formats():
+        raise ValueError(f'Unsupported export format: {fmt}')
+
+    def generate():
+        with engine.connect() as conn:
+            batches = iter_row_batches(conn, table_name, batch_size)
+            if fmt == 'csv':
+                chunks = _csv_chunks(batches)
+            elif fmt == 'ndjson':
+                chunks = _ndjson_chunks(batches)
+            else:
+                schema = pa.schema([(column['name'], _arrow_type(column['type']))
+                                    for column in inspect(conn).get_columns(table_name)])
+                chunks = _parquet_chunks(batches, schema)
+            if compress:
+                chunks = _gzip_chunks(chunks)
+            for chunk in chunks:
+                if chunk:
+                    yield chunk
+
+    return generate()
@@ -2,195 +2,312 @@ import pandas as pd
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
-from app.models import ETLLog
-from datetime import datetime
+from app.etl.errors import StageError
+from app.etl.runlog import get_run_logger
+from app.etl.pagination import PageFetcher, iter_pages
+from app.etl.http_cache import (SOURCE_UNCHANGED, conditional_headers, remember_response,
+                                remember_validators, load_cached_body, cache_chunks,
+                                iter_cached_body)
+from app.etl.json_stream import JSONRecordStream, iter_record_batches
+from app.etl.fingerprint import file_content_hash
+from app.etl.frame_cache import load_cached_frame, store_frame
+from flask import current_app
+import json
 import time
 
-def extract_from_csv(file_path, etl_run, db):
-    """Extract data from a CSV file"""
+def extract_from_csv(file_path, etl_run, db, data_source=None):
+    """Extract data from a CSV file.
+
+    When a data source is given, the parsed DataFrame is cached by the
+    file's content hash and later runs read the cache instead of the CSV.
+    """
+    log = get_run_logger(etl_run, db)
     try:
         # Log extraction start
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message=f'Starting CSV extraction from {file_path}',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.info('extract', f'Starting CSV extraction from {file_path}')
+        
+        df = None
+        content_hash = file_content_hash(data_source) if data_source else None
+        if content_hash:
+            df = load_cached_frame(content_hash)
+            if df is not None:
+                log.info('extract', 'Loaded parsed data from cache')
         
-        # Read CSV file
-        df = pd.read_csv(file_path)
+        if df is None:
+            # Read CSV file
+            df = pd.read_csv(file_path)
+            if content_hash:
+                try:
+                    store_frame(content_hash, df)
+                except Exception as e:
+                    log.warning('extract', f'Could not cache parsed data: {str(e)}')
         row_count = len(df)
         
         # Log success
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message=f'Successfully extracted {row_count} rows from CSV',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
+        log.info('extract', f'Successfully extracted {row_count} rows from CSV')
         etl_run.rows_extracted = row_count
-        db.session.commit()
         
         return df, None
     
     except Exception as e:
         error_msg = f'CSV extraction failed: {str(e)}'
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message=error_msg,
-            log_level='error',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.error('extract', error_msg)
         return None, error_msg
 
 
-def extract_from_api(api_url, api_format, etl_run, db):
-    """Extract data from an API endpoint with retry logic"""
+def extract_csv_chunks(file_path, chunk_size, etl_run, db):
+    """Extract a CSV file as a stream of DataFrame chunks of at most chunk_size rows"""
+    log = get_run_logger(etl_run, db)
+    log.info('extract', f'Starting streaming CSV extraction from {file_path} ({chunk_size} rows per chunk)')
+
+    chunk_count = 0
+    try:
+        for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+            chunk_count += 1
+            etl_run.rows_extracted = (etl_run.rows_extracted or 0) + len(chunk)
+            yield chunk
+    except Exception as e:
+        raise StageError('extract', f'CSV extraction failed: {str(e)}')
+
+    log.info('extract', f'Successfully extracted {etl_run.rows_extracted} rows from CSV in {chunk_count} chunks')
+
+
+def create_http_session(retry_rate_limits=True, pool_size=10):
+    """Create a requests session with retry strategy.
+
+    With retry_rate_limits=False, 429 responses are returned to the caller
+    instead of being retried per request.
+    """
+    session = requests.Session()
+    status_forcelist = [500, 502, 503, 504]
+    if retry_rate_limits:
+        status_forcelist.insert(0, 429)
+    retry_strategy = Retry(
+        total=3,  # Total number of retries
+        backoff_factor=1,  # Wait 1, 2, 4 seconds between retries
+        status_forcelist=status_forcelist,  # Retry on these HTTP status codes
+        allowed_methods=["GET"],  # Only retry GET requests
+        respect_retry_after_header=retry_rate_limits
+    )
+    adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def extract_from_api(api_url, api_format, etl_run, db, data_source=None, replay=False):
+    """Extract data from an API endpoint with retry logic.
+
+    When a data_source is given its stored ETag / Last-Modified validators are
+    sent with the request. A 304 response returns SOURCE_UNCHANGED, unless
+    replay is set, in which case the cached copy of the last body is parsed.
+    """
+    log = get_run_logger(etl_run, db)
     try:
         # Log extraction start
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message=f'Starting API extraction from {api_url}',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.info('extract', f'Starting API extraction from {api_url}')
         
         # Setup session with retry strategy
-        session = requests.Session()
-        retry_strategy = Retry(
-            total=3,  # Total number of retries
-            backoff_factor=1,  # Wait 1, 2, 4 seconds between retries
-            status_forcelist=[429, 500, 502, 503, 504],  # Retry on these HTTP status codes
-            allowed_methods=["GET"]  # Only retry GET requests
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
+        session = create_http_session()
         
         # Log retry attempt
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message='Attempting API request with retry strategy (3 retries, 10s timeout)',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.info('extract', 'Attempting API request with retry strategy (3 retries, 10s timeout)')
+        
+        # Send stored validators so an unchanged source can answer 304
+        headers = conditional_headers(data_source) if data_source else {}
         
         # Fetch data from API with reduced timeout
-        response = session.get(api_url, timeout=10)
-        response.raise_for_status()
+        response = session.get(api_url, timeout=10, headers=headers)
+        
+        body = None
+        if response.status_code == 304:
+            if not replay:
+                log.info('extract', 'Source unchanged since last run (HTTP 304 Not Modified); skipping transform and load')
+                return SOURCE_UNCHANGED, None
+            
+            body = load_cached_body(data_source)
+            if body is None:
+                log.info('extract', 'Source unchanged (HTTP 304) but no cached copy to replay; downloading it again')
+                response = session.get(api_url, timeout=10)
+            else:
+                log.info('extract', 'Source unchanged (HTTP 304 Not Modified); replaying cached copy of last response')
+        
+        if body is None:
+            response.raise_for_status()
+            body = response.text
+            if data_source is not None:
+                remember_response(data_source, response)
         
         # Parse based on format
         if api_format == 'json':
-            data = response.json()
+            data = json.loads(body)
             
             # If single dict is returned (not a list), wrap it in a list
             if isinstance(data, dict) and not any(isinstance(v, list) for v in data.values()):
                 # Check if it's a single record (not containing array fields)
                 data = [data]
-                log = ETLLog(
-                    etl_run_id=etl_run.id,
-                    stage='extract',
-                    message='API returned single object, converted to list with 1 record',
-                    log_level='info',
-                    timestamp=datetime.utcnow()
-                )
-                db.session.add(log)
-                db.session.commit()
+                log.info('extract', 'API returned single object, converted to list with 1 record')
             elif isinstance(data, dict):
                 # Try common keys for data arrays
                 for key in ['data', 'results', 'items', 'records']:
                     if key in data and isinstance(data[key], list):
                         data = data[key]
-                        log = ETLLog(
-                            etl_run_id=etl_run.id,
-                            stage='extract',
-                            message=f'Extracted data from "{key}" field in response',
-                            log_level='info',
-                            timestamp=datetime.utcnow()
-                        )
-                        db.session.add(log)
-                        db.session.commit()
+                        log.info('extract', f'Extracted data from "{key}" field in response')
                         break
             
             df = pd.DataFrame(data)
         elif api_format == 'csv':
             from io import StringIO
-            df = pd.read_csv(StringIO(response.text))
+            df = pd.read_csv(StringIO(body))
         else:
             raise ValueError(f'Unsupported API format: {api_format}')
         
         row_count = len(df)
         
         # Log success
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message=f'Successfully extracted {row_count} rows from API',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
+        log.info('extract', f'Successfully extracted {row_count} rows from API')
         etl_run.rows_extracted = row_count
-        db.session.commit()
         
         return df, None
     
     except requests.RequestException as e:
         error_msg = f'API request failed: {str(e)}'
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message=error_msg,
-            log_level='error',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.error('extract', error_msg)
         return None, error_msg
     
     except Exception as e:
         error_msg = f'API extraction failed: {str(e)}'
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message=error_msg,
-            log_level='error',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.error('extract', error_msg)
+        return None, error_msg
+
+
+def extract_api_chunks(data_source, chunk_size, etl_run, db, replay=False):
+    """Extract a JSON API response as a stream of DataFrame chunks of at most chunk_size rows.
+
+    The request is sent straight away so that a 304 is known before the load
+    starts: SOURCE_UNCHANGED is returned then (unless replay is set).
+    Otherwise the body is parsed incrementally while it downloads.
+    """
+    log = get_run_logger(etl_run, db)
+    api_url = data_source.api_url
+    log.info('extract', f'Starting streaming API extraction from {api_url} ({chunk_size} rows per chunk)')
+
+    try:
+        session = create_http_session()
+        response = session.get(api_url, timeout=10, headers=conditional_headers(data_source), stream=True)
+
+        body = None
+        if response.status_code == 304:
+            response.close()
+            if not replay:
+                log.info('extract', 'Source unchanged since last run (HTTP 304 Not Modified); skipping transform and load')
+                return SOURCE_UNCHANGED
+
+            body = iter_cached_body(data_source)
+            if body is None:
+                log.info('extract', 'Source unchanged (HTTP 304) but no cached copy to replay; downloading it again')
+                response = session.get(api_url, timeout=10, stream=True)
+            else:
+                log.info('extract', 'Source unchanged (HTTP 304 Not Modified); replaying cached copy of last response')
+
+        if body is None:
+            response.raise_for_status()
+            remember_validators(data_source, response)
+            body = cache_chunks(data_source, response.iter_content(chunk_size=64 * 1024))
+    except requests.RequestException as e:
+        raise StageError('extract', f'API request failed: {str(e)}')
+
+    return _json_record_chunks(body, chunk_size, etl_run, db)
+
+
+def _json_record_chunks(body, chunk_size, etl_run, db):
+    """Parse JSON body bytes into DataFrame chunks with the columns of the first chunk"""
+    log = get_run_logger(etl_run, db)
+    records = JSONRecordStream(body)
+
+    columns = None
+    chunk_count = 0
+    try:
+        for batch in iter_record_batches(records, chunk_size):
+            chunk = pd.DataFrame(batch)
+            if columns is None:
+                columns = chunk.columns
+                if records.record_key:
+                    log.info('extract', f'Extracted data from "{records.record_key}" field in response')
+            else:
+                # The target table is created from the first chunk
+                extra = chunk.columns.difference(columns)
+                if len(extra):
+                    log.warning('extract', f'Dropping fields not present in the first chunk: {", ".join(map(str, extra))}')
+                chunk = chunk.reindex(columns=columns)
+
+            chunk_count += 1
+            etl_run.rows_extracted = (etl_run.rows_extracted or 0) + len(chunk)
+            yield chunk
+    except requests.RequestException as e:
+        raise StageError('extract', f'API request failed: {str(e)}')
+    except Exception as e:
+        raise StageError('extract', f'API extraction failed: {str(e)}')
+
+    log.info('extract', f'Successfully extracted {etl_run.rows_extracted} rows from API in {chunk_count} chunks')
+
+
+def extract_from_paginated_api(data_source, etl_run, db):
+    """Extract every page of a paginated JSON API into a single DataFrame"""
+    log = get_run_logger(etl_run, db)
+    try:
+        concurrency = current_app.config.get('ETL_API_CONCURRENCY', 4)
+        log.info('extract', f'Starting paginated API extraction from {data_source.api_url} '
+                            f'({data_source.pagination_type} pagination)')
+        if data_source.pagination_type in ('offset', 'page'):
+            log.info('extract', f'Fetching pages with up to {concurrency} concurrent requests')
+
+        # 429 responses are handled by PageFetcher so all page workers back off together
+        session = create_http_session(retry_rate_limits=False, pool_size=concurrency)
+        fetcher = PageFetcher(session)
+
+        records = []
+        page_count = 0
+        for page in iter_pages(fetcher, data_source, concurrency=concurrency,
+                               max_pages=current_app.config.get('ETL_API_MAX_PAGES', 1000)):
+            page_count += 1
+            records.extend(page)
+
+        if fetcher.rate_limited:
+            log.warning('extract', f'API rate limited {fetcher.rate_limited} request(s); backed off and retried')
+        if fetcher.page_limit_reached:
+            log.warning('extract', f'Stopped at the limit of {page_count} pages; the API has more records '
+                                   f'that were not loaded (raise the source\'s max_pages)')
+
+        df = pd.DataFrame(records)
+        row_count = len(df)
+
+        log.info('extract', f'Successfully extracted {row_count} rows from API across {page_count} pages')
+        etl_run.rows_extracted = row_count
+
+        return df, None
+
+    except requests.RequestException as e:
+        error_msg = f'API request failed: {str(e)}'
+        log.error('extract', error_msg)
+        return None, error_msg
+
+    except Exception as e:
+        error_msg = f'API extraction failed: {str(e)}'
+        log.error('extract', error_msg)
         return None, error_msg
 
 
-def extract_data(data_source, etl_run, db):
+def extract_data(data_source, etl_run, db, replay=False):
     """Main extraction function that routes to the appropriate extractor"""
     if data_source.source_type == 'csv':
-        return extract_from_csv(data_source.file_path, etl_run, db)
+        return extract_from_csv(data_source.file_path, etl_run, db, data_source=data_source)
+    elif data_source.source_type == 'api' and data_source.pagination_type:
+        return extract_from_paginated_api(data_source, etl_run, db)
     elif data_source.source_type == 'api':
-        return extract_from_api(data_source.api_url, data_source.api_format, etl_run, db)
+        return extract_from_api(data_source.api_url, data_source.api_format, etl_run, db,
+                                data_source=data_source, replay=replay)
     else:
         error_msg = f'Unknown source type: {data_source.source_type}'
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='extract',
-            message=error_msg,
-            log_level='error',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        get_run_logger(etl_run, db).error('extract', error_msg)
         return None, error_msg
@@ -0,0 +1,38 @@
+import hashlib
+import os
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_content_hash(data_source):
+    """Return the SHA-256 of a CSV source, rehashing only when the file changed.
+
+    The file size and mtime are compared with the values stored on the data
+    source first; the file is only streamed through the hash when they differ.
+    """
+    stat = os.stat(data_source.file_path)
+    if (data_source.content_hash and data_source.file_size == stat.st_size
+            and data_source.file_mtime == stat.st_mtime):
+        return data_source.content_hash
+
+    digest = hashlib.sha256()
+    with open(data_source.file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+
+    data_source.file_size = stat.st_size
+    data_source.file_mtime = stat.st_mtime
+    data_source.content_hash = digest.hexdigest()
+    return data_source.content_hash
+
+
+def job_config_signature(job):
+    """Settings of a job that change what ends up in its target table"""
+    return (f'table={job.table_name};mode={job.load_mode};keys={job.key_columns or ""};'
+            f'indexes={job.index_specs or ""}')
+
+
+def source_fingerprint(job):
+    """Fingerprint of a job's CSV input combined with its configuration"""
+    content_hash = file_content_hash(job.data_source)
+    return hashlib.sha256(f'{content_hash}|{job_config_signature(job)}'.encode('utf-8')).hexdigest()
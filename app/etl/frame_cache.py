@@ -0,0 +1,93 @@
+from flask import current_app
+import pandas as pd
+import os
+import tempfile
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow is optional; fall back to pickled DataFrames
+    feather = None
+
+
+def cache_folder():
+    """Folder holding parsed copies of uploaded files"""
+    return current_app.config.get('ETL_FRAME_CACHE_FOLDER') or \
+        os.path.join(current_app.config['UPLOAD_FOLDER'], 'frame_cache')
+
+
+def frame_cache_path(content_hash):
+    """Path of the cached DataFrame for a file with the given content hash"""
+    extension = 'feather' if feather else 'pkl'
+    return os.path.join(cache_folder(), f'{content_hash}.{extension}')
+
+
+def load_cached_frame(content_hash):
+    """Return the cached DataFrame for a content hash, or None on a miss.
+
+    Feather files are memory-mapped, so only the columns that are used
+    are read from disk.
+    """
+    path = frame_cache_path(content_hash)
+    if not os.path.exists(path):
+        return None
+
+    # Reading an entry makes it the most recently used one
+    os.utime(path)
+    if feather:
+        return feather.read_feather(path, memory_map=True)
+    return pd.read_pickle(path)
+
+
+def store_frame(content_hash, df):
+    """Write a parsed DataFrame to the cache, then evict old entries over the size cap.
+
+    Each writer uses its own temporary file, so runs caching the same upload
+    at once cannot interleave their writes before the rename.
+    """
+    path = frame_cache_path(content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=f'{os.path.basename(path)}.',
+                                     suffix='.tmp', delete=False) as tmp:
+        tmp_path = tmp.name
+    try:
+        if feather:
+            feather.write_feather(df, tmp_path)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    evict_frames(current_app.config.get('ETL_FRAME_CACHE_MAX_BYTES'))
+
+
+def evict_frames(max_bytes):
+    """Delete least recently used cache entries until the cache fits in max_bytes"""
+    folder = cache_folder()
+    if not max_bytes or not os.path.isdir(folder):
+        return
+
+    entries = []
+    for entry in os.scandir(folder):
+        if entry.is_file() and not entry.name.endswith('.tmp'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def delete_cached_frame(content_hash):
+    """Remove the cached DataFrame for a content hash from disk"""
+    path = frame_cache_path(content_hash)
+    if os.path.exists(path):
+        os.remove(path)
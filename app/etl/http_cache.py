@@ -0,0 +1,116 @@
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.orm.attributes import set_committed_value
+import gzip
+import os
+
+from app.models import DataSource
+
+# Returned by the extractor in place of a DataFrame when the API answered 304
+SOURCE_UNCHANGED = object()
+
+
+def conditional_headers(data_source):
+    """Build If-None-Match / If-Modified-Since headers from the stored validators"""
+    headers = {}
+    if data_source.etag:
+        headers['If-None-Match'] = data_source.etag
+    if data_source.last_modified:
+        headers['If-Modified-Since'] = data_source.last_modified
+    return headers
+
+
+def body_cache_path(data_source):
+    """Path of the compressed copy of the last response body for a data source"""
+    folder = current_app.config.get('ETL_API_CACHE_FOLDER') or \
+        os.path.join(current_app.config['UPLOAD_FOLDER'], 'api_cache')
+    return os.path.join(folder, f'source_{data_source.id}.gz')
+
+
+def remember_validators(data_source, response):
+    """Keep the ETag / Last-Modified headers of a response until its data is loaded.
+
+    They are only written by save_validators, in the load's own transaction,
+    so a run that fails, is cancelled or dies before its load commits does
+    not make the next run skip a source it never loaded.
+    """
+    data_source._pending_validators = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+
+def save_validators(conn, data_source):
+    """Write the validators kept by remember_validators, inside the caller's transaction"""
+    pending = getattr(data_source, '_pending_validators', None)
+    if pending is None:
+        return
+    etag, last_modified = pending
+    conn.execute(update(DataSource).where(DataSource.id == data_source.id)
+                 .values(etag=etag, last_modified=last_modified))
+    # Already written; the session must not flush them again
+    set_committed_value(data_source, 'etag', etag)
+    set_committed_value(data_source, 'last_modified', last_modified)
+    data_source._pending_validators = None
+
+
+def remember_response(data_source, response):
+    """Keep the response validators and, if enabled, store a gzip copy of the body"""
+    remember_validators(data_source, response)
+
+    if data_source.cache_body:
+        path = body_cache_path(data_source)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+            f.write(response.text.encode('utf-8'))
+        os.replace(tmp_path, path)
+
+
+def load_cached_body(data_source):
+    """Return the cached response body as text, or None if there is no copy"""
+    path = body_cache_path(data_source)
+    if not data_source.cache_body or not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rb') as f:
+        return f.read().decode('utf-8')
+
+
+def cache_chunks(data_source, chunks):
+    """Pass body chunks through while writing a gzip copy of them, if enabled.
+
+    The copy only replaces the previous one once the whole body has been read.
+    """
+    if not data_source.cache_body:
+        yield from chunks
+        return
+
+    path = body_cache_path(data_source)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    try:
+        with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def iter_cached_body(data_source, chunk_size=64 * 1024):
+    """Return an iterator over the cached response body bytes, or None if there is no copy"""
+    path = body_cache_path(data_source)
+    if not data_source.cache_body or not os.path.exists(path):
+        return None
+
+    def read_chunks():
+        with gzip.open(path, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+    return read_chunks()
+
+
+def delete_cached_body(data_source):
+    """Remove the cached response body from disk"""
+    path = body_cache_path(data_source)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,124 @@
+from sqlalchemy import inspect, text
+import time
+
+from app.etl.transform import clean_column_name
+
+
+def parse_index_specs(specs):
+    """Parse index specs such as 'city; last_name, first_name; unique: email'.
+
+    Indexes are separated by semicolons (or new lines) and their columns by
+    commas. A 'unique:' prefix makes a unique index. Column names are cleaned
+    the same way as in the transform stage. Returns a list of
+    (columns, unique) tuples.
+    """
+    parsed = []
+    for spec in (specs or '').replace('\n', ';').split(';'):
+        spec = spec.strip()
+        unique = spec.lower().startswith('unique:')
+        if unique:
+            spec = spec[len('unique:'):]
+        columns = tuple(clean_column_name(column) for column in spec.split(',') if column.strip())
+        if columns and (columns, unique) not in parsed:
+            parsed.append((columns, unique))
+    return parsed
+
+
+def format_index_specs(specs):
+    """Format parsed index specs back into their text form"""
+    return '; '.join(('unique: ' if unique else '') + ', '.join(columns) for columns, unique in specs)
+
+
+def index_name(table_name, columns, unique=False):
+    """Name of the index declared on table_name for the given columns"""
+    return f'{"ux" if unique else "ix"}_{table_name}__{"__".join(columns)}'
+
+
+def merge_index_name(table_name, key_columns):
+    """Name of the unique index merge loads of table_name upsert against"""
+    return f'uq_{table_name}__{"__".join(key_columns)}'
+
+
+def _indexes_named(conn, table_name, prefixes):
+    """Names of the indexes that currently exist on a table and start with one of prefixes"""
+    return [index['name'] for index in inspect(conn).get_indexes(table_name)
+            if index['name'] and index['name'].startswith(prefixes)]
+
+
+def managed_indexes(conn, table_name):
+    """Names of the declared indexes that currently exist on a table"""
+    return _indexes_named(conn, table_name, (f'ix_{table_name}__', f'ux_{table_name}__'))
+
+
+def merge_indexes(conn, table_name):
+    """Names of the merge key indexes that currently exist on a table"""
+    # uq_<table>_key is the name used before the index was named after its key columns
+    return _indexes_named(conn, table_name, (f'uq_{table_name}__', f'uq_{table_name}_key'))
+
+
+def drop_indexes(conn, table_name):
+    """Drop the declared and merge key indexes of a table"""
+    from app.etl.load import quote_identifier
+
+    for name in managed_indexes(conn, table_name) + merge_indexes(conn, table_name):
+        conn.execute(text(f'DROP INDEX IF EXISTS {quote_identifier(name)}'))
+
+
+def ensure_merge_index(conn, table_name, key_columns):
+    """Create the unique index on key_columns that merge loads upsert against.
+
+    The live table's own indexes are checked rather than relying on
+    IF NOT EXISTS, as index names are shared by the whole database: a table
+    retired by a replace load may still hold one, and an index on earlier key
+    columns has to make way for the current ones.
+    """
+    from app.etl.load import quote_identifier
+
+    name = merge_index_name(table_name, key_columns)
+    existing = merge_indexes(conn, table_name)
+    for other in existing:
+        if other != name:
+            conn.execute(text(f'DROP INDEX IF EXISTS {quote_identifier(other)}'))
+    if name not in existing:
+        conn.execute(text(f'DROP INDEX IF EXISTS {quote_identifier(name)}'))
+        column_list = ', '.join(quote_identifier(column) for column in key_columns)
+        conn.execute(text(f'CREATE UNIQUE INDEX {quote_identifier(name)} '
+                          f'ON {quote_identifier(table_name)} ({column_list})'))
+
+
+def sync_indexes(conn, table_name, specs, log):
+    """Create the declared indexes of a table and drop ones no longer declared.
+
+    Runs inside the caller's transaction once the rows have been written, so
+    the indexes are built in one pass instead of being maintained row by row.
+    """
+    from app.etl.load import quote_identifier
+
+    specs = parse_index_specs(specs)
+    existing = set(managed_indexes(conn, table_name))
+    if not specs and not existing:
+        return
+
+    started = time.perf_counter()
+    columns_present = {column['name'] for column in inspect(conn).get_columns(table_name)}
+    wanted = set()
+    built = 0
+    for columns, unique in specs:
+        missing = [column for column in columns if column not in columns_present]
+        if missing:
+            log.warning('load', f'Skipping index on ({", ".join(columns)}): '
+                                f'column not found: {", ".join(missing)}')
+            continue
+        name = index_name(table_name, columns, unique)
+        wanted.add(name)
+        if name not in existing:
+            column_list = ', '.join(quote_identifier(column) for column in columns)
+            conn.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX {quote_identifier(name)} '
+                              f'ON {quote_identifier(table_name)} ({column_list})'))
+            built += 1
+
+    for name in existing - wanted:
+        conn.execute(text(f'DROP INDEX IF EXISTS {quote_identifier(name)}'))
+
+    log.info('load', f'Built {built} indexes on {table_name} in {time.perf_counter() - started:.2f}s '
+                     f'({len(wanted)} declared)')
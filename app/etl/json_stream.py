@@ -0,0 +1,170 @@
+import codecs
+import json
+import tempfile
+
+from app.etl.pagination import RECORD_KEYS, find_records
+
+WHITESPACE = ' \t\n\r'
+
+
+class JSONRecordStream:
+    """Incrementally parse the records array of a JSON document.
+
+    Bytes are pulled from ``chunks`` (e.g. ``response.iter_content()``) only
+    as needed, and each record is decoded as soon as it is complete, so the
+    document never has to be held in memory. The records are taken from a
+    top-level array or from an array under one of ``RECORD_KEYS`` in a
+    top-level object, preferring the keys in that order as ``find_records``
+    does. An array under the first key is streamed at once. One under a
+    later key is spooled to a temporary file until the end of the object
+    shows no preferred key follows. An object without such an array is
+    treated the way ``find_records`` treats it.
+    """
+
+    def __init__(self, chunks, record_keys=RECORD_KEYS):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._exhausted = False
+        self.record_keys = record_keys
+        self.record_key = None  # Key the records array was found under
+
+    def _read_more(self):
+        """Append the next chunk to the buffer; return False at end of stream"""
+        if self._exhausted:
+            return False
+        # Drop the consumed part of the buffer before growing it
+        self._buffer = self._buffer[self._pos:]
+        self._pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                self._buffer += text
+                return True
+        self._buffer += self._decoder.decode(b'', final=True)
+        self._exhausted = True
+        return False
+
+    def _peek(self):
+        """Return the next non-whitespace character without consuming it ('' at end)"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_more():
+                return ''
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char == '' or char not in chars:
+            raise ValueError(f'Invalid JSON: expected {" or ".join(chars)} at offset {self._pos}, '
+                             f'got {char!r}')
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """Decode one complete JSON value, reading more data until it is available"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self._buffer) or self._exhausted:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._exhausted:
+                    raise
+            self._read_more()
+
+    def _array_items(self):
+        """Yield the items of the array starting at the current position"""
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def _drain(self):
+        """Read the rest of the document so wrapped chunk iterators run to completion"""
+        for _ in self._chunks:
+            pass
+        self._exhausted = True
+
+    def __iter__(self):
+        yield from self._records()
+        self._drain()
+
+    def _records(self):
+        char = self._peek()
+        if char == '[':
+            yield from self._array_items()
+            return
+        if char != '{':
+            yield from find_records(self._value())[0]
+            return
+
+        # Walk the top-level object for the records array of the most preferred key
+        self._expect('{')
+        skipped = {}
+        spool = None
+        try:
+            if self._peek() != '}':
+                while True:
+                    key = self._value()
+                    self._expect(':')
+                    if key in self.record_keys and self._peek() == '[':
+                        rank = self.record_keys.index(key)
+                        if rank == 0:
+                            self.record_key = key
+                            yield from self._array_items()
+                            return
+                        if self.record_key is None or rank < self.record_keys.index(self.record_key):
+                            spool = self._spool_array(spool)
+                            self.record_key = key
+                        else:
+                            for _ in self._array_items():
+                                pass
+                    else:
+                        skipped[key] = self._value()
+                    if self._expect(',}') == '}':
+                        break
+            else:
+                self._pos += 1
+
+            if spool is None:
+                yield from find_records(skipped)[0]
+                return
+            spool.seek(0)
+            for line in spool:
+                yield json.loads(line)
+        finally:
+            if spool is not None:
+                spool.close()
+
+    def _spool_array(self, spool):
+        """Write the items of the array at the current position to a new temporary file, one per line"""
+        if spool is not None:
+            spool.close()
+        spool = tempfile.TemporaryFile('w+', encoding='utf-8')
+        for item in self._array_items():
+            spool.write(json.dumps(item) + '\n')
+        return spool
+
+
+def iter_record_batches(records, batch_size):
+    """Group an iterable of records into lists of at most batch_size records"""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -1,100 +1,454 @@
 import pandas as pd
-from sqlalchemy import create_engine, inspect, text
-from app.models import ETLLog
-from datetime import datetime
+from sqlalchemy import Column, MetaData, Table, inspect, text
+from app.etl.errors import StageError
+from app.etl.runlog import get_run_logger
+from app.etl.indexes import sync_indexes, drop_indexes, ensure_merge_index
+from app.etl.control import check_cancelled
+from app.etl.http_cache import save_validators
 from flask import current_app
+import threading
+import time
 
-def load_data(df, table_name, etl_run, db, load_mode='replace'):
-    """Load transformed data into SQLite database"""
+def table_exists(db, table_name):
+    """Check whether a table exists in the application database"""
+    return bool(table_name) and inspect(db.engine).has_table(table_name)
+
+
+def quote_identifier(name):
+    """Quote a table or column name for use in SQL"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def begin_write(conn):
+    """Open the write transaction on a connection explicitly.
+
+    pysqlite only begins a transaction before DML, so a DROP or CREATE TABLE
+    would otherwise be committed on its own. BEGIN IMMEDIATE also takes the
+    write lock up front, so a competing writer waits for the busy timeout
+    before any work is done instead of failing half way through.
+    """
+    if conn.dialect.name == 'sqlite' and not conn.connection.driver_connection.in_transaction:
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def create_table(conn, df, table_name):
+    """Create the table for a DataFrame's columns and dtypes if it does not exist"""
+    df.head(0).to_sql(table_name, conn, if_exists='append', index=False)
+
+
+def copy_table_schema(conn, table_name, new_name):
+    """Create an empty table new_name with the columns and column types of table_name"""
+    source = Table(table_name, MetaData(), autoload_with=conn)
+    Table(new_name, MetaData(), *(Column(column.name, column.type) for column in source.columns)).create(conn)
+
+
+def staging_table_name(table_name):
+    """Name of the table a replace load writes to before it is swapped in"""
+    return f'{table_name}__staging'
+
+
+def swap_in_staging(conn, table_name, run_id):
+    """Swap the staging table in for table_name, inside the caller's transaction.
+
+    The current table is renamed out of the way rather than dropped, so the
+    swap only touches the schema (and the old table's declared and merge key
+    indexes, which are dropped so the new table can reuse their names). Without a staging
+    table nothing is swapped. Returns the name the old table was renamed
+    to, or None if no table was retired.
+    """
+    inspector = inspect(conn)
+    staging = staging_table_name(table_name)
+    if not inspector.has_table(staging):
+        return None
+    retired = None
+    if inspector.has_table(table_name):
+        retired = f'{table_name}__old_{run_id}'
+        # Index names stay with a renamed table; free them for the new table
+        drop_indexes(conn, table_name)
+        conn.execute(text(f'ALTER TABLE {quote_identifier(table_name)} RENAME TO {quote_identifier(retired)}'))
+    conn.execute(text(f'ALTER TABLE {quote_identifier(staging)} RENAME TO {quote_identifier(table_name)}'))
+    return retired
+
+
+def drop_retired_tables(db, table_name):
+    """Drop the tables retired by replace loads of table_name on a background thread.
+
+    Dropping a large table is slow and holds the write lock, so it happens
+    after the swap has been committed. Tables left behind by an interrupted
+    drop are picked up by the next one.
+    """
+    app = current_app._get_current_object()
+    prefix = f'{table_name}__old_'
+
+    def drop():
+        with app.app_context():
+            try:
+                with db.engine.connect() as conn:
+                    for name in inspect(conn).get_table_names():
+                        if name.startswith(prefix):
+                            begin_write(conn)
+                            conn.execute(text(f'DROP TABLE IF EXISTS {quote_identifier(name)}'))
+                            conn.commit()
+            except Exception as e:
+                app.logger.warning(f'Could not drop retired tables of {table_name}: {e}')
+
+    thread = threading.Thread(target=drop, name='etl-drop-table', daemon=True)
+    thread.start()
+    return thread
+
+
+def _row_values(df):
+    """Rows of a DataFrame as tuples of plain Python values, with NaN/NaT as None"""
+    columns = []
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            # Same text format SQLAlchemy uses for SQLite DATETIME columns
+            column = column.dt.strftime('%Y-%m-%d %H:%M:%S.%f')
+        if column.isna().any():
+            column = column.astype(object).where(column.notna(), None)
+        columns.append(column.tolist())
+    return list(zip(*columns))
+
+
+def bulk_insert(conn, df, table_name, batch_size=None, fast_path=None):
+    """Insert a DataFrame with prepared executemany calls of batch_size rows.
+
+    With the SQLite fast path the batches go straight to the DBAPI cursor,
+    skipping SQLAlchemy's per-row parameter processing. Returns the number of
+    rows inserted. The caller owns the transaction.
+    """
+    if batch_size is None:
+        batch_size = current_app.config.get('ETL_LOAD_BATCH_SIZE', 10000)
+    if fast_path is None:
+        fast_path = current_app.config.get('ETL_LOAD_FAST_PATH', True)
+
+    columns = ', '.join(quote_identifier(column) for column in df.columns)
+    if fast_path and conn.dialect.name == 'sqlite':
+        cursor = conn.connection.driver_connection.cursor()
+        sql = f'INSERT INTO {quote_identifier(table_name)} ({columns}) VALUES ({", ".join("?" * len(df.columns))})'
+        try:
+            for start in range(0, len(df), batch_size):
+                cursor.executemany(sql, _row_values(df.iloc[start:start + batch_size]))
+        finally:
+            cursor.close()
+    else:
+        keys = [f'c{i}' for i in range(len(df.columns))]
+        statement = text(f'INSERT INTO {quote_identifier(table_name)} ({columns}) '
+                         f'VALUES ({", ".join(":" + key for key in keys)})')
+        for start in range(0, len(df), batch_size):
+            rows = _row_values(df.iloc[start:start + batch_size])
+            conn.execute(statement, [dict(zip(keys, row)) for row in rows])
+
+    return len(df)
+
+
+def merge_rows(conn, df, table_name, key_columns):
+    """Upsert a DataFrame into table_name on key_columns, inside the caller's transaction.
+
+    The rows are bulk-inserted into a temporary table first and then merged
+    with merge_table. Returns (inserted, updated, unchanged).
+    """
+    missing = [column for column in key_columns if column not in df.columns]
+    if missing:
+        raise ValueError(f'Key columns not found in data: {", ".join(missing)}')
+
+    create_table(conn, df, table_name)
+    batch = f'_merge_{table_name}'
+    conn.execute(text(f'DROP TABLE IF EXISTS temp.{quote_identifier(batch)}'))
+    conn.execute(text(f'CREATE TEMP TABLE {quote_identifier(batch)} AS SELECT * FROM {quote_identifier(table_name)} WHERE 0'))
+    try:
+        bulk_insert(conn, df, batch)
+        return merge_table(conn, batch, table_name, key_columns, df.columns)
+    finally:
+        conn.execute(text(f'DROP TABLE IF EXISTS temp.{quote_identifier(batch)}'))
+
+
+def merge_table(conn, source, table_name, key_columns, columns):
+    """Upsert the rows of table source into table_name on key_columns, inside the caller's transaction.
+
+    The rows are compared with the target to count new, changed and
+    unchanged rows, and applied with one INSERT ... ON CONFLICT DO UPDATE.
+    Unchanged rows are not rewritten. source must hold each key at most
+    once. Returns (inserted, updated, unchanged).
+    """
+    table = quote_identifier(table_name)
+    batch = quote_identifier(source)
+    keys = [quote_identifier(column) for column in key_columns]
+    ensure_merge_index(conn, table_name, key_columns)
+
+    columns = [quote_identifier(column) for column in columns]
+    on_keys = ' AND '.join(f't.{key} = b.{key}' for key in keys)
+    same_values = ' AND '.join(f't.{column} IS b.{column}' for column in columns)
+    total = conn.execute(text(f'SELECT COUNT(*) FROM {batch}')).scalar()
+    matched, unchanged = conn.execute(text(
+        f'SELECT COUNT(*), COALESCE(SUM({same_values}), 0) FROM {batch} b JOIN {table} t ON {on_keys}'
+    )).one()
+
+    # WHERE true keeps SQLite from reading ON CONFLICT as part of the SELECT
+    updates = [column for column in columns if column not in keys]
+    if updates:
+        on_conflict = (f'DO UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in updates)} '
+                       f'WHERE {" OR ".join(f"{table}.{column} IS NOT excluded.{column}" for column in updates)}')
+    else:
+        on_conflict = 'DO NOTHING'
+    conn.execute(text(f'INSERT INTO {table} ({", ".join(columns)}) SELECT {", ".join(columns)} FROM {batch} '
+                      f'WHERE true ON CONFLICT ({", ".join(keys)}) {on_conflict}'))
+
+    return total - matched, matched - unchanged, unchanged
+
+
+def prepare_merge_batch(df, key_columns, log):
+    """Drop rows without a full key and keep the last row for each duplicated key"""
+    present = [column for column in key_columns if column in df.columns]
+    if len(present) < len(key_columns):
+        # merge_rows reports the missing key columns
+        return df
+
+    rows_before = len(df)
+    df = df.dropna(subset=key_columns)
+    if len(df) < rows_before:
+        log.warning('load', f'Skipped {rows_before - len(df)} rows with empty key values')
+
+    rows_before = len(df)
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+    if len(df) < rows_before:
+        log.warning('load', f'Skipped {rows_before - len(df)} rows with duplicate keys (the last one wins)')
+    return df
+
+
+def load_data(df, table_name, etl_run, db, load_mode='replace', key_columns=None, index_specs=None):
+    """Load transformed data into SQLite database in a single transaction.
+
+    Replace loads write to a staging table that is renamed over the old one
+    at the end, so readers keep seeing the previous data until the commit and
+    a failed load leaves it untouched. The old table is dropped afterwards in
+    the background. Merge loads upsert the rows on ``key_columns``. The
+    indexes declared in ``index_specs`` are built after the rows are written.
+    """
+    log = get_run_logger(etl_run, db)
+    # Loaded before the write transaction opens: a lazy load inside it would autoflush the session
+    data_source = etl_run.job.data_source
     try:
         # Log load start
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='load',
-            message=f'Starting data load to table: {table_name} (mode: {load_mode})',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
-        
-        # Create SQLAlchemy engine
-        engine = create_engine(current_app.config['SQLALCHEMY_DATABASE_URI'])
-        
-        # Check if table exists
-        inspector = inspect(engine)
-        table_exists = table_name in inspector.get_table_names()
+        log.info('load', f'Starting data load to table: {table_name} (mode: {load_mode})')
         
-        if load_mode == 'replace' and table_exists:
-            # Drop existing table
-            with engine.connect() as conn:
-                conn.execute(text(f'DROP TABLE IF EXISTS "{table_name}"'))
-                conn.commit()
+        # Use the app's pooled engine; the whole load is one transaction.
+        # Logs stay buffered meanwhile, as writing them would wait for its lock
+        with log.hold(), db.engine.connect() as conn:
+            begin_write(conn)
+            write_started = time.perf_counter()
+            
+            # Check if table exists
+            table_exists = inspect(conn).has_table(table_name)
             
-            log = ETLLog(
-                etl_run_id=etl_run.id,
-                stage='load',
-                message=f'Dropped existing table: {table_name} (replace mode)',
-                log_level='info',
-                timestamp=datetime.utcnow()
-            )
-            db.session.add(log)
-            db.session.commit()
+            # Get existing row count for modes that keep the current rows
+            existing_rows = 0
+            if table_exists and load_mode in ('append', 'merge'):
+                existing_rows = conn.execute(text(f'SELECT COUNT(*) FROM "{table_name}"')).scalar()
             
-            # Load data
-            df.to_sql(table_name, engine, if_exists='replace', index=False)
-            rows_loaded = len(df)
+            retired = None
+            if load_mode == 'merge':
+                df = prepare_merge_batch(df, key_columns, log)
+                inserted, updated, unchanged = merge_rows(conn, df, table_name, key_columns)
+                etl_run.rows_inserted, etl_run.rows_updated, etl_run.rows_unchanged = inserted, updated, unchanged
+                rows_loaded = inserted + updated
+                table_rows = existing_rows + inserted
+                log.info('load', f'Merged on ({", ".join(key_columns)}): {inserted} inserted, '
+                                 f'{updated} updated, {unchanged} unchanged')
             
-        elif load_mode == 'append':
-            # Append to existing table or create new
-            if table_exists:
-                # Get existing row count
-                with engine.connect() as conn:
-                    result = conn.execute(text(f'SELECT COUNT(*) FROM "{table_name}"'))
-                    existing_rows = result.scalar()
+            elif load_mode == 'append':
+                if table_exists:
+                    log.info('load', f'Appending to existing table with {existing_rows} rows')
                 
-                log = ETLLog(
-                    etl_run_id=etl_run.id,
-                    stage='load',
-                    message=f'Appending to existing table with {existing_rows} rows',
-                    log_level='info',
-                    timestamp=datetime.utcnow()
-                )
-                db.session.add(log)
-                db.session.commit()
+                # An empty response may have no columns to create the table from
+                if len(df.columns):
+                    create_table(conn, df, table_name)
+                rows_loaded = bulk_insert(conn, df, table_name)
+                table_rows = existing_rows + rows_loaded
             
-            # Append data
-            df.to_sql(table_name, engine, if_exists='append', index=False)
-            rows_loaded = len(df)
+            else:
+                # Replace mode: build the new table next to the old one and swap it in
+                staging = staging_table_name(table_name)
+                conn.execute(text(f'DROP TABLE IF EXISTS "{staging}"'))
+                if len(df.columns):
+                    create_table(conn, df, staging)
+                elif table_exists:
+                    # No rows and no columns: empty the table but keep its columns
+                    copy_table_schema(conn, table_name, staging)
+                    log.warning('load', f'Source returned no rows; table {table_name} is now empty')
+                rows_loaded = bulk_insert(conn, df, staging)
+                table_rows = rows_loaded
+                retired = swap_in_staging(conn, table_name, etl_run.id)
+                log.info('load', f'Swapped new data into table: {table_name} (replace mode)')
             
-        else:
-            # Default: replace mode
-            df.to_sql(table_name, engine, if_exists='replace', index=False)
-            rows_loaded = len(df)
+            if inspect(conn).has_table(table_name):
+                sync_indexes(conn, table_name, index_specs, log)
+            # The source's new ETag / Last-Modified are committed with the data they describe
+            save_validators(conn, data_source)
+            # Last chance to cancel; leaving the block without commit rolls the load back
+            check_cancelled(etl_run, 'load')
+            conn.commit()
+            write_seconds = time.perf_counter() - write_started
         
-        # Log success
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='load',
-            message=f'Successfully loaded {rows_loaded} rows to table: {table_name}',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
+        if retired:
+            drop_retired_tables(db, table_name)
+        
+        # Log success; the row count is cached for the data viewer
         etl_run.rows_loaded = rows_loaded
-        db.session.commit()
+        etl_run.job.row_count = table_rows
+        etl_run.rows_per_second = len(df) / write_seconds if write_seconds > 0 else None
+        log.info('load', f'Successfully loaded {rows_loaded} rows to table: {table_name} '
+                         f'({etl_run.rows_per_second or 0:,.0f} rows/s)')
         
         return None
     
     except Exception as e:
         error_msg = f'Load failed: {str(e)}'
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='load',
-            message=error_msg,
-            log_level='error',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.error('load', error_msg)
         return error_msg
+
+
+def drop_table(db, table_name):
+    """Drop a table in its own short write transaction"""
+    with db.engine.connect() as conn:
+        begin_write(conn)
+        conn.execute(text(f'DROP TABLE IF EXISTS {quote_identifier(table_name)}'))
+        conn.commit()
+
+
+def _apply_staged_rows(conn, staging, table_name, etl_run, load_mode, key_columns, columns, log):
+    """Move the staged rows of a streaming load into table_name, inside the caller's transaction.
+
+    Returns (rows in table_name afterwards, name of the retired table or None).
+    """
+    staged = columns is not None
+    target_exists = inspect(conn).has_table(table_name)
+    existing_rows = 0
+    if target_exists and load_mode in ('append', 'merge'):
+        existing_rows = conn.execute(text(f'SELECT COUNT(*) FROM {quote_identifier(table_name)}')).scalar()
+
+    if load_mode == 'merge':
+        if not staged:
+            return existing_rows, None
+        # Chunks were deduplicated one by one; across chunks the last row of a key wins too
+        keys = ', '.join(quote_identifier(column) for column in key_columns)
+        duplicates = conn.execute(text(
+            f'DELETE FROM {quote_identifier(staging)} WHERE rowid NOT IN '
+            f'(SELECT MAX(rowid) FROM {quote_identifier(staging)} GROUP BY {keys})')).rowcount
+        if duplicates:
+            log.warning('load', f'Skipped {duplicates} rows with duplicate keys (the last one wins)')
+        if not target_exists:
+            copy_table_schema(conn, staging, table_name)
+        inserted, updated, unchanged = merge_table(conn, staging, table_name, key_columns, columns)
+        conn.execute(text(f'DROP TABLE {quote_identifier(staging)}'))
+        etl_run.rows_inserted, etl_run.rows_updated, etl_run.rows_unchanged = inserted, updated, unchanged
+        etl_run.rows_loaded = inserted + updated
+        log.info('load', f'Merged on ({", ".join(key_columns)}): {inserted} inserted, '
+                         f'{updated} updated, {unchanged} unchanged')
+        return existing_rows + inserted, None
+
+    if load_mode == 'append':
+        if staged and target_exists:
+            column_list = ', '.join(quote_identifier(column) for column in columns)
+            conn.execute(text(f'INSERT INTO {quote_identifier(table_name)} ({column_list}) '
+                              f'SELECT {column_list} FROM {quote_identifier(staging)}'))
+            conn.execute(text(f'DROP TABLE {quote_identifier(staging)}'))
+        elif staged:
+            swap_in_staging(conn, table_name, etl_run.id)
+        return existing_rows + etl_run.rows_loaded, None
+
+    if not staged and target_exists:
+        # The source had no rows: empty the table but keep its columns
+        copy_table_schema(conn, table_name, staging)
+        log.warning('load', f'Source returned no rows; table {table_name} is now empty')
+    return etl_run.rows_loaded, swap_in_staging(conn, table_name, etl_run.id)
+
+
+def load_chunks(chunks, table_name, etl_run, db, load_mode='replace', key_columns=None,
+                index_specs=None):
+    """Load a stream of DataFrame chunks through a staging table.
+
+    Each chunk is written to the staging table in its own short write
+    transaction, and the run's row counters are committed after it. The
+    status page therefore sees the run progress, and heartbeats, log writes
+    and other runs only ever wait for one chunk to be written, never for the
+    source to be read. Nothing reaches table_name until every chunk has
+    arrived. Then, in one transaction, replace loads swap the staging table
+    in, append loads copy its rows over and merge loads upsert them on
+    ``key_columns``. Any failure (including one raised by an upstream stage)
+    drops the staging table and leaves table_name untouched.
+    """
+    log = get_run_logger(etl_run, db)
+    # Loaded up front: a lazy load would autoflush the session while a chunk is being written
+    data_source = etl_run.job.data_source
+    staging = staging_table_name(table_name)
+    try:
+        log.info('load', f'Starting streaming load to table: {table_name} (mode: {load_mode})')
+        etl_run.rows_loaded = 0
+        # A staging table left by a run that died is discarded
+        drop_table(db, staging)
+
+        columns = None
+        chunk_count = 0
+        write_seconds = 0.0
+        with db.engine.connect() as conn:
+            for chunk in chunks:
+                if load_mode == 'merge':
+                    chunk = prepare_merge_batch(chunk, key_columns, log)
+                write_started = time.perf_counter()
+                # Logs stay buffered while the write lock is held
+                with log.hold():
+                    begin_write(conn)
+                    if columns is None:
+                        missing = [column for column in key_columns or [] if column not in chunk.columns]
+                        if load_mode == 'merge' and missing:
+                            raise ValueError(f'Key columns not found in data: {", ".join(missing)}')
+                        create_table(conn, chunk, staging)
+                        columns = list(chunk.columns)
+                    bulk_insert(conn, chunk, staging)
+                    conn.commit()
+                write_seconds += time.perf_counter() - write_started
+                chunk_count += 1
+                etl_run.rows_loaded += len(chunk)
+                # Publish the progress counters between chunks
+                db.session.commit()
+
+            rows_staged = etl_run.rows_loaded
+            check_cancelled(etl_run, 'load')
+            write_started = time.perf_counter()
+            with log.hold():
+                begin_write(conn)
+                table_rows, retired = _apply_staged_rows(conn, staging, table_name, etl_run, load_mode,
+                                                         key_columns, columns, log)
+                if inspect(conn).has_table(table_name):
+                    sync_indexes(conn, table_name, index_specs, log)
+                # The source's new ETag / Last-Modified are committed with the data they describe
+                save_validators(conn, data_source)
+                # Last chance to cancel; leaving the block without commit rolls the apply back
+                check_cancelled(etl_run, 'load')
+                conn.commit()
+            write_seconds += time.perf_counter() - write_started
+
+        # Cache the row count for the data viewer
+        etl_run.job.row_count = table_rows
+        etl_run.rows_per_second = rows_staged / write_seconds if write_seconds > 0 else None
+        log.info('load', f'Successfully loaded {etl_run.rows_loaded} rows in {chunk_count} chunks to table: {table_name} '
+                         f'({etl_run.rows_per_second or 0:,.0f} rows/s)')
+        db.session.commit()
+
+        if retired:
+            drop_retired_tables(db, table_name)
+
+    except Exception as e:
+        db.session.rollback()
+        # The staged rows are discarded, so none were loaded
+        etl_run.rows_loaded = 0
+        try:
+            drop_table(db, staging)
+        except Exception as drop_error:
+            # The next load of the table drops it
+            current_app.logger.warning(f'Could not drop staging table {staging}: {drop_error}')
+        if isinstance(e, StageError):
+            raise
+        raise StageError('load', f'Load failed: {str(e)}')
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, insert, delete, update, or_
+from sqlalchemy.exc import IntegrityError, OperationalError
+import time
+
+from app.models import ETLRun, ETLLog, TableLock
+from app.etl.control import beating_runs
+from app.etl.load import begin_write
+from app.etl.runlog import get_run_logger
+
+LOCK_POLICIES = ('queue', 'reject')
+
+
+def lock_ttl():
+    """Seconds a table lease lasts without being renewed"""
+    config = current_app.config
+    return config.get('ETL_TABLE_LOCK_TTL') or config.get('ETL_HEARTBEAT_TIMEOUT', 300)
+
+
+def _live_leases(table, now, beating=()):
+    """Leases whose run is still queued or running and that have not expired.
+
+    A lease of a run in ``beating`` counts as live even past its expiry: the
+    run's file heartbeat is fresh, and only the renewal was held up by
+    another run's write lock.
+    """
+    active_runs = select(ETLRun.id).where(ETLRun.status.in_(ETLRun.ACTIVE_STATUSES))
+    unexpired = table.c.expires_at >= now
+    if beating:
+        unexpired = unexpired | table.c.etl_run_id.in_(beating)
+    return unexpired & table.c.etl_run_id.in_(active_runs)
+
+
+def _beating_holders(conn, table, table_name, now, ttl):
+    """Runs leasing table_name whose heartbeat file was touched within ttl"""
+    holders = conn.execute(select(table.c.etl_run_id).where(table.c.table_name == table_name)).scalars().all()
+    return beating_runs(holders, now - timedelta(seconds=ttl))
+
+
+def acquire_table_lock(db, table_name, etl_run_id, ttl=None):
+    """Take the lease on a target table for a run.
+
+    A lease whose run has finished, or that was neither renewed nor
+    heartbeated within its ttl (its process died), is released first. Returns the id of the run that
+    holds the lease afterwards: etl_run_id when it was acquired.
+    """
+    ttl = ttl or lock_ttl()
+    now = datetime.utcnow()
+    table = TableLock.__table__
+    with db.engine.connect() as conn:
+        begin_write(conn)
+        beating = _beating_holders(conn, table, table_name, now, ttl)
+        conn.execute(delete(table).where(table.c.table_name == table_name, ~_live_leases(table, now, beating)))
+        holder = conn.execute(select(table.c.etl_run_id).where(table.c.table_name == table_name)).scalar()
+        if holder is None:
+            try:
+                conn.execute(insert(table).values(table_name=table_name, etl_run_id=etl_run_id,
+                                                  acquired_at=now, expires_at=now + timedelta(seconds=ttl)))
+                holder = etl_run_id
+            except IntegrityError:
+                # Another process took it first (databases without BEGIN IMMEDIATE)
+                conn.rollback()
+                holder = conn.execute(select(table.c.etl_run_id)
+                                      .where(table.c.table_name == table_name)).scalar()
+        conn.commit()
+    return holder
+
+
+def renew_table_locks(conn, etl_run_id, ttl):
+    """Extend the leases held by a run, inside the caller's transaction"""
+    table = TableLock.__table__
+    conn.execute(update(table).where(table.c.etl_run_id == etl_run_id)
+                 .values(expires_at=datetime.utcnow() + timedelta(seconds=ttl)))
+
+
+def release_table_lock(db, table_name, etl_run_id):
+    """Give up a run's lease on a target table"""
+    table = TableLock.__table__
+    with db.engine.connect() as conn:
+        begin_write(conn)
+        conn.execute(delete(table).where(table.c.table_name == table_name, table.c.etl_run_id == etl_run_id))
+        conn.commit()
+
+
+def table_lock_holder(db, table_name):
+    """Id of the run currently holding a live lease on table_name, or None"""
+    table = TableLock.__table__
+    now = datetime.utcnow()
+    beating = _beating_holders(db.session, table, table_name, now, lock_ttl())
+    holder = db.session.execute(select(table.c.etl_run_id).where(
+        table.c.table_name == table_name, _live_leases(table, now, beating))).scalar()
+    db.session.commit()
+    return holder
+
+
+def wait_for_table_lock(db, etl_run, policy=None, poll=None, block=True):
+    """Acquire the lease on a queued run's target table before it starts.
+
+    With the 'queue' policy the run stays queued behind the holder until the
+    lease is free (or the run is cancelled); with 'reject' it is marked
+    'rejected' straight away. With block=False a busy lease is tried only
+    once and the run is left queued, so the caller can retry it later
+    without holding a worker. Returns True once the lease is held.
+    """
+    config = current_app.config
+    policy = policy or config.get('ETL_TABLE_LOCK_POLICY', 'queue')
+    poll = poll or config.get('ETL_TABLE_LOCK_POLL', 1.0)
+    table_name = etl_run.job.table_name
+    waiting = False
+    while True:
+        try:
+            holder = acquire_table_lock(db, table_name, etl_run.id)
+        except OperationalError:
+            # The database stayed locked by a load; try again
+            holder = None
+        if holder == etl_run.id:
+            return True
+
+        if holder is not None and policy == 'reject':
+            etl_run.status = 'rejected'
+            etl_run.error_message = f'Table {table_name} is being loaded by run #{holder}'
+            etl_run.completed_at = datetime.utcnow()
+            get_run_logger(etl_run, db).error('general', etl_run.error_message)
+            return False
+
+        if holder is not None and not waiting:
+            message = f'Waiting for run #{holder} to finish loading table {table_name}'
+            # A deferred run is retried many times; the wait is logged once per holder
+            if block or not ETLLog.query.filter_by(etl_run_id=etl_run.id, message=message).first():
+                get_run_logger(etl_run, db).info('general', message)
+            waiting = True
+        # Written now: a deferred run's attempt ends here
+        get_run_logger(etl_run, db).flush()
+        if not block:
+            return False
+        time.sleep(poll)
+
+        # The run may have been cancelled while it waited
+        db.session.refresh(etl_run)
+        db.session.commit()
+        if etl_run.status != 'queued':
+            return False
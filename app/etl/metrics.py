@@ -0,0 +1,195 @@
+from contextlib import contextmanager
+from flask import current_app
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+
+from app.models import ETLStageMetric
+
+STAGE_ROW_COUNTERS = {
+    'extract': 'rows_extracted',
+    'transform': 'rows_transformed',
+    'load': 'rows_loaded',
+}
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):  # Not available on Windows
+    PAGE_SIZE = None
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where it cannot be read"""
+    if PAGE_SIZE is None:
+        return None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class _RSSSampler:
+    """Background thread that reports the process RSS to the active collectors"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.collectors = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, collector):
+        with self._lock:
+            self.collectors.add(collector)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='etl-rss-sampler', daemon=True)
+                self._thread.start()
+
+    def unregister(self, collector):
+        with self._lock:
+            self.collectors.discard(collector)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss()
+            if rss is None:
+                continue
+            with self._lock:
+                collectors = list(self.collectors)
+            for collector in collectors:
+                collector._observe(rss)
+
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+def _get_sampler(interval):
+    global _sampler
+    with _sampler_lock:
+        if _sampler is None:
+            _sampler = _RSSSampler(interval)
+        return _sampler
+
+
+class StageMetrics:
+    """Collects wall time, CPU time and peak memory per stage of one run.
+
+    Stages may nest: in streaming mode the load stage pulls chunks from
+    transform, which pulls them from extract. Time is only counted for the
+    innermost active stage, so each stage gets its own (exclusive) time.
+
+    ``ETL_STAGE_MEMORY`` selects how peak memory is measured: ``'rss'``
+    samples the process resident set size every ``ETL_RSS_SAMPLE_INTERVAL``
+    seconds (cheap), ``'tracemalloc'`` records peak Python allocations
+    (exact but slows pandas-heavy stages down noticeably) and None turns it
+    off. Both are process-wide, so they are exact when one run executes at a
+    time and an upper bound when runs overlap.
+    """
+
+    def __init__(self, memory_mode=None):
+        config = current_app.config
+        if memory_mode is None:
+            memory_mode = config.get('ETL_STAGE_MEMORY', 'rss')
+        self.memory_mode = memory_mode
+        self.stages = {}
+        self._stack = []
+        self._mark = None
+        self._lock = threading.Lock()
+        if memory_mode == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif memory_mode == 'rss':
+            _get_sampler(config.get('ETL_RSS_SAMPLE_INTERVAL', 0.05)).register(self)
+
+    def _stage(self, stage):
+        return self.stages.setdefault(stage, {'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                              'peak_memory_bytes': None})
+
+    def _observe(self, memory):
+        """Record a memory reading against the active stage"""
+        with self._lock:
+            if self._stack:
+                totals = self._stage(self._stack[-1])
+                totals['peak_memory_bytes'] = max(totals['peak_memory_bytes'] or 0, memory)
+
+    def _read_memory(self):
+        if self.memory_mode == 'tracemalloc' and tracemalloc.is_tracing():
+            memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+            return memory
+        if self.memory_mode == 'rss':
+            return current_rss()
+        return None
+
+    def _switch(self):
+        """Charge the time and memory since the last switch to the active stage"""
+        now = (time.perf_counter(), time.thread_time())
+        memory = self._read_memory()
+        if self._stack and self._mark:
+            with self._lock:
+                totals = self._stage(self._stack[-1])
+                totals['wall_seconds'] += now[0] - self._mark[0]
+                totals['cpu_seconds'] += now[1] - self._mark[1]
+            if memory is not None:
+                self._observe(memory)
+        self._mark = now
+
+    @contextmanager
+    def measure(self, stage):
+        """Count the time spent in the block towards a stage"""
+        self._switch()
+        with self._lock:
+            self._stack.append(stage)
+        try:
+            yield
+        finally:
+            self._switch()
+            with self._lock:
+                self._stack.pop()
+
+    def measure_chunks(self, stage, chunks):
+        """Wrap a chunk generator so the time spent producing chunks counts towards a stage"""
+        iterator = iter(chunks)
+        while True:
+            with self.measure(stage):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+
+    def save(self, etl_run, db):
+        """Store one ETLStageMetric row per measured stage and commit"""
+        if self.memory_mode == 'rss':
+            _get_sampler(None).unregister(self)
+        # Streaming runs measure the stages out of order; store them in pipeline order
+        order = list(STAGE_ROW_COUNTERS)
+        stages = sorted(self.stages.items(),
+                        key=lambda item: order.index(item[0]) if item[0] in order else len(order))
+        for stage, totals in stages:
+            counter = STAGE_ROW_COUNTERS.get(stage)
+            rows = getattr(etl_run, counter) if counter else None
+            wall_seconds = totals['wall_seconds']
+            db.session.add(ETLStageMetric(
+                etl_run_id=etl_run.id,
+                stage=stage,
+                wall_seconds=wall_seconds,
+                cpu_seconds=totals['cpu_seconds'],
+                rows=rows,
+                rows_per_second=rows / wall_seconds if rows and wall_seconds > 0 else None,
+                peak_memory_bytes=totals['peak_memory_bytes'],
+            ))
+        self.stages = {}
+        db.session.commit()
+
+
+def get_stage_metrics(etl_run):
+    """Return the StageMetrics attached to an ETL run, creating it on first use"""
+    metrics = getattr(etl_run, '_stage_metrics', None)
+    if metrics is None:
+        metrics = StageMetrics()
+        etl_run._stage_metrics = metrics
+    return metrics
@@ -0,0 +1,225 @@
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from datetime import datetime, timezone
+import threading
+import time
+
+PAGINATION_TYPES = ['offset', 'page', 'cursor', 'link']
+
+# Default (page parameter, size parameter) names for each pagination type
+DEFAULT_PARAMS = {
+    'offset': ('offset', 'limit'),
+    'page': ('page', 'per_page'),
+    'cursor': ('cursor', 'limit'),
+    'link': (None, 'per_page'),
+}
+
+DEFAULT_PAGE_SIZE = 100
+
+# Keys commonly used by APIs to wrap the records array
+RECORD_KEYS = ['data', 'results', 'items', 'records']
+
+# Keys commonly used by APIs for the total number of records, at the top level or under 'meta'
+TOTAL_KEYS = ['total', 'total_count', 'totalCount', 'count']
+
+
+def find_records(payload):
+    """Return the list of records in a JSON payload and the key it was found under"""
+    if isinstance(payload, list):
+        return payload, None
+    if isinstance(payload, dict):
+        for key in RECORD_KEYS:
+            if isinstance(payload.get(key), list):
+                return payload[key], key
+        if not any(isinstance(v, list) for v in payload.values()):
+            return [payload], None
+    return [], None
+
+
+def find_total(payload):
+    """Return the total number of records an API reports with a page, or None"""
+    if not isinstance(payload, dict):
+        return None
+    for container in (payload, payload.get('meta'), payload.get('pagination')):
+        if isinstance(container, dict):
+            for key in TOTAL_KEYS:
+                value = container.get(key)
+                if isinstance(value, int) and not isinstance(value, bool):
+                    return value
+    return None
+
+
+def lookup_path(payload, path):
+    """Look up a dotted path such as 'meta.next_cursor' in a JSON payload"""
+    value = payload
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def with_query_params(url, params):
+    """Return url with the given query parameters added or replaced"""
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    query_params = [(k, v) for k, v in parse_qsl(query, keep_blank_values=True) if k not in params]
+    query_params.extend((k, v) for k, v in params.items() if v is not None)
+    return urlunsplit((scheme, netloc, path, urlencode(query_params), fragment))
+
+
+def retry_after_seconds(response, attempt):
+    """Seconds to wait after a 429, from the Retry-After header or exponential backoff"""
+    header = response.headers.get('Retry-After')
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(header)
+                return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    return float(2 ** attempt)
+
+
+class RateLimitGate:
+    """Shared 429 backoff: once any request is rate limited, every worker pauses"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, seconds):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+class PageFetcher:
+    """GETs pages through a shared session, honouring 429 responses.
+
+    ``rate_limited`` counts the 429s that were retried, and
+    ``page_limit_reached`` is set when the page iterators stopped at
+    ``max_pages`` while the API still had more pages.
+    """
+
+    def __init__(self, session, timeout=10, max_retries=5):
+        self.session = session
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.gate = RateLimitGate()
+        self.rate_limited = 0
+        self.page_limit_reached = False
+
+    def get(self, url):
+        for attempt in range(self.max_retries + 1):
+            self.gate.wait()
+            response = self.session.get(url, timeout=self.timeout)
+            if response.status_code != 429 or attempt == self.max_retries:
+                break
+            self.rate_limited += 1
+            self.gate.backoff(retry_after_seconds(response, attempt))
+        response.raise_for_status()
+        return response
+
+
+def _numbered_pages(fetcher, data_source, page_param, size_param, page_size, max_pages, concurrency):
+    """Fetch offset/page-number pages concurrently, yielding them in order.
+
+    The first page is fetched on its own. Its length is the page size the
+    server really uses (it may cap the requested one), so offsets step by
+    it, and the total it reports, if any, bounds the pages requested. Up to
+    ``concurrency`` requests are then kept in flight until a page comes back
+    empty or the total is reached. A short page does not end the fetch.
+    """
+    def page_url(index, size):
+        if data_source.pagination_type == 'offset':
+            position = index * size
+        else:
+            position = index + 1
+        return with_query_params(data_source.api_url, {page_param: position, size_param: page_size})
+
+    def fetch(index, size):
+        return fetcher.get(page_url(index, size)).json()
+
+    payload = fetch(0, page_size)
+    records, _ = find_records(payload)
+    yield records
+    if not records:
+        return
+    size = min(len(records), page_size)
+    total = find_total(payload)
+    needed = None if total is None else -(-total // size)
+    last_page = max_pages if needed is None else min(max_pages, needed)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='etl-page') as pool:
+        pending = {}
+        next_index = 1
+        while True:
+            while len(pending) < concurrency and next_index < last_page:
+                pending[next_index] = pool.submit(fetch, next_index, size)
+                next_index += 1
+            if not pending:
+                break
+
+            records, _ = find_records(pending.pop(min(pending)).result())
+            if not records:
+                for future in pending.values():
+                    future.cancel()
+                return
+            yield records
+
+    if needed is None or needed > max_pages:
+        fetcher.page_limit_reached = True
+
+
+def _linked_pages(fetcher, data_source, page_param, size_param, page_size, max_pages):
+    """Follow cursor tokens or Link headers page by page"""
+    url = data_source.api_url
+    if size_param and data_source.page_size:
+        url = with_query_params(url, {size_param: page_size})
+
+    for _ in range(max_pages):
+        response = fetcher.get(url)
+        payload = response.json()
+        records, _ = find_records(payload)
+        yield records
+
+        if data_source.pagination_type == 'link':
+            next_url = response.links.get('next', {}).get('url')
+        else:
+            cursor = lookup_path(payload, data_source.cursor_path or 'next_cursor')
+            if cursor in (None, ''):
+                next_url = None
+            elif str(cursor).startswith(('http://', 'https://')):
+                next_url = str(cursor)
+            else:
+                next_url = with_query_params(url, {page_param: cursor})
+
+        if not next_url or not records:
+            break
+        url = next_url
+    else:
+        fetcher.page_limit_reached = True
+
+
+def iter_pages(fetcher, data_source, concurrency=4, max_pages=1000):
+    """Yield the records of each page of a paginated JSON API, in page order"""
+    default_page_param, default_size_param = DEFAULT_PARAMS[data_source.pagination_type]
+    page_param = data_source.page_param or default_page_param
+    size_param = data_source.size_param or default_size_param
+    page_size = data_source.page_size or DEFAULT_PAGE_SIZE
+    max_pages = data_source.max_pages or max_pages
+
+    if data_source.pagination_type in ('offset', 'page'):
+        pages = _numbered_pages(fetcher, data_source, page_param, size_param, page_size,
+                                max_pages, concurrency)
+    else:
+        pages = _linked_pages(fetcher, data_source, page_param, size_param, page_size, max_pages)
+
+    yield from pages
@@ -0,0 +1,130 @@
+import os
+
+from app.etl.extract import extract_data, extract_csv_chunks, extract_api_chunks
+from app.etl.transform import transform_data, transform_chunks
+from app.etl.load import load_data, load_chunks, table_exists
+from app.etl.errors import StageError
+from app.etl.runlog import get_run_logger
+from app.etl.http_cache import SOURCE_UNCHANGED
+from app.etl.fingerprint import source_fingerprint
+from app.etl.metrics import get_stage_metrics
+from app.etl.control import check_cancelled, checked_chunks
+
+
+def is_streaming(job):
+    """Check whether a job should run in chunked streaming mode"""
+    if not job.chunk_size:
+        return False
+    data_source = job.data_source
+    if data_source.source_type == 'csv':
+        return True
+    return (data_source.source_type == 'api' and data_source.api_format == 'json'
+            and not data_source.pagination_type)
+
+
+def run_streaming_pipeline(job, etl_run, db, replay=False):
+    """Stream a CSV file or JSON API response through transform and load chunk by chunk"""
+    log = get_run_logger(etl_run, db)
+    metrics = get_stage_metrics(etl_run)
+    data_source = job.data_source
+    try:
+        if data_source.source_type == 'csv':
+            chunks = extract_csv_chunks(data_source.file_path, job.chunk_size, etl_run, db)
+        else:
+            with metrics.measure('extract'):
+                chunks = extract_api_chunks(data_source, job.chunk_size, etl_run, db, replay=replay)
+            if chunks is SOURCE_UNCHANGED:
+                etl_run.status = 'unchanged'
+                log.flush()
+                return None, None
+        # The stages interleave chunk by chunk; each one is timed separately.
+        # A cancelled run stops before its next chunk and the load is rolled back
+        chunks = metrics.measure_chunks('extract', checked_chunks(etl_run, 'extract', chunks))
+        chunks = metrics.measure_chunks('transform', transform_chunks(chunks, etl_run, db))
+
+        with metrics.measure('load'):
+            load_chunks(chunks, job.table_name, etl_run, db, job.load_mode, job.get_key_columns(),
+                        job.index_specs)
+    except StageError as e:
+        log.error(e.stage, e.message)
+        return e.stage, e.message
+    log.flush()
+    return None, None
+
+
+def run_pipeline(job, etl_run, db, force=False):
+    """Run extract, transform and load for a job.
+
+    Returns a (stage, error) tuple; both are None when the run succeeded.
+    Buffered logs and row counters are written at each stage boundary. If the
+    source is unchanged since the last successful load (same CSV contents and
+    job settings, or a 304 from an API) the run is marked 'unchanged' and
+    nothing is loaded. ``force`` disables both checks.
+    """
+    log = get_run_logger(etl_run, db)
+    metrics = get_stage_metrics(etl_run)
+    data_source = job.data_source
+    target_exists = table_exists(db, job.table_name)
+
+    fingerprint = None
+    if data_source.source_type == 'csv' and os.path.exists(data_source.file_path or ''):
+        with metrics.measure('extract'):
+            fingerprint = source_fingerprint(job)
+        if not force and target_exists and fingerprint == data_source.loaded_fingerprint:
+            etl_run.status = 'unchanged'
+            log.info('extract', 'Source file and job settings unchanged since the last load, skipping run')
+            log.flush()
+            metrics.save(etl_run, db)
+            return None, None
+
+    # Without a target table (or when forced) there is nothing to keep, so an
+    # unchanged API source is replayed from its cached copy instead of skipped
+    try:
+        stage, error = _run_stages(job, etl_run, db, replay=force or not target_exists)
+    except StageError as e:
+        # Raised at a cancellation check point between stages
+        log.error(e.stage, e.message)
+        stage, error = e.stage, e.message
+    metrics.save(etl_run, db)
+    if fingerprint and not error:
+        data_source.loaded_fingerprint = fingerprint
+        db.session.commit()
+    return stage, error
+
+
+def _run_stages(job, etl_run, db, replay=False):
+    """Run the pipeline stages, streaming CSV sources in chunks when configured"""
+    if is_streaming(job):
+        return run_streaming_pipeline(job, etl_run, db, replay=replay)
+
+    log = get_run_logger(etl_run, db)
+    metrics = get_stage_metrics(etl_run)
+
+    with metrics.measure('extract'):
+        df, error = extract_data(job.data_source, etl_run, db, replay=replay)
+    log.flush()
+    if error:
+        return 'extract', error
+
+    if df is SOURCE_UNCHANGED:
+        etl_run.status = 'unchanged'
+        return None, None
+
+    check_cancelled(etl_run, 'transform')
+    with metrics.measure('transform'):
+        df, error = transform_data(df, etl_run, db)
+    if error:
+        log.flush()
+        return 'transform', error
+    log.flush()
+
+    check_cancelled(etl_run, 'load')
+    with metrics.measure('load'):
+        error = load_data(df, job.table_name, etl_run, db, job.load_mode, job.get_key_columns(),
+                          job.index_specs)
+    if error:
+        log.flush()
+        return 'load', error
+    log.flush()
+
+    return None, None
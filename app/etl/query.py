@@ -0,0 +1,204 @@
+from sqlalchemy import inspect, text
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+FILTER_OPERATORS = {
+    'eq': '=',
+    'ne': '!=',
+    'lt': '<',
+    'le': '<=',
+    'gt': '>',
+    'ge': '>=',
+    'like': 'LIKE',
+    'in': 'IN',
+    'null': 'IS NULL',
+    'notnull': 'IS NOT NULL',
+}
+
+
+def encode_cursor(value, rowid):
+    """Encode a (sort value, rowid) position as an opaque URL-safe token"""
+    raw = json.dumps([value, rowid], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token made by encode_cursor; raises ValueError if it is invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, rowid = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid page cursor')
+    if not isinstance(rowid, int):
+        raise ValueError('Invalid page cursor')
+    return value, rowid
+
+
+def table_columns(conn, table_name):
+    """Column names of a table, in table order"""
+    return [column['name'] for column in inspect(conn).get_columns(table_name)]
+
+
+def count_rows(conn, table_name):
+    """Count the rows of a table (a full scan; prefer the cached Job.row_count)"""
+    return conn.execute(text(f'SELECT COUNT(*) FROM "{table_name}"')).scalar()
+
+
+def parse_filter(expression):
+    """Parse a 'column:operator:value' filter into a (column, operator, value) tuple.
+
+    The value may contain colons; 'null' and 'notnull' take no value and 'in'
+    takes a comma-separated list. Raises ValueError if it is malformed.
+    """
+    parts = expression.split(':', 2)
+    if len(parts) < 2 or parts[1] not in FILTER_OPERATORS:
+        raise ValueError(f'Invalid filter: {expression} (expected column:operator:value, '
+                         f'operators: {", ".join(FILTER_OPERATORS)})')
+    column, operator = parts[0], parts[1]
+    if operator in ('null', 'notnull'):
+        return column, operator, None
+    if len(parts) < 3:
+        raise ValueError(f'Filter needs a value: {expression}')
+    value = parts[2].split(',') if operator == 'in' else parts[2]
+    return column, operator, value
+
+
+def compile_filters(filters, table_columns):
+    """Compile (column, operator, value) filters into a parameterized WHERE clause.
+
+    Column names are checked against table_columns and values are always
+    bound as parameters. Returns (where, params); where is None without filters.
+    """
+    clauses = []
+    params = {}
+    for column, operator, value in filters:
+        if column not in table_columns:
+            raise ValueError(f'Unknown filter column: {column}')
+        sql_operator = FILTER_OPERATORS[operator]
+        if value is None:
+            clauses.append(f'"{column}" {sql_operator}')
+        elif operator == 'in':
+            names = []
+            for item in value:
+                names.append(f'filter_{len(params)}')
+                params[names[-1]] = item
+            clauses.append(f'"{column}" IN ({", ".join(":" + name for name in names)})')
+        else:
+            name = f'filter_{len(params)}'
+            params[name] = value
+            clauses.append(f'"{column}" {sql_operator} :{name}')
+    return (' AND '.join(clauses) or None), params
+
+
+def _after_clause(column, ascending, value):
+    """WHERE clause for rows strictly after a cursor in ORDER BY column, rowid.
+
+    SQLite sorts NULLs before all other values, so they come first when
+    ascending and last when descending.
+    """
+    if column is None:
+        return f'rowid {">" if ascending else "<"} :cursor_rowid'
+    if ascending:
+        if value is None:
+            return f'("{column}" IS NULL AND rowid > :cursor_rowid) OR "{column}" IS NOT NULL'
+        return f'"{column}" > :cursor_value OR ("{column}" = :cursor_value AND rowid > :cursor_rowid)'
+    if value is None:
+        return f'"{column}" IS NULL AND rowid < :cursor_rowid'
+    return (f'"{column}" < :cursor_value OR ("{column}" = :cursor_value AND rowid < :cursor_rowid) '
+            f'OR "{column}" IS NULL')
+
+
+def iter_page(conn, table_name, sort=None, descending=False, after=None, before=None,
+              limit=DEFAULT_PAGE_SIZE, where=None, params=None, columns=None):
+    """Read one page of a table row by row with keyset pagination on (sort column, rowid).
+
+    Only the requested rows are read, and no OFFSET is used, so every page
+    costs the same however deep it is. ``after`` and ``before`` are cursors
+    from a previous page. ``where``/``params`` add a filter and ``columns``
+    limits the selected columns. The request is checked straight away
+    (raising ValueError); the query runs once the rows are iterated.
+
+    Returns (columns, rows, cursors): rows yields each row as a list of
+    values, and cursors gets its 'next_cursor' / 'prev_cursor' (None when
+    there is no such page) once rows is exhausted. Pages after a cursor are
+    read straight from the database cursor; pages before one are read in
+    reverse and flipped, so those (at most ``limit`` rows) are held in memory.
+    """
+    all_columns = table_columns(conn, table_name)
+    if sort is not None and sort not in all_columns:
+        raise ValueError(f'Unknown sort column: {sort}')
+    unknown = [column for column in columns or [] if column not in all_columns]
+    if unknown:
+        raise ValueError(f'Unknown column: {", ".join(unknown)}')
+    columns = columns or all_columns
+
+    backwards = before is not None
+    ascending = not descending
+    if backwards:
+        # Walk the reversed order from the cursor, then flip the rows back
+        ascending = not ascending
+
+    clauses = [f'({where})'] if where else []
+    query_params = dict(params or {})
+    cursor = before if backwards else after
+    if cursor is not None:
+        value, rowid = decode_cursor(cursor)
+        clauses.append(f'({_after_clause(sort, ascending, value)})')
+        query_params.update(cursor_value=value, cursor_rowid=rowid)
+
+    direction = 'ASC' if ascending else 'DESC'
+    order_by = f'"{sort}" {direction}, rowid {direction}' if sort else f'rowid {direction}'
+    # rowid and the sort value are selected first to build the page cursors
+    select_list = ', '.join(['rowid', f'"{sort}"' if sort else 'NULL'] + [f'"{column}"' for column in columns])
+    sql = f'SELECT {select_list} FROM "{table_name}"'
+    if clauses:
+        sql += f' WHERE {" AND ".join(clauses)}'
+    sql += f' ORDER BY {order_by} LIMIT :limit'
+    # One extra row tells whether there is a page beyond this one
+    query_params['limit'] = limit + 1
+
+    cursors = {'next_cursor': None, 'prev_cursor': None}
+
+    def read_rows():
+        result = conn.execute(text(sql), query_params)
+        try:
+            if backwards:
+                rows = result.fetchall()
+                has_more = len(rows) > limit
+                rows = reversed(rows[:limit])
+            else:
+                rows, has_more = result, False
+            first = last = None
+            for count, row in enumerate(rows):
+                if count == limit:
+                    has_more = True
+                    break
+                if first is None:
+                    first = row
+                last = row
+                yield list(row[2:])
+        finally:
+            result.close()
+
+        if last is not None:
+            if has_more or backwards:
+                cursors['next_cursor'] = encode_cursor(last[1], last[0])
+            if (has_more and backwards) or (not backwards and after is not None):
+                cursors['prev_cursor'] = encode_cursor(first[1], first[0])
+
+    return columns, read_rows(), cursors
+
+
+def fetch_page(conn, table_name, sort=None, descending=False, after=None, before=None,
+               limit=DEFAULT_PAGE_SIZE, where=None, params=None, columns=None):
+    """Fetch one page of a table; the arguments are those of iter_page.
+
+    Returns a dict with 'columns', 'rows' (lists of values), and
+    'next_cursor' / 'prev_cursor' (None when there is no such page).
+    """
+    columns, rows, cursors = iter_page(conn, table_name, sort=sort, descending=descending, after=after,
+                                       before=before, limit=limit, where=where, params=params, columns=columns)
+    return dict(cursors, columns=columns, rows=list(rows))
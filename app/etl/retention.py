@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import text
+
+from app.models import ETLRun
+from app.etl.load import begin_write
+
+
+def runs_to_compact(db, job_id, keep_runs=None, keep_days=None, limit=None, now=None):
+    """Ids of a job's finished runs whose detailed logs are past retention.
+
+    A run keeps its logs while it is one of the job's keep_runs most recent
+    runs or is younger than keep_days. A setting of None does not protect
+    any runs; with both None nothing is compacted.
+    """
+    if keep_runs is None and keep_days is None:
+        return []
+
+    query = db.session.query(ETLRun.id).filter(ETLRun.job_id == job_id,
+                                               ETLRun.compacted_at.is_(None),
+                                               ETLRun.status.in_(ETLRun.FINISHED_STATUSES))
+    if keep_days is not None:
+        cutoff = (now or datetime.utcnow()) - timedelta(days=keep_days)
+        query = query.filter(ETLRun.started_at < cutoff)
+    if keep_runs:
+        recent = (db.session.query(ETLRun.id).filter(ETLRun.job_id == job_id)
+                  .order_by(ETLRun.started_at.desc(), ETLRun.id.desc()).limit(keep_runs))
+        query = query.filter(ETLRun.id.notin_(recent.scalar_subquery()))
+
+    run_ids = [run_id for run_id, in query.order_by(ETLRun.id).limit(limit).all()]
+    # End the read transaction before the writes start
+    db.session.commit()
+    return run_ids
+
+
+def compact_runs(db, run_ids):
+    """Replace the detailed logs of runs with counts on the run rows"""
+    params = {f'run_{i}': run_id for i, run_id in enumerate(run_ids)}
+    id_list = ', '.join(f':{name}' for name in params)
+    with db.engine.connect() as conn:
+        begin_write(conn)
+        conn.execute(text(f'''
+            UPDATE etl_runs SET
+                log_count = (SELECT COUNT(*) FROM etl_logs WHERE etl_run_id = etl_runs.id),
+                warning_count = (SELECT COUNT(*) FROM etl_logs
+                                 WHERE etl_run_id = etl_runs.id AND log_level = 'warning'),
+                error_count = (SELECT COUNT(*) FROM etl_logs
+                               WHERE etl_run_id = etl_runs.id AND log_level = 'error'),
+                compacted_at = :now
+            WHERE id IN ({id_list})
+        '''), dict(params, now=datetime.utcnow()))
+        conn.execute(text(f'DELETE FROM etl_logs WHERE etl_run_id IN ({id_list})'), params)
+        conn.commit()
+
+
+def apply_retention(db, job_id, keep_runs=None, keep_days=None, batch_size=None):
+    """Compact the runs of a job that are past the log retention window.
+
+    Runs are compacted batch_size at a time, each batch in its own short
+    write transaction, so loads and the log writer are never blocked for
+    long. Defaults come from the ETL_LOG_RETENTION_* settings. Returns the
+    number of runs compacted.
+    """
+    config = current_app.config
+    if keep_runs is None:
+        keep_runs = config.get('ETL_LOG_RETENTION_RUNS')
+    if keep_days is None:
+        keep_days = config.get('ETL_LOG_RETENTION_DAYS')
+    batch_size = batch_size or config.get('ETL_LOG_RETENTION_BATCH_SIZE', 500)
+
+    compacted = 0
+    while True:
+        run_ids = runs_to_compact(db, job_id, keep_runs, keep_days, limit=batch_size)
+        if not run_ids:
+            break
+        compact_runs(db, run_ids)
+        compacted += len(run_ids)
+        if len(run_ids) < batch_size:
+            break
+    return compacted
@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from datetime import datetime
+import time
+
+from flask import current_app
+from sqlalchemy import insert
+
+from app.models import ETLLog
+
+
+class RunLogger:
+    """Buffers ETLLog records for one run and writes them in bulk.
+
+    Each record is timestamped when it is logged. The buffer is written with a
+    single multi-row INSERT when ``flush()`` is called (the pipeline does this
+    at stage boundaries), when ``ETL_LOG_FLUSH_INTERVAL`` seconds have passed
+    since the last write, or immediately when an error is logged.
+    """
+
+    def __init__(self, etl_run, db, flush_interval=None):
+        self.etl_run_id = etl_run.id
+        self.db = db
+        if flush_interval is None:
+            flush_interval = current_app.config.get('ETL_LOG_FLUSH_INTERVAL', 2.0)
+        self.flush_interval = flush_interval
+        self._records = []
+        self._held = 0
+        self._last_flush = time.monotonic()
+
+    def log(self, stage, message, level='info'):
+        self._records.append({
+            'etl_run_id': self.etl_run_id,
+            'stage': stage,
+            'message': message,
+            'log_level': level,
+            'timestamp': datetime.utcnow(),
+        })
+        if level == 'error' or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def info(self, stage, message):
+        self.log(stage, message, 'info')
+
+    def warning(self, stage, message):
+        self.log(stage, message, 'warning')
+
+    def error(self, stage, message):
+        self.log(stage, message, 'error')
+
+    def flush(self):
+        """Write buffered records and commit the session"""
+        if self._held:
+            return
+        if self._records:
+            records, self._records = self._records, []
+            self.db.session.execute(insert(ETLLog), records)
+        self.db.session.commit()
+        self._last_flush = time.monotonic()
+
+    @contextmanager
+    def hold(self):
+        """Keep records buffered (no commits) while a load transaction is open"""
+        self._held += 1
+        try:
+            yield self
+        finally:
+            self._held -= 1
+
+
+def get_run_logger(etl_run, db):
+    """Return the RunLogger attached to an ETL run, creating it on first use"""
+    logger = getattr(etl_run, '_run_logger', None)
+    if logger is None:
+        logger = RunLogger(etl_run, db)
+        etl_run._run_logger = logger
+    return logger
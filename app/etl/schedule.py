@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+import re
+
+CATCHUP_POLICIES = ('skip', 'coalesce', 'run-all')
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+}
+
+# (name, min, max) of the five cron fields
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 7),
+)
+
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+INTERVAL_PATTERN = re.compile(r'^every\s+(\d+)\s*([smhd])$', re.IGNORECASE)
+
+
+def _parse_cron_field(text, name, low, high):
+    """Expand one cron field ('*', '5', '1-5', '*/15', '1,3,5', '10-40/10') into a set"""
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise ValueError(f'Invalid step in {name} field: {text}')
+            step = int(step_text)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            if not start_text.isdigit() or not end_text.isdigit():
+                raise ValueError(f'Invalid range in {name} field: {text}')
+            start, end = int(start_text), int(end_text)
+        elif part.isdigit():
+            start = end = int(part)
+            if step > 1:
+                end = high
+        else:
+            raise ValueError(f'Invalid {name} field: {text}')
+        if start < low or end > high or start > end:
+            raise ValueError(f'{name.capitalize()} field out of range ({low}-{high}): {text}')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """A standard five-field cron expression, evaluated in UTC.
+
+    As in cron, when both day of month and day of week are restricted a day
+    matches if either one does.
+    """
+
+    def __init__(self, expression):
+        self.expression = CRON_ALIASES.get(expression.strip().lower(), expression.strip())
+        fields = self.expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields (minute hour day month weekday): {expression}')
+        parsed = [_parse_cron_field(field, *spec) for field, spec in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # Sunday is both 0 and 7; Python counts Monday as 0
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self.days_restricted = fields[2] != '*'
+        self.weekdays_restricted = fields[4] != '*'
+
+    def _day_matches(self, moment):
+        day_match = moment.day in self.days
+        weekday_match = moment.weekday() in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        return day_match and weekday_match
+
+    def next_after(self, moment):
+        """First fire time strictly after moment"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=366 * 5)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f'Cron expression never fires: {self.expression}')
+
+
+class IntervalSchedule:
+    """A fixed interval such as 'every 15m', counted from the previous fire time"""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError('Interval must be positive')
+        self.interval = timedelta(seconds=seconds)
+
+    def next_after(self, moment):
+        return moment + self.interval
+
+
+def parse_schedule(text):
+    """Parse a job schedule: 'every 30m' / 'every 2h' or a cron expression.
+
+    Raises ValueError if the schedule is invalid.
+    """
+    text = (text or '').strip()
+    match = INTERVAL_PATTERN.match(text)
+    if match:
+        return IntervalSchedule(int(match.group(1)) * INTERVAL_UNITS[match.group(2).lower()])
+    return CronSchedule(text)
+
+
+def first_fire(schedule, now=None):
+    """First fire time of a newly scheduled job"""
+    return schedule.next_after(now or datetime.utcnow())
@@ -0,0 +1,202 @@
+from datetime import datetime
+from sqlalchemy import update
+import heapq
+import threading
+
+from app import db
+from app.models import Job, ETLRun
+from app.etl.schedule import parse_schedule, first_fire
+from app.etl.control import fail_stale_runs
+
+
+def has_active_run(job_id):
+    """Check whether a job already has a queued or running run"""
+    return db.session.query(ETLRun.id).filter(ETLRun.job_id == job_id,
+                                              ETLRun.status.in_(ETLRun.ACTIVE_STATUSES)).first() is not None
+
+
+def dispatch_due_job(job, now, catchup=None, misfire_grace=60):
+    """Queue a run of a scheduled job whose next_run_at has passed.
+
+    The missed-fire policy decides what happens when fires were missed (the
+    app was down, or the previous run was still going):
+
+    - 'skip': missed fires are dropped; a run is only queued if the fire is
+      less than misfire_grace seconds late and the job is idle
+    - 'coalesce': all missed fires are collapsed into a single run
+    - 'run-all': each missed fire gets its own run, one after another
+
+    A job with a queued or running run never gets a second one; with
+    'coalesce' and 'run-all' the fire waits until that run has finished. Runs
+    abandoned by a process that died are failed first, so they cannot keep
+    the job busy forever. The new
+    next_run_at is claimed with a compare-and-set on the old value, so only
+    one scheduler wins when several processes run one. Returns the queued
+    ETLRun, or None.
+    """
+    schedule = parse_schedule(job.schedule)
+    policy = job.catchup_policy or catchup or 'coalesce'
+    due = job.next_run_at
+    busy = has_active_run(job.id)
+    if busy:
+        fail_stale_runs(db, ETLRun.query.filter(ETLRun.job_id == job.id), now=now)
+        busy = has_active_run(job.id)
+    if busy and policy != 'skip':
+        # Keep the fire; it is dispatched once the current run has finished
+        return None
+
+    if policy == 'run-all':
+        next_run_at = schedule.next_after(due)
+        run = True
+    else:
+        next_run_at = schedule.next_after(max(due, now))
+        run = not busy and (policy == 'coalesce' or (now - due).total_seconds() <= misfire_grace)
+
+    claimed = db.session.execute(
+        update(Job).where(Job.id == job.id, Job.next_run_at == due).values(next_run_at=next_run_at)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return None
+
+    etl_run = None
+    if run:
+        etl_run = ETLRun(job_id=job.id, status='queued', queued_at=now, trigger='schedule')
+        db.session.add(etl_run)
+    db.session.commit()
+    return etl_run
+
+
+class Scheduler:
+    """Starts ETL runs for jobs with a schedule from a background thread.
+
+    Due jobs are kept in a min-heap ordered by their next fire time; the
+    thread sleeps until the earliest one (or until ``wake()`` is called after
+    a schedule changes) and rebuilds the heap from the database every
+    ``ETL_SCHEDULER_REFRESH`` seconds, after failing the runs abandoned by
+    processes that died (at start-up too). At most ``ETL_SCHEDULER_MAX_CONCURRENT``
+    runs are in flight in the executor; further due jobs wait for the next
+    tick. Enable it with ``ETL_SCHEDULER_ENABLED``; the thread starts with the
+    first request the app serves.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._heap = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['etl_scheduler'] = self
+        if app.config.get('ETL_SCHEDULER_ENABLED'):
+            # Started with the first request, so scripts that only create the app
+            # (and create the tables afterwards) do not run it
+            app.before_request(self._ensure_started)
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='etl-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wake(self):
+        """Reload the schedules now (call after a job's schedule changes)"""
+        self._wake.set()
+
+    def _load(self):
+        """Rebuild the heap from the scheduled jobs, giving new schedules their first fire time"""
+        now = datetime.utcnow()
+        heap = []
+        for job in Job.query.filter(Job.schedule.isnot(None)).all():
+            if job.next_run_at is None:
+                try:
+                    job.next_run_at = first_fire(parse_schedule(job.schedule), now)
+                except ValueError as e:
+                    self.app.logger.warning(f'Invalid schedule for job {job.id}: {e}')
+                    continue
+            heap.append((job.next_run_at, job.id))
+        db.session.commit()
+        heapq.heapify(heap)
+        self._heap = heap
+
+    def tick(self, now=None):
+        """Dispatch every job that is due and return the runs that were queued"""
+        from app.etl.executor import executor
+
+        now = now or datetime.utcnow()
+        config = self.app.config
+        limit = config.get('ETL_SCHEDULER_MAX_CONCURRENT') or config.get('ETL_MAX_WORKERS', 4)
+        queued = []
+        deferred = []
+        while self._heap and self._heap[0][0] <= now:
+            if executor.queue_depth() + executor.in_flight() >= limit:
+                break
+            due, job_id = heapq.heappop(self._heap)
+            job = db.session.get(Job, job_id)
+            if job is None or not job.schedule or job.next_run_at is None or job.next_run_at > now:
+                continue
+            try:
+                etl_run = dispatch_due_job(job, now, config.get('ETL_SCHEDULER_CATCHUP'),
+                                           config.get('ETL_SCHEDULER_MISFIRE_GRACE', 60))
+            except ValueError as e:
+                db.session.rollback()
+                self.app.logger.warning(f'Invalid schedule for job {job_id}: {e}')
+                continue
+            if etl_run is not None:
+                executor.submit(etl_run.id)
+                queued.append(etl_run)
+            elif job.next_run_at == due:
+                # The job is still busy; try again on the next poll
+                deferred.append((due, job_id))
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return queued
+
+    def sweep(self):
+        """Fail runs and pipeline runs abandoned by a process that died or restarted"""
+        from app.etl.control import sweep_abandoned_runs
+
+        stale_runs, stale_pipeline_runs = sweep_abandoned_runs(db)
+        if stale_runs or stale_pipeline_runs:
+            self.app.logger.warning(f'Failed {len(stale_runs)} abandoned run(s) and '
+                                    f'{len(stale_pipeline_runs)} abandoned pipeline run(s)')
+
+    def _run(self):
+        refresh = self.app.config.get('ETL_SCHEDULER_REFRESH', 30)
+        poll = self.app.config.get('ETL_SCHEDULER_POLL', 5)
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self.sweep()
+                    self._load()
+                    self.tick()
+                    # Jobs that could not be dispatched yet are retried after a short poll
+                    wait = refresh
+                    if self._heap:
+                        until_next = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+                        wait = min(refresh, until_next if until_next > 0 else poll)
+                except Exception as e:
+                    self.app.logger.warning(f'Scheduler tick failed: {e}')
+                    wait = refresh
+                finally:
+                    db.session.remove()
+            self._wake.wait(timeout=wait)
+            self._wake.clear()
+
+
+scheduler = Scheduler()
@@ -1,6 +1,6 @@
 import pandas as pd
-from app.models import ETLLog
-from datetime import datetime
+from app.etl.errors import StageError
+from app.etl.runlog import get_run_logger
 import re
 import json
 
@@ -38,19 +38,43 @@ def flatten_nested_data(df):
     return flattened_df
 
 
+def clean_chunk(df):
+    """Apply the standard cleaning steps to a DataFrame without logging.
+
+    Returns the cleaned DataFrame and the number of empty rows dropped.
+    """
+    df.columns = [clean_column_name(col) for col in df.columns]
+    df = flatten_nested_data(df)
+    rows_before = len(df)
+    df = df.dropna(how='all').reset_index(drop=True)
+    return df, rows_before - len(df)
+
+
+def transform_chunks(chunks, etl_run, db):
+    """Transform a stream of DataFrame chunks, yielding each cleaned chunk"""
+    log = get_run_logger(etl_run, db)
+    log.info('transform', 'Starting streaming data transformation')
+
+    rows_dropped = 0
+    for chunk in chunks:
+        try:
+            chunk, dropped = clean_chunk(chunk)
+        except Exception as e:
+            raise StageError('transform', f'Transformation failed: {str(e)}')
+        rows_dropped += dropped
+        etl_run.rows_transformed = (etl_run.rows_transformed or 0) + len(chunk)
+        yield chunk
+
+    log.info('transform', f'Transformation completed: {etl_run.rows_extracted} -> {etl_run.rows_transformed} rows '
+                          f'({rows_dropped} completely empty rows dropped)')
+
+
 def transform_data(df, etl_run, db):
     """Transform the extracted data"""
+    log = get_run_logger(etl_run, db)
     try:
         # Log transformation start
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='transform',
-            message='Starting data transformation',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.info('transform', 'Starting data transformation')
         
         initial_rows = len(df)
         
@@ -59,29 +83,13 @@ def transform_data(df, etl_run, db):
         df.columns = [clean_column_name(col) for col in df.columns]
         cleaned_columns = df.columns.tolist()
         
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='transform',
-            message=f'Cleaned column names: {len(original_columns)} columns processed',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.info('transform', f'Cleaned column names: {len(original_columns)} columns processed')
         
         # Flatten nested data structures (dicts, lists) to JSON strings
         nested_cols = [col for col in df.columns if df[col].apply(lambda x: isinstance(x, (dict, list))).any()]
         if nested_cols:
             df = flatten_nested_data(df)
-            log = ETLLog(
-                etl_run_id=etl_run.id,
-                stage='transform',
-                message=f'Flattened {len(nested_cols)} nested columns to JSON strings: {", ".join(nested_cols)}',
-                log_level='info',
-                timestamp=datetime.utcnow()
-            )
-            db.session.add(log)
-            db.session.commit()
+            log.info('transform', f'Flattened {len(nested_cols)} nested columns to JSON strings: {", ".join(nested_cols)}')
         
         # Drop rows that are completely empty
         df_before_drop = len(df)
@@ -89,15 +97,7 @@ def transform_data(df, etl_run, db):
         rows_dropped = df_before_drop - len(df)
         
         if rows_dropped > 0:
-            log = ETLLog(
-                etl_run_id=etl_run.id,
-                stage='transform',
-                message=f'Dropped {rows_dropped} completely empty rows',
-                log_level='info',
-                timestamp=datetime.utcnow()
-            )
-            db.session.add(log)
-            db.session.commit()
+            log.info('transform', f'Dropped {rows_dropped} completely empty rows')
         
         # Reset index after dropping rows
         df = df.reset_index(drop=True)
@@ -105,28 +105,12 @@ def transform_data(df, etl_run, db):
         final_rows = len(df)
         
         # Log success
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='transform',
-            message=f'Transformation completed: {initial_rows} -> {final_rows} rows',
-            log_level='info',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
+        log.info('transform', f'Transformation completed: {initial_rows} -> {final_rows} rows')
         etl_run.rows_transformed = final_rows
-        db.session.commit()
         
         return df, None
     
     except Exception as e:
         error_msg = f'Transformation failed: {str(e)}'
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='transform',
-            message=error_msg,
-            log_level='error',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
+        log.error('transform', error_msg)
         return None, error_msg
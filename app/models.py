@@ -28,8 +28,19 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
 
+# Upstream jobs whose tables a job reads: job_id runs after upstream_id
+job_dependencies = db.Table(
+    'job_dependencies',
+    db.Column('job_id', db.Integer, db.ForeignKey('jobs.id'), primary_key=True),
+    db.Column('upstream_id', db.Integer, db.ForeignKey('jobs.id'), primary_key=True),
+)
+
+
 class Job(db.Model):
     __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_user_created', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -38,10 +49,27 @@ class Job(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     table_name = db.Column(db.String(100), unique=True)  # Name of the table where data is loaded
-    load_mode = db.Column(db.String(20), default='replace')  # 'replace' or 'append'
+    load_mode = db.Column(db.String(20), default='replace')  # 'replace', 'append' or 'merge'
+    key_columns = db.Column(db.String(500))  # Comma-separated key columns for merge mode
+    index_specs = db.Column(db.Text)  # Indexes to build after each load, e.g. 'city; unique: email'
+    row_count = db.Column(db.Integer)  # Rows in the target table, updated by each load
+    chunk_size = db.Column(db.Integer)  # Rows per chunk in streaming mode (None = load whole file)
+    schedule = db.Column(db.String(100))  # Cron expression or interval such as 'every 30m' (None = manual only)
+    catchup_policy = db.Column(db.String(20))  # Missed fires: 'skip', 'coalesce' or 'run-all' (None = config default)
+    next_run_at = db.Column(db.DateTime)  # Next scheduled fire time (UTC)
+    timeout_seconds = db.Column(db.Integer)  # Runs are stopped after this long (None = config default)
     
     data_source = db.relationship('DataSource', backref='job', uselist=False, cascade='all, delete-orphan')
     etl_runs = db.relationship('ETLRun', backref='job', lazy=True, cascade='all, delete-orphan')
+    pipeline_runs = db.relationship('PipelineRun', backref='job', lazy=True, cascade='all, delete-orphan')
+    upstream_jobs = db.relationship('Job', secondary=job_dependencies,
+                                    primaryjoin=id == job_dependencies.c.job_id,
+                                    secondaryjoin=id == job_dependencies.c.upstream_id,
+                                    backref='downstream_jobs', order_by='Job.name')
+    
+    def get_key_columns(self):
+        """Return the merge key columns as a list"""
+        return [column.strip() for column in (self.key_columns or '').split(',') if column.strip()]
     
     def __repr__(self):
         return f'<Job {self.name}>'
@@ -56,11 +84,28 @@ class DataSource(db.Model):
     
     # For CSV uploads
     file_path = db.Column(db.String(500))
+    file_size = db.Column(db.BigInteger)  # Size and mtime seen when content_hash was computed
+    file_mtime = db.Column(db.Float)
+    content_hash = db.Column(db.String(64))  # SHA-256 of the file contents
+    loaded_fingerprint = db.Column(db.String(64))  # Input + job config fingerprint of the last successful load
     
     # For API sources
     api_url = db.Column(db.String(500))
     api_format = db.Column(db.String(20))  # 'json' or 'csv'
     
+    # Pagination for JSON API sources
+    pagination_type = db.Column(db.String(20))  # None, 'offset', 'page', 'cursor' or 'link'
+    page_size = db.Column(db.Integer)
+    page_param = db.Column(db.String(50))  # Offset, page number or cursor query parameter
+    size_param = db.Column(db.String(50))  # Page size query parameter
+    cursor_path = db.Column(db.String(200))  # Dotted path to the next cursor in the response
+    max_pages = db.Column(db.Integer)
+    
+    # Conditional fetch cache for API sources
+    etag = db.Column(db.String(200))
+    last_modified = db.Column(db.String(100))
+    cache_body = db.Column(db.Boolean, default=False)  # Keep a gzip copy of the last body for replay
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def __repr__(self):
@@ -69,25 +114,129 @@ class DataSource(db.Model):
 
 class ETLRun(db.Model):
     __tablename__ = 'etl_runs'
+    __table_args__ = (
+        db.Index('ix_etl_runs_job_started', 'job_id', 'started_at'),
+        db.Index('ix_etl_runs_status_started', 'status', 'started_at'),
+        db.Index('ix_etl_runs_started', 'started_at', 'id'),
+        db.Index('ix_etl_runs_pipeline_run', 'pipeline_run_id'),
+    )
+    
+    # A run is active until it reaches one of the finished statuses
+    ACTIVE_STATUSES = ('queued', 'running')
+    FINISHED_STATUSES = ('success', 'failed', 'unchanged', 'skipped', 'cancelled', 'rejected')
     
     id = db.Column(db.Integer, primary_key=True)
     job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False)
-    status = db.Column(db.String(20), nullable=False)  # 'running', 'success', 'failed'
+    status = db.Column(db.String(20), nullable=False)  # One of ACTIVE_STATUSES or FINISHED_STATUSES
+    force = db.Column(db.Boolean, default=False)  # Run even if the source is unchanged
+    trigger = db.Column(db.String(20), default='manual')  # 'manual', 'schedule', 'pipeline' or 'cli'
+    pipeline_run_id = db.Column(db.Integer, db.ForeignKey('pipeline_runs.id'))  # Set for runs started by a pipeline
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
     completed_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # Written periodically while the run executes
+    cancel_requested = db.Column(db.Boolean, default=False)  # Set to stop the run at its next check point
     rows_extracted = db.Column(db.Integer, default=0)
     rows_transformed = db.Column(db.Integer, default=0)
     rows_loaded = db.Column(db.Integer, default=0)
+    rows_per_second = db.Column(db.Float)  # Load throughput of the run
+    rows_inserted = db.Column(db.Integer)  # Merge mode only
+    rows_updated = db.Column(db.Integer)
+    rows_unchanged = db.Column(db.Integer)
     error_message = db.Column(db.Text)
+    compacted_at = db.Column(db.DateTime)  # Set when the run's detailed logs were pruned
+    log_count = db.Column(db.Integer)  # Log summary kept after compaction
+    warning_count = db.Column(db.Integer)
+    error_count = db.Column(db.Integer)
     
     logs = db.relationship('ETLLog', backref='etl_run', lazy=True, cascade='all, delete-orphan')
+    stage_metrics = db.relationship('ETLStageMetric', backref='etl_run', lazy=True, cascade='all, delete-orphan',
+                                    order_by='ETLStageMetric.id')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_id': self.job_id,
+            'status': self.status,
+            'queued_at': self.queued_at.isoformat() if self.queued_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'heartbeat_at': self.heartbeat_at.isoformat() if self.heartbeat_at else None,
+            'cancel_requested': bool(self.cancel_requested),
+            'rows_extracted': self.rows_extracted,
+            'rows_transformed': self.rows_transformed,
+            'rows_loaded': self.rows_loaded,
+            'rows_per_second': self.rows_per_second,
+            'rows_inserted': self.rows_inserted,
+            'rows_updated': self.rows_updated,
+            'rows_unchanged': self.rows_unchanged,
+            'error_message': self.error_message,
+            'force': bool(self.force),
+            'trigger': self.trigger,
+            'pipeline_run_id': self.pipeline_run_id,
+            'compacted': self.compacted_at is not None,
+            'stage_metrics': [metric.to_dict() for metric in self.stage_metrics],
+        }
     
     def __repr__(self):
         return f'<ETLRun {self.id} - {self.status}>'
 
 
+class PipelineRun(db.Model):
+    """One run of a job together with all of its upstream jobs"""
+    __tablename__ = 'pipeline_runs'
+    __table_args__ = (
+        db.Index('ix_pipeline_runs_job_started', 'job_id', 'started_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('jobs.id'), nullable=False)  # The job the pipeline ends at
+    status = db.Column(db.String(20), nullable=False)  # 'queued', 'running', 'success', 'failed'
+    force = db.Column(db.Boolean, default=False)  # Force every run of the pipeline
+    queued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    error_message = db.Column(db.Text)
+    
+    etl_runs = db.relationship('ETLRun', backref='pipeline_run', lazy=True, order_by='ETLRun.id')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_id': self.job_id,
+            'status': self.status,
+            'force': bool(self.force),
+            'queued_at': self.queued_at.isoformat() if self.queued_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'error_message': self.error_message,
+            'runs': [{'id': run.id, 'job_id': run.job_id, 'status': run.status} for run in self.etl_runs],
+        }
+    
+    def __repr__(self):
+        return f'<PipelineRun {self.id} - {self.status}>'
+
+
+class TableLock(db.Model):
+    """Lease on a target table, held by the one run allowed to write it"""
+    __tablename__ = 'table_locks'
+    
+    table_name = db.Column(db.String(100), primary_key=True)
+    etl_run_id = db.Column(db.Integer, db.ForeignKey('etl_runs.id'), nullable=False)
+    acquired_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)  # Renewed by the holder's heartbeats
+    
+    def __repr__(self):
+        return f'<TableLock {self.table_name} - run {self.etl_run_id}>'
+
+
 class ETLLog(db.Model):
     __tablename__ = 'etl_logs'
+    __table_args__ = (
+        db.Index('ix_etl_logs_run_timestamp', 'etl_run_id', 'timestamp'),
+        db.Index('ix_etl_logs_stage_timestamp', 'stage', 'timestamp'),
+        db.Index('ix_etl_logs_timestamp', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     etl_run_id = db.Column(db.Integer, db.ForeignKey('etl_runs.id'), nullable=False)
@@ -98,3 +247,32 @@ class ETLLog(db.Model):
     
     def __repr__(self):
         return f'<ETLLog {self.stage} - {self.log_level}>'
+
+
+class ETLStageMetric(db.Model):
+    __tablename__ = 'etl_stage_metrics'
+    __table_args__ = (
+        db.Index('ix_etl_stage_metrics_run_stage', 'etl_run_id', 'stage'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    etl_run_id = db.Column(db.Integer, db.ForeignKey('etl_runs.id'), nullable=False)
+    stage = db.Column(db.String(20), nullable=False)  # 'extract', 'transform', 'load'
+    wall_seconds = db.Column(db.Float, nullable=False)
+    cpu_seconds = db.Column(db.Float, nullable=False)
+    rows = db.Column(db.Integer)
+    rows_per_second = db.Column(db.Float)
+    peak_memory_bytes = db.Column(db.BigInteger)  # Peak traced memory while the stage ran
+    
+    def to_dict(self):
+        return {
+            'stage': self.stage,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'rows': self.rows,
+            'rows_per_second': self.rows_per_second,
+            'peak_memory_bytes': self.peak_memory_bytes,
+        }
+    
+    def __repr__(self):
+        return f'<ETLStageMetric {self.stage} for Run {self.etl_run_id}>'
@@ -0,0 +1,233 @@
+from flask import Response, g, request
+from sqlalchemy import func
+import os
+import threading
+import time
+
+try:
+    import prometheus_client
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:  # prometheus_client is optional; a minimal in-process registry is used instead
+    prometheus_client = None
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+ROW_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class _Metric:
+    """Base of the fallback metrics: a value per label combination"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            lines.extend(child.render(self.name, dict(zip(self.labelnames, key))))
+        return lines
+
+
+class _CounterValue:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name, labels):
+        return [f'{name}_total{_format_labels(labels)} {_format_value(self.value)}']
+
+
+class _Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterValue()
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def render(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(dict(labels, le=_format_value(float(bound))))} {cumulative}')
+        lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+        return lines
+
+
+class _Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets)) + (float('inf'),)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+
+if prometheus_client is not None:
+    Counter, Histogram = prometheus_client.Counter, prometheus_client.Histogram
+else:
+    Counter, Histogram = _Counter, _Histogram
+
+RUNS = Counter('etl_runs', 'Finished ETL runs by final status', ['status'])
+STAGE_FAILURES = Counter('etl_stage_failures', 'Failed ETL runs by the stage that failed', ['stage'])
+STAGE_DURATION = Histogram('etl_stage_duration_seconds', 'Wall time of ETL stages', ['stage'],
+                           buckets=STAGE_BUCKETS)
+STAGE_ROWS = Histogram('etl_stage_rows', 'Rows processed by ETL stages', ['stage'], buckets=ROW_BUCKETS)
+REQUESTS = Counter('etl_http_requests', 'Web requests by route and response status',
+                   ['endpoint', 'method', 'status'])
+REQUEST_LATENCY = Histogram('etl_http_request_duration_seconds', 'Web request latency by route',
+                            ['endpoint', 'method'], buckets=LATENCY_BUCKETS)
+METRICS = (RUNS, STAGE_FAILURES, STAGE_DURATION, STAGE_ROWS, REQUESTS, REQUEST_LATENCY)
+
+
+def record_run(etl_run, failed_stage=None):
+    """Count a finished run and observe its stage metrics"""
+    RUNS.labels(status=etl_run.status).inc()
+    if etl_run.status == 'failed':
+        STAGE_FAILURES.labels(stage=failed_stage or 'general').inc()
+    for metric in etl_run.stage_metrics:
+        STAGE_DURATION.labels(stage=metric.stage).observe(metric.wall_seconds)
+        if metric.rows is not None:
+            STAGE_ROWS.labels(stage=metric.stage).observe(metric.rows)
+
+
+def run_gauges():
+    """Queued and running runs, counted in the database so every process agrees"""
+    from app import db
+    from app.models import ETLRun
+
+    counts = dict(db.session.query(ETLRun.status, func.count(ETLRun.id))
+                  .filter(ETLRun.status.in_(ETLRun.ACTIVE_STATUSES))
+                  .group_by(ETLRun.status).all())
+    db.session.commit()
+    return {
+        'etl_queue_depth': ('ETL runs waiting for a worker', counts.get('queued', 0)),
+        'etl_runs_in_flight': ('ETL runs currently executing', counts.get('running', 0)),
+    }
+
+
+class _GaugeCollector:
+    """prometheus_client collector exposing run_gauges()"""
+
+    def collect(self):
+        for name, (documentation, value) in run_gauges().items():
+            yield GaugeMetricFamily(name, documentation, value=value)
+
+
+def render_metrics():
+    """Render all metrics in the Prometheus text format.
+
+    With prometheus_client and PROMETHEUS_MULTIPROC_DIR set, the values
+    written by every worker process are aggregated; otherwise only this
+    process's values are reported.
+    """
+    if prometheus_client is None:
+        lines = []
+        for metric in METRICS:
+            lines.extend(metric.render())
+        for name, (documentation, value) in run_gauges().items():
+            lines.extend([f'# HELP {name} {documentation}', f'# TYPE {name} gauge', f'{name} {value}'])
+        return '\n'.join(lines) + '\n', CONTENT_TYPE
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.CollectorRegistry()
+        for metric in METRICS:
+            registry.register(metric)
+    registry.register(_GaugeCollector())
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+class Monitoring:
+    """Times web requests and serves the metrics at ``/metrics``"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('METRICS_WEB_WORKERS', 1) > 1 and (
+                prometheus_client is None or not os.environ.get('PROMETHEUS_MULTIPROC_DIR')):
+            app.logger.warning('/metrics only reports the worker process that answers each scrape; install '
+                               'prometheus_client and set PROMETHEUS_MULTIPROC_DIR to aggregate all '
+                               f'{app.config["METRICS_WEB_WORKERS"]} workers')
+        app.before_request(self._start_timer)
+        app.after_request(self._record_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['etl_monitoring'] = self
+
+    def _start_timer(self):
+        g._request_started = time.perf_counter()
+
+    def _record_request(self, response):
+        started = g.pop('_request_started', None)
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.labels(endpoint=endpoint, method=request.method).observe(time.perf_counter() - started)
+            REQUESTS.labels(endpoint=endpoint, method=request.method, status=response.status_code).inc()
+        return response
+
+    def metrics_view(self):
+        body, content_type = render_metrics()
+        return Response(body, content_type=content_type)
+
+
+monitoring = Monitoring()
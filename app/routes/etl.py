@@ -1,87 +1,200 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, request
+from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, request, Response, stream_with_context
 from flask_login import login_required, current_user
 from app import db
-from app.models import Job, ETLRun, ETLLog
-from app.etl import extract_data, transform_data, load_data
+from app.models import Job, ETLRun, ETLLog, PipelineRun
+from app.etl.executor import executor
+from app.etl.load import table_exists
+from app.etl.query import fetch_page, iter_page, count_rows, parse_filter, compile_filters, table_columns, \
+    encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.etl.export import export_table, export_filename, available_formats, EXPORT_FORMATS
+from app.etl.dag import build_pipeline, CycleError
+from app.etl.control import request_cancel
+from app.etl.locks import table_lock_holder
+from sqlalchemy import func, or_, and_, update
+from sqlalchemy.orm import joinedload
 from datetime import datetime
-import pandas as pd
-from sqlalchemy import create_engine, text
 from flask import current_app
+import json
 
 bp = Blueprint('etl', __name__, url_prefix='/etl')
 
+RUNS_PER_PAGE = 50
+
+def _wants_json():
+    """Check whether the client asked for a JSON response"""
+    return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+
 @bp.route('/run/<int:job_id>', methods=['POST'])
 @login_required
 def run_etl(job_id):
     job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
     
-    # Create ETL run record
+    # Another run is loading this job's table
+    holder = table_lock_holder(db, job.table_name)
+    if holder and current_app.config.get('ETL_TABLE_LOCK_POLICY') == 'reject':
+        message = f'Job is already running (run #{holder}). Try again once it has finished.'
+        if _wants_json():
+            return jsonify(error=message, holder_run_id=holder), 409
+        flash(message, 'warning')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    
+    # Create ETL run record and hand it to the background executor
+    data = request.get_json(silent=True) or request.form
     etl_run = ETLRun(
         job_id=job.id,
-        status='running',
-        started_at=datetime.utcnow()
+        status='queued',
+        queued_at=datetime.utcnow(),
+        force=str(data.get('force', '')).lower() in ('1', 'true', 'on', 'yes')
     )
     db.session.add(etl_run)
     db.session.commit()
     
-    try:
-        # Extract
-        df, error = extract_data(job.data_source, etl_run, db)
-        if error:
-            etl_run.status = 'failed'
-            etl_run.error_message = error
-            etl_run.completed_at = datetime.utcnow()
-            db.session.commit()
-            flash(f'ETL failed during extraction: {error}', 'danger')
-            return redirect(url_for('jobs.view_job', job_id=job.id))
-        
-        # Transform
-        df, error = transform_data(df, etl_run, db)
-        if error:
-            etl_run.status = 'failed'
-            etl_run.error_message = error
-            etl_run.completed_at = datetime.utcnow()
-            db.session.commit()
-            flash(f'ETL failed during transformation: {error}', 'danger')
-            return redirect(url_for('jobs.view_job', job_id=job.id))
-        
-        # Load
-        error = load_data(df, job.table_name, etl_run, db, job.load_mode)
-        if error:
-            etl_run.status = 'failed'
-            etl_run.error_message = error
-            etl_run.completed_at = datetime.utcnow()
-            db.session.commit()
-            flash(f'ETL failed during loading: {error}', 'danger')
-            return redirect(url_for('jobs.view_job', job_id=job.id))
-        
-        # Success
-        etl_run.status = 'success'
-        etl_run.completed_at = datetime.utcnow()
-        db.session.commit()
-        
+    executor.submit(etl_run.id)
+    
+    if _wants_json():
+        return jsonify(run=etl_run.to_dict(),
+                       status_url=url_for('etl.run_status', run_id=etl_run.id)), 202
+    
+    # With the 'sync' executor the run has already finished
+    if etl_run.status == 'success':
         flash(f'ETL pipeline completed successfully! Processed {etl_run.rows_loaded} rows.', 'success')
         return redirect(url_for('etl.view_data', job_id=job.id))
+    if etl_run.status == 'failed':
+        flash(f'ETL pipeline failed: {etl_run.error_message}', 'danger')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    if etl_run.status == 'unchanged':
+        flash('Source unchanged since the last run. Nothing to load. Use "Force Run" to load it again.', 'info')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
     
-    except Exception as e:
-        etl_run.status = 'failed'
-        etl_run.error_message = str(e)
-        etl_run.completed_at = datetime.utcnow()
-        db.session.commit()
-        
-        # Log the error
-        log = ETLLog(
-            etl_run_id=etl_run.id,
-            stage='general',
-            message=f'Unexpected error: {str(e)}',
-            log_level='error',
-            timestamp=datetime.utcnow()
-        )
-        db.session.add(log)
-        db.session.commit()
-        
-        flash(f'ETL pipeline failed: {str(e)}', 'danger')
+    if etl_run.status == 'rejected':
+        flash(f'ETL run rejected: {etl_run.error_message}', 'warning')
         return redirect(url_for('jobs.view_job', job_id=job.id))
+    if holder:
+        flash(f'ETL run #{etl_run.id} queued behind run #{holder}, which is loading the same table.', 'info')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    
+    flash(f'ETL run #{etl_run.id} queued. This page will refresh when it completes.', 'info')
+    return redirect(url_for('jobs.view_job', job_id=job.id))
+
+
+@bp.route('/status/<int:run_id>')
+@login_required
+def run_status(run_id):
+    etl_run = ETLRun.query.get_or_404(run_id)
+    
+    # Verify user owns this job
+    if etl_run.job.user_id != current_user.id:
+        return jsonify(error='Access denied'), 403
+    
+    status = etl_run.to_dict()
+    status['active'] = executor.is_active(run_id)
+    return jsonify(status)
+
+
+@bp.route('/cancel/<int:run_id>', methods=['POST'])
+@login_required
+def cancel_run(run_id):
+    """Cancel a queued run, or ask a running one to stop at its next check point"""
+    etl_run = ETLRun.query.get_or_404(run_id)
+    
+    # Verify user owns this job
+    if etl_run.job.user_id != current_user.id:
+        if _wants_json():
+            return jsonify(error='Access denied'), 403
+        flash('Access denied', 'danger')
+        return redirect(url_for('main.index'))
+    
+    # A run executing in this process is stopped before anything is written, as
+    # its load may be holding the database's write lock until it rolls back
+    request_cancel(run_id)
+    
+    # Claimed with a conditional UPDATE so a run that just started or finished is not overwritten
+    cancelled = db.session.execute(
+        update(ETLRun).where(ETLRun.id == run_id, ETLRun.status == 'queued')
+        .values(status='cancelled', cancel_requested=True, completed_at=datetime.utcnow(),
+                error_message='Run cancelled by user')
+    ).rowcount
+    if not cancelled:
+        db.session.execute(update(ETLRun).where(ETLRun.id == run_id, ETLRun.status == 'running')
+                           .values(cancel_requested=True))
+    db.session.commit()
+    db.session.refresh(etl_run)
+    
+    if _wants_json():
+        return jsonify(run=etl_run.to_dict(),
+                       status_url=url_for('etl.run_status', run_id=etl_run.id)), 202
+    
+    if etl_run.status == 'cancelled':
+        flash(f'ETL run #{etl_run.id} cancelled.', 'info')
+    elif etl_run.status == 'running':
+        flash(f'Stopping ETL run #{etl_run.id}. Its partial load will be rolled back.', 'info')
+    else:
+        flash(f'ETL run #{etl_run.id} has already finished.', 'warning')
+    return redirect(url_for('jobs.view_job', job_id=etl_run.job_id))
+
+
+@bp.route('/pipeline/<int:job_id>', methods=['POST'])
+@login_required
+def run_pipeline(job_id):
+    """Run a job after all of its upstream jobs"""
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    
+    try:
+        build_pipeline(job)
+    except CycleError as e:
+        if _wants_json():
+            return jsonify(error=str(e)), 400
+        flash(str(e), 'danger')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    
+    data = request.get_json(silent=True) or request.form
+    pipeline_run = PipelineRun(
+        job_id=job.id,
+        status='queued',
+        queued_at=datetime.utcnow(),
+        force=str(data.get('force', '')).lower() in ('1', 'true', 'on', 'yes')
+    )
+    db.session.add(pipeline_run)
+    db.session.commit()
+    
+    executor.submit_pipeline(pipeline_run.id)
+    
+    if _wants_json():
+        return jsonify(pipeline_run=pipeline_run.to_dict(),
+                       status_url=url_for('etl.view_pipeline_run', pipeline_run_id=pipeline_run.id)), 202
+    
+    return redirect(url_for('etl.view_pipeline_run', pipeline_run_id=pipeline_run.id))
+
+
+@bp.route('/pipeline-runs/<int:pipeline_run_id>')
+@login_required
+def view_pipeline_run(pipeline_run_id):
+    pipeline_run = PipelineRun.query.get_or_404(pipeline_run_id)
+    
+    # Verify user owns this job
+    if pipeline_run.job.user_id != current_user.id:
+        if _wants_json():
+            return jsonify(error='Access denied'), 403
+        flash('Access denied', 'danger')
+        return redirect(url_for('main.index'))
+    
+    if _wants_json():
+        return jsonify(pipeline_run.to_dict())
+    
+    # Lay the runs out by the pipeline's current levels; jobs without a run are still waiting
+    runs = {run.job_id: run for run in pipeline_run.etl_runs}
+    try:
+        jobs, graph, levels = build_pipeline(pipeline_run.job)
+    except CycleError:
+        jobs, graph, levels = {run.job_id: run.job for run in pipeline_run.etl_runs}, {}, [sorted(runs)]
+    
+    return render_template('etl/pipeline_run.html',
+                         pipeline_run=pipeline_run,
+                         jobs=jobs,
+                         graph=graph,
+                         levels=levels,
+                         runs=runs)
 
 
 @bp.route('/data/<int:job_id>')
@@ -93,47 +206,129 @@ def view_data(job_id):
         flash('No data table exists for this job', 'warning')
         return redirect(url_for('jobs.view_job', job_id=job.id))
     
+    if not table_exists(db, job.table_name):
+        flash('Data table does not exist. Please run the ETL pipeline first.', 'warning')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    
+    # Page parameters
+    sort = request.args.get('sort') or None
+    descending = request.args.get('dir') == 'desc'
+    per_page = min(request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int) or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    
     try:
-        # Read data from the job's table
-        engine = create_engine(current_app.config['SQLALCHEMY_DATABASE_URI'])
-        
-        # Check if table exists
-        with engine.connect() as conn:
-            result = conn.execute(text(
-                f"SELECT name FROM sqlite_master WHERE type='table' AND name='{job.table_name}'"
-            ))
-            if not result.fetchone():
-                flash('Data table does not exist. Please run the ETL pipeline first.', 'warning')
-                return redirect(url_for('jobs.view_job', job_id=job.id))
-        
-        # Read data with limit for display
-        df = pd.read_sql_table(job.table_name, engine)
-        
-        # Convert to HTML table
-        if len(df) > 0:
-            # Limit to first 100 rows for display
-            display_df = df.head(100)
-            table_html = display_df.to_html(classes='table table-striped table-bordered table-hover', 
-                                           index=False, 
-                                           escape=False)
-            total_rows = len(df)
-            columns = df.columns.tolist()
-        else:
-            table_html = None
-            total_rows = 0
-            columns = []
+        with db.engine.connect() as conn:
+            # Only the requested page is read from the table
+            page = fetch_page(conn, job.table_name, sort=sort, descending=descending,
+                              after=request.args.get('after'), before=request.args.get('before'),
+                              limit=per_page)
+            
+            # Row count is cached at load time; count once if it is missing
+            if job.row_count is None:
+                job.row_count = count_rows(conn, job.table_name)
+                db.session.commit()
         
         return render_template('etl/view_data.html', 
                              job=job, 
-                             table_html=table_html,
-                             total_rows=total_rows,
-                             columns=columns)
+                             columns=page['columns'],
+                             rows=page['rows'],
+                             total_rows=job.row_count,
+                             next_cursor=page['next_cursor'],
+                             prev_cursor=page['prev_cursor'],
+                             sort=sort,
+                             descending=descending,
+                             per_page=per_page,
+                             export_formats=available_formats())
+    
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('etl.view_data', job_id=job.id))
     
     except Exception as e:
         flash(f'Error reading data: {str(e)}', 'danger')
         return redirect(url_for('jobs.view_job', job_id=job.id))
 
 
+@bp.route('/api/data/<int:job_id>')
+@login_required
+def query_data(job_id):
+    """Query a job's table as JSON.
+
+    Query parameters: columns=a,b  sort=col (or -col for descending)
+    filter=column:operator:value (repeatable)  limit=N  after=/before=cursor
+    """
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    
+    if not job.table_name or not table_exists(db, job.table_name):
+        return jsonify(error='Data table does not exist. Please run the ETL pipeline first.'), 404
+    
+    sort = request.args.get('sort') or None
+    descending = request.args.get('dir') == 'desc'
+    if sort and sort.startswith('-'):
+        sort, descending = sort[1:], True
+    columns = [column.strip() for column in request.args.get('columns', '').split(',') if column.strip()]
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int) or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    
+    # The connection stays open while the response streams the rows
+    conn = db.engine.connect()
+    try:
+        filters = [parse_filter(expression) for expression in request.args.getlist('filter')]
+        where, params = compile_filters(filters, table_columns(conn, job.table_name))
+        columns, rows, cursors = iter_page(conn, job.table_name, sort=sort, descending=descending,
+                                           after=request.args.get('after'), before=request.args.get('before'),
+                                           limit=limit, where=where, params=params, columns=columns or None)
+    except ValueError as e:
+        conn.close()
+        return jsonify(error=str(e)), 400
+    except Exception:
+        conn.close()
+        raise
+    
+    total_rows = job.row_count
+    
+    def generate():
+        # Rows are written as they are read from the database cursor
+        yield '{"columns": %s, "data": [' % json.dumps(columns)
+        for i, row in enumerate(rows):
+            yield (',' if i else '') + json.dumps(dict(zip(columns, row)), default=str)
+        yield '], "next_cursor": %s, "prev_cursor": %s, "total_rows": %s}' % (
+            json.dumps(cursors['next_cursor']), json.dumps(cursors['prev_cursor']), json.dumps(total_rows))
+    
+    response = Response(generate(), mimetype='application/json')
+    response.call_on_close(conn.close)
+    return response
+
+
+@bp.route('/export/<int:job_id>')
+@login_required
+def export_data(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    
+    if not job.table_name or not table_exists(db, job.table_name):
+        flash('Data table does not exist. Please run the ETL pipeline first.', 'warning')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    
+    fmt = request.args.get('format', 'csv').lower()
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'on', 'yes')
+    
+    if fmt not in available_formats():
+        if fmt == 'parquet':
+            flash('Parquet export requires pyarrow to be installed', 'warning')
+        else:
+            flash(f'Unsupported export format: {fmt}', 'warning')
+        return redirect(url_for('etl.view_data', job_id=job.id))
+    
+    # Rows are streamed from the database in batches; the table is never held in memory
+    chunks = export_table(db.engine, job.table_name, fmt, compress,
+                          current_app.config.get('ETL_EXPORT_BATCH_SIZE', 5000))
+    filename = export_filename(job.table_name, fmt, compress)
+    mimetype = 'application/gzip' if compress else EXPORT_FORMATS[fmt][0]
+    
+    return Response(stream_with_context(chunks),
+                    mimetype=mimetype,
+                    direct_passthrough=True,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
 @bp.route('/logs/<int:run_id>')
 @login_required
 def view_logs(run_id):
@@ -169,13 +364,40 @@ def logs_overview():
     if status:
         query = query.filter(ETLRun.status == status)
     
-    # Get ETL runs
-    etl_runs = query.order_by(ETLRun.started_at.desc()).all()
+    # Get statistics with one GROUP BY instead of loading every run
+    status_counts = dict(query.with_entities(ETLRun.status, func.count(ETLRun.id))
+                         .group_by(ETLRun.status).all())
+    total_runs = sum(status_counts.values())
+    successful_runs = status_counts.get('success', 0)
+    failed_runs = status_counts.get('failed', 0)
+    
+    # Page through runs newest first with a (started_at, id) cursor
+    after = request.args.get('after')
+    if after:
+        try:
+            started_at, run_id = decode_cursor(after)
+            started_at = datetime.fromisoformat(started_at)
+        except (TypeError, ValueError):
+            flash('Invalid page cursor', 'warning')
+            return redirect(url_for('etl.logs_overview', job_id=job_id, status=status, stage=stage))
+        query = query.filter(or_(ETLRun.started_at < started_at,
+                                 and_(ETLRun.started_at == started_at, ETLRun.id < run_id)))
+    
+    # Jobs and data sources are loaded with the runs rather than one query per row
+    etl_runs = (query.options(joinedload(ETLRun.job).joinedload(Job.data_source))
+                .order_by(ETLRun.started_at.desc(), ETLRun.id.desc())
+                .limit(RUNS_PER_PAGE + 1).all())
+    next_cursor = None
+    if len(etl_runs) > RUNS_PER_PAGE:
+        etl_runs = etl_runs[:RUNS_PER_PAGE]
+        next_cursor = encode_cursor(etl_runs[-1].started_at.isoformat(), etl_runs[-1].id)
     
-    # Get statistics
-    total_runs = len(etl_runs)
-    successful_runs = sum(1 for run in etl_runs if run.status == 'success')
-    failed_runs = sum(1 for run in etl_runs if run.status == 'failed')
+    # Log entries per run on this page
+    log_counts = {}
+    if etl_runs:
+        log_counts = dict(db.session.query(ETLLog.etl_run_id, func.count(ETLLog.id))
+                          .filter(ETLLog.etl_run_id.in_([run.id for run in etl_runs]))
+                          .group_by(ETLLog.etl_run_id).all())
     
     # Get recent logs
     logs_query = ETLLog.query.join(ETLRun).join(Job).filter(Job.user_id == current_user.id)
@@ -186,11 +408,13 @@ def logs_overview():
     
     # Get recent logs (last 50)
     recent_logs = logs_query.order_by(ETLLog.timestamp.desc()).limit(50).all()
-    total_logs = logs_query.count()
+    total_logs = logs_query.with_entities(func.count(ETLLog.id)).scalar()
     
     return render_template('etl/logs_overview.html',
                          jobs=jobs,
                          etl_runs=etl_runs,
+                         log_counts=log_counts,
+                         next_cursor=next_cursor,
                          recent_logs=recent_logs,
                          total_runs=total_runs,
                          successful_runs=successful_runs,
@@ -1,9 +1,18 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required, current_user
 from app import db
-from app.models import Job, DataSource, ETLRun
+from sqlalchemy.orm import selectinload
+from app.models import Job, DataSource, ETLRun, PipelineRun
 from app.utils import save_uploaded_file, generate_table_name, validate_url
-from datetime import datetime, timedelta
+from app.etl.control import fail_stale_runs, fail_stale_pipeline_runs
+from app.etl.transform import clean_column_name
+from app.etl.indexes import parse_index_specs, format_index_specs
+from app.etl.pagination import PAGINATION_TYPES
+from app.etl.http_cache import delete_cached_body
+from app.etl.frame_cache import delete_cached_frame
+from app.etl.schedule import parse_schedule, first_fire, CATCHUP_POLICIES
+from app.etl.scheduler import scheduler
+from app.etl.dag import build_pipeline, CycleError
 
 bp = Blueprint('jobs', __name__, url_prefix='/jobs')
 
@@ -14,6 +23,24 @@ def list_jobs():
     return render_template('jobs/list.html', jobs=jobs)
 
 
+def _read_schedule_form():
+    """Read and validate the schedule fields of a job form.
+
+    Returns (schedule, catchup_policy, error); schedule is None when the
+    job is only run by hand.
+    """
+    schedule = (request.form.get('schedule') or '').strip() or None
+    catchup_policy = request.form.get('catchup_policy') or None
+    if catchup_policy and catchup_policy not in CATCHUP_POLICIES:
+        return None, None, 'Invalid missed-run policy'
+    if schedule:
+        try:
+            first_fire(parse_schedule(schedule))
+        except ValueError as e:
+            return None, None, f'Invalid schedule: {e}'
+    return schedule, catchup_policy, None
+
+
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
 def create_job():
@@ -33,13 +60,61 @@ def create_job():
         
         # Get load mode
         load_mode = request.form.get('load_mode', 'replace')
+        if load_mode not in ['replace', 'append', 'merge']:
+            flash('Invalid load mode', 'danger')
+            return render_template('jobs/create.html')
+        
+        # Merge mode needs key columns, named as they appear after transformation
+        key_columns = None
+        if load_mode == 'merge':
+            keys = [clean_column_name(column) for column in request.form.get('key_columns', '').split(',')
+                    if column.strip()]
+            if not keys:
+                flash('Merge mode requires at least one key column', 'danger')
+                return render_template('jobs/create.html')
+            key_columns = ','.join(dict.fromkeys(keys))
+        
+        # Indexes built on the target table after each load
+        index_specs = format_index_specs(parse_index_specs(request.form.get('index_specs'))) or None
+        
+        # Streaming mode (CSV files and single-request JSON APIs)
+        chunk_size = None
+        if source_type == 'csv' and request.form.get('streaming'):
+            chunk_size = request.form.get('chunk_size', type=int) or current_app.config['ETL_CHUNK_SIZE']
+        elif source_type == 'api' and request.form.get('stream_response'):
+            if request.form.get('api_format') != 'json' or request.form.get('pagination_type'):
+                flash('Streaming is only supported for single-request JSON APIs', 'danger')
+                return render_template('jobs/create.html')
+            chunk_size = request.form.get('api_chunk_size', type=int) or current_app.config['ETL_CHUNK_SIZE']
+        if chunk_size is not None and chunk_size <= 0:
+            flash('Chunk size must be a positive number of rows', 'danger')
+            return render_template('jobs/create.html')
+        
+        # Per-job run timeout (empty = ETL_RUN_TIMEOUT)
+        timeout_minutes = request.form.get('timeout_minutes', type=int)
+        if timeout_minutes is not None and timeout_minutes <= 0:
+            flash('Timeout must be a positive number of minutes', 'danger')
+            return render_template('jobs/create.html')
+        
+        # Optional cron or interval schedule
+        schedule, catchup_policy, error = _read_schedule_form()
+        if error:
+            flash(error, 'danger')
+            return render_template('jobs/create.html')
         
         # Create job
         job = Job(
             name=job_name,
             description=description,
             user_id=current_user.id,
-            load_mode=load_mode
+            load_mode=load_mode,
+            key_columns=key_columns,
+            index_specs=index_specs,
+            chunk_size=chunk_size,
+            timeout_seconds=timeout_minutes * 60 if timeout_minutes else None,
+            schedule=schedule,
+            catchup_policy=catchup_policy,
+            next_run_at=first_fire(parse_schedule(schedule)) if schedule else None
         )
         db.session.add(job)
         db.session.flush()  # Get job.id without committing
@@ -93,9 +168,34 @@ def create_job():
             
             data_source.api_url = api_url
             data_source.api_format = api_format
+            data_source.cache_body = bool(request.form.get('cache_body'))
+            
+            # Optional pagination (JSON APIs only)
+            pagination_type = request.form.get('pagination_type') or None
+            if pagination_type:
+                if pagination_type not in PAGINATION_TYPES or api_format != 'json':
+                    db.session.rollback()
+                    flash('Pagination is only supported for JSON APIs', 'danger')
+                    return render_template('jobs/create.html')
+                
+                page_size = request.form.get('page_size', type=int)
+                max_pages = request.form.get('max_pages', type=int)
+                if (page_size is not None and page_size <= 0) or (max_pages is not None and max_pages <= 0):
+                    db.session.rollback()
+                    flash('Page size and max pages must be positive numbers', 'danger')
+                    return render_template('jobs/create.html')
+                
+                data_source.pagination_type = pagination_type
+                data_source.page_size = page_size
+                data_source.max_pages = max_pages
+                data_source.page_param = request.form.get('page_param') or None
+                data_source.size_param = request.form.get('size_param') or None
+                data_source.cursor_path = request.form.get('cursor_path') or None
         
         db.session.add(data_source)
         db.session.commit()
+        if job.schedule:
+            scheduler.wake()
         
         flash(f'Job "{job_name}" created successfully!', 'success')
         return redirect(url_for('jobs.view_job', job_id=job.id))
@@ -108,36 +208,76 @@ def create_job():
 def view_job(job_id):
     job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
     
-    # Clean up stuck "running" jobs (running for more than 5 minutes)
-    stuck_threshold = datetime.utcnow() - timedelta(minutes=5)
-    stuck_runs = ETLRun.query.filter(
-        ETLRun.job_id == job.id,
-        ETLRun.status == 'running',
-        ETLRun.started_at < stuck_threshold
-    ).all()
-    
+    # Fail runs whose worker stopped sending heartbeats (long runs that are alive are kept)
+    stuck_runs = fail_stale_runs(db, ETLRun.query.filter(ETLRun.job_id == job.id))
     if stuck_runs:
-        from app.models import ETLLog
-        for run in stuck_runs:
-            run.status = 'failed'
-            run.completed_at = datetime.utcnow()
-            run.error_message = 'Job timed out after 5 minutes (auto-cancelled)'
-            
-            # Add log entry
-            log = ETLLog(
-                etl_run_id=run.id,
-                stage='general',
-                message='Job automatically cancelled due to timeout (exceeded 5 minutes)',
-                log_level='error',
-                timestamp=datetime.utcnow()
-            )
-            db.session.add(log)
-        
-        db.session.commit()
-        flash(f'Cleaned up {len(stuck_runs)} stuck job(s)', 'info')
+        flash(f'Cleaned up {len(stuck_runs)} abandoned run(s)', 'info')
+    
+    etl_runs = (ETLRun.query.filter_by(job_id=job.id)
+                .options(selectinload(ETLRun.stage_metrics))
+                .order_by(ETLRun.started_at.desc()).all())
     
-    etl_runs = ETLRun.query.filter_by(job_id=job.id).order_by(ETLRun.started_at.desc()).all()
-    return render_template('jobs/view.html', job=job, etl_runs=etl_runs)
+    # Jobs this one can depend on, and its latest pipeline runs
+    other_jobs = (Job.query.filter(Job.user_id == current_user.id, Job.id != job.id)
+                  .order_by(Job.name.asc()).all())
+    pipeline_runs = (PipelineRun.query.filter_by(job_id=job.id)
+                     .order_by(PipelineRun.queued_at.desc()).limit(5).all())
+    return render_template('jobs/view.html', job=job, etl_runs=etl_runs,
+                         other_jobs=other_jobs, pipeline_runs=pipeline_runs)
+
+
+@bp.route('/<int:job_id>/schedule', methods=['POST'])
+@login_required
+def update_schedule(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    
+    schedule, catchup_policy, error = _read_schedule_form()
+    if error:
+        flash(error, 'danger')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    
+    job.schedule = schedule
+    job.catchup_policy = catchup_policy
+    job.next_run_at = first_fire(parse_schedule(schedule)) if schedule else None
+    db.session.commit()
+    scheduler.wake()
+    
+    if schedule:
+        flash(f'Schedule updated. Next run at {job.next_run_at.strftime("%Y-%m-%d %H:%M")} UTC.', 'success')
+    else:
+        flash('Schedule removed. The job only runs when started by hand.', 'info')
+    return redirect(url_for('jobs.view_job', job_id=job.id))
+
+
+@bp.route('/<int:job_id>/dependencies', methods=['POST'])
+@login_required
+def update_dependencies(job_id):
+    job = Job.query.filter_by(id=job_id, user_id=current_user.id).first_or_404()
+    
+    upstream_ids = set(request.form.getlist('upstream_ids', type=int))
+    upstream_jobs = []
+    if upstream_ids:
+        upstream_jobs = (Job.query.filter(Job.user_id == current_user.id, Job.id.in_(upstream_ids))
+                         .order_by(Job.name.asc()).all())
+    if len(upstream_jobs) != len(upstream_ids):
+        flash('Unknown upstream job', 'danger')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    
+    # Refuse changes that would make the pipeline loop back on itself
+    try:
+        build_pipeline(job, upstream_jobs)
+    except CycleError as e:
+        flash(f'Dependencies not saved. {e}', 'danger')
+        return redirect(url_for('jobs.view_job', job_id=job.id))
+    
+    job.upstream_jobs = upstream_jobs
+    db.session.commit()
+    
+    if upstream_jobs:
+        flash(f'Job now runs after {", ".join(upstream.name for upstream in upstream_jobs)}.', 'success')
+    else:
+        flash('Dependencies removed.', 'info')
+    return redirect(url_for('jobs.view_job', job_id=job.id))
 
 
 @bp.route('/<int:job_id>/delete', methods=['POST'])
@@ -155,6 +295,22 @@ def delete_job(job_id):
         except Exception as e:
             print(f"Error deleting file: {e}")
     
+    # Delete cached API response if exists
+    if job.data_source and job.data_source.cache_body:
+        try:
+            delete_cached_body(job.data_source)
+        except Exception as e:
+            print(f"Error deleting cached response: {e}")
+    
+    # Delete parsed copy of the upload unless another job's file has the same contents
+    content_hash = job.data_source.content_hash if job.data_source else None
+    if content_hash and not DataSource.query.filter(DataSource.content_hash == content_hash,
+                                                    DataSource.job_id != job.id).first():
+        try:
+            delete_cached_frame(content_hash)
+        except Exception as e:
+            print(f"Error deleting cached data: {e}")
+    
     db.session.delete(job)
     db.session.commit()
     
@@ -165,35 +321,13 @@ def delete_job(job_id):
 @bp.route('/cleanup-stuck', methods=['POST'])
 @login_required
 def cleanup_stuck_jobs():
-    """Clean up all stuck 'running' jobs for the current user"""
-    from app.models import ETLLog
-    
-    # Find stuck jobs (running for more than 5 minutes)
-    stuck_threshold = datetime.utcnow() - timedelta(minutes=5)
-    stuck_runs = ETLRun.query.join(Job).filter(
-        Job.user_id == current_user.id,
-        ETLRun.status == 'running',
-        ETLRun.started_at < stuck_threshold
-    ).all()
+    """Fail the current user's runs and pipeline runs whose worker stopped responding"""
+    stuck_runs = fail_stale_runs(db, ETLRun.query.join(Job).filter(Job.user_id == current_user.id))
+    stuck_runs += fail_stale_pipeline_runs(db, PipelineRun.query.join(Job).filter(Job.user_id == current_user.id),
+                                           swept={run.id for run in stuck_runs})
     
     if stuck_runs:
-        for run in stuck_runs:
-            run.status = 'failed'
-            run.completed_at = datetime.utcnow()
-            run.error_message = 'Job timed out after 5 minutes (auto-cancelled)'
-            
-            # Add log entry
-            log = ETLLog(
-                etl_run_id=run.id,
-                stage='general',
-                message='Job automatically cancelled due to timeout (exceeded 5 minutes)',
-                log_level='error',
-                timestamp=datetime.utcnow()
-            )
-            db.session.add(log)
-        
-        db.session.commit()
-        flash(f'Successfully cleaned up {len(stuck_runs)} stuck job(s)', 'success')
+        flash(f'Successfully cleaned up {len(stuck_runs)} abandoned run(s)', 'success')
     else:
         flash('No stuck jobs found', 'info')
     
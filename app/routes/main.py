@@ -1,6 +1,9 @@
 from flask import Blueprint, render_template
 from flask_login import login_required, current_user
-from app.models import Job
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Job, ETLRun
 
 bp = Blueprint('main', __name__)
 
@@ -14,15 +17,17 @@ def index():
 @bp.route('/dashboard')
 @login_required
 def dashboard():
-    jobs = Job.query.filter_by(user_id=current_user.id).order_by(Job.created_at.desc()).all()
-    total_jobs = len(jobs)
+    # Only the recent jobs shown on the page are loaded, with their data sources
+    jobs = (Job.query.filter_by(user_id=current_user.id)
+            .options(joinedload(Job.data_source))
+            .order_by(Job.created_at.desc()).limit(6).all())
+    total_jobs = Job.query.filter_by(user_id=current_user.id).count()
     
-    # Count successful runs
-    from app.models import ETLRun
-    successful_runs = ETLRun.query.join(Job).filter(
-        Job.user_id == current_user.id,
-        ETLRun.status == 'success'
-    ).count()
+    # Count runs by status in one GROUP BY
+    status_counts = dict(db.session.query(ETLRun.status, func.count(ETLRun.id))
+                         .join(Job).filter(Job.user_id == current_user.id)
+                         .group_by(ETLRun.status).all())
+    successful_runs = status_counts.get('success', 0)
     
     return render_template('dashboard.html', 
                          jobs=jobs, 
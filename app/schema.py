@@ -0,0 +1,33 @@
+from sqlalchemy import inspect, literal
+
+
+def upgrade_schema(db):
+    """Create missing tables and add the columns and indexes the models gained.
+
+    db.create_all() only creates tables that do not exist yet, so a database
+    made by an earlier version lacks the newer columns. They are added with
+    ALTER TABLE ... ADD COLUMN, filled with the model's default where it has
+    a plain one, and missing indexes are created. Returns the added columns
+    as 'table.column'.
+    """
+    db.create_all()
+    dialect = db.engine.dialect
+    preparer = dialect.identifier_preparer
+    added = []
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = (f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN '
+                       f'{preparer.format_column(column)} {column.type.compile(dialect=dialect)}')
+                if column.default is not None and column.default.is_scalar:
+                    value = literal(column.default.arg, column.type)
+                    ddl += f' DEFAULT {value.compile(dialect=dialect, compile_kwargs={"literal_binds": True})}'
+                conn.exec_driver_sql(ddl)
+                added.append(f'{table.name}.{column.name}')
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+    return added
@@ -0,0 +1,21 @@
+from sqlalchemy import event
+
+
+def configure_sqlite(engine, pragmas):
+    """Apply PRAGMA settings to every new connection of a SQLite engine.
+
+    The pragmas are run from a connection event hook, so they also apply to
+    connections the pool opens later. Engines for other databases are left
+    untouched.
+    """
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+ETL Load Benchmark
+Measures load throughput and reader latency while loads are running, with
+the default SQLite settings and with the tuned SQLITE_PRAGMAS from config.py.
+
+Usage: python benchmark.py [--rows 200000] [--loads 3]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+
+def make_frame(rows):
+    """Build a DataFrame shaped like a typical transformed upload"""
+    rng = np.random.default_rng(42)
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'name': [f'user{i}' for i in range(rows)],
+        'city': rng.choice(['london', 'paris', 'berlin', 'madrid'], rows),
+        'amount': rng.random(rows) * 1000,
+        'quantity': rng.integers(0, 100, rows),
+        'active': rng.random(rows) > 0.5,
+    })
+
+
+def run_profile(label, pragmas, df, loads, fresh_engines=False):
+    """Run the loads on a background thread while the main thread issues reads"""
+    from app import create_app, db
+    from app.models import User, Job, ETLRun
+    from app.etl import load_data
+    from config import Config
+
+    tmp_dir = tempfile.mkdtemp()
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp_dir, 'bench.db')
+        UPLOAD_FOLDER = os.path.join(tmp_dir, 'uploads')
+        SQLITE_PRAGMAS = pragmas
+        ETL_SCHEDULER_ENABLED = False
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@test.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.flush()
+        job = Job(name='Benchmark', user_id=user.id, table_name='etl_data_benchmark')
+        db.session.add(job)
+        db.session.commit()
+        job_id = job.id
+
+    load_times = []
+    load_errors = []
+
+    def loader():
+        with app.app_context():
+            for _ in range(loads):
+                etl_run = ETLRun(job_id=job_id, status='running')
+                db.session.add(etl_run)
+                db.session.commit()
+                start = time.perf_counter()
+                error = load_data(df, 'etl_data_benchmark', etl_run, db, 'replace')
+                load_times.append(time.perf_counter() - start)
+                if error:
+                    load_errors.append(error)
+
+    latencies = []
+    read_errors = 0
+    thread = threading.Thread(target=loader)
+    with app.app_context():
+        thread.start()
+        while thread.is_alive():
+            start = time.perf_counter()
+            try:
+                # The queries behind the dashboard and job pages
+                engine = create_engine(BenchConfig.SQLALCHEMY_DATABASE_URI) if fresh_engines else db.engine
+                with engine.connect() as conn:
+                    conn.execute(text('SELECT COUNT(*) FROM etl_runs WHERE job_id = :id'), {'id': job_id}).scalar()
+                    conn.execute(text('SELECT * FROM jobs ORDER BY created_at DESC LIMIT 20')).fetchall()
+                if fresh_engines:
+                    engine.dispose()
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                read_errors += 1
+            time.sleep(0.005)
+        thread.join()
+        db.engine.dispose()
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies) or [0.0]
+    total_rows = len(df) * len(load_times)
+    return {
+        'label': label,
+        'rows_per_second': total_rows / sum(load_times) if load_times else 0,
+        'reads': len(latencies),
+        'p50': statistics.median(latencies_ms),
+        'p95': latencies_ms[int(len(latencies_ms) * 0.95) - 1] if len(latencies_ms) > 1 else latencies_ms[0],
+        'max': latencies_ms[-1],
+        'read_errors': read_errors,
+        'load_errors': len(load_errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ETL loads and concurrent reads')
+    parser.add_argument('--rows', type=int, default=200000, help='Rows per load (default: 200000)')
+    parser.add_argument('--loads', type=int, default=3, help='Loads per profile (default: 3)')
+    args = parser.parse_args()
+
+    from config import Config
+
+    df = make_frame(args.rows)
+    profiles = [
+        ('default, engine per read', {}, True),
+        ('default, pooled', {}, False),
+        ('tuned, pooled', Config.SQLITE_PRAGMAS, False),
+    ]
+
+    print("=" * 92)
+    print(f"ETL LOAD BENCHMARK ({args.rows} rows x {args.loads} loads)")
+    print("=" * 92)
+    print(f"{'Profile':<26}{'Rows/s':>12}{'Reads':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"
+          f"{'Read err':>10}{'Load err':>10}")
+    for label, pragmas, fresh_engines in profiles:
+        result = run_profile(label, pragmas, df, args.loads, fresh_engines)
+        print(f"{result['label']:<26}{result['rows_per_second']:>12,.0f}{result['reads']:>8}"
+              f"{result['p50']:>10.2f}{result['p95']:>10.2f}{result['max']:>10.2f}"
+              f"{result['read_errors']:>10}{result['load_errors']:>10}")
+    print("=" * 92)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 from app import create_app, db
-from app.models import User, Job, DataSource, ETLRun, ETLLog
+from app.models import (User, Job, DataSource, ETLRun, ETLLog, ETLStageMetric, PipelineRun, TableLock,
+                        job_dependencies)
 
 app = create_app()
 
@@ -10,10 +11,22 @@ with app.app_context():
         db.session.query(ETLLog).delete()
         print("ETL logs cleared.")
 
+        # Delete stage metrics and table leases, which point at runs
+        db.session.query(ETLStageMetric).delete()
+        print("Stage metrics cleared.")
+        db.session.query(TableLock).delete()
+        print("Table locks cleared.")
+
         # Delete ETL runs
         db.session.query(ETLRun).delete()
         print("ETL runs cleared.")
 
+        # Delete pipeline runs and job dependencies, which point at jobs
+        db.session.query(PipelineRun).delete()
+        print("Pipeline runs cleared.")
+        db.session.execute(job_dependencies.delete())
+        print("Job dependencies cleared.")
+
         # Delete data sources
         db.session.query(DataSource).delete()
         print("Data sources cleared.")
@@ -6,3 +6,43 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    ETL_CHUNK_SIZE = 50000  # Default rows per chunk for streaming CSV jobs
+    ETL_EXECUTOR = os.environ.get('ETL_EXECUTOR') or 'thread'  # 'thread', 'process' or 'sync'
+    ETL_MAX_WORKERS = int(os.environ.get('ETL_MAX_WORKERS') or 4)  # Parallel ETL runs
+    ETL_LOG_FLUSH_INTERVAL = 2.0  # Max seconds run logs stay buffered before being written
+    ETL_RUN_TIMEOUT = 3600  # Default seconds a run may take before it is stopped (None = no limit)
+    ETL_HEARTBEAT_INTERVAL = 10  # Seconds between heartbeats (and cancel checks) of an executing run
+    ETL_HEARTBEAT_TIMEOUT = 300  # Runs without a heartbeat for this long are failed as abandoned
+    ETL_HEARTBEAT_FOLDER = os.path.join('uploads', 'heartbeats')  # Heartbeat files, written without the database lock
+    ETL_TABLE_LOCK_POLICY = 'queue'  # When another run is writing the target table: 'queue' (wait for it) or 'reject'
+    ETL_TABLE_LOCK_TTL = None  # Seconds a table lease lasts without renewal (None = ETL_HEARTBEAT_TIMEOUT)
+    ETL_TABLE_LOCK_POLL = 1.0  # Seconds between attempts to take a busy table lease
+    ETL_SCHEDULER_ENABLED = (os.environ.get('ETL_SCHEDULER') or '1') == '1'  # Run scheduled jobs from a background thread
+    ETL_SCHEDULER_CATCHUP = 'coalesce'  # Default policy for missed fires: 'skip', 'coalesce' or 'run-all'
+    ETL_SCHEDULER_MISFIRE_GRACE = 60  # Seconds late a fire may be and still run under 'skip'
+    ETL_SCHEDULER_MAX_CONCURRENT = None  # Max scheduled runs in flight (None = ETL_MAX_WORKERS)
+    ETL_SCHEDULER_REFRESH = 30  # Seconds between reloads of the job schedules
+    ETL_SCHEDULER_POLL = 5  # Seconds between retries of jobs that are due but busy
+    ETL_API_CONCURRENCY = 4  # Max in-flight page requests for paginated APIs
+    ETL_API_MAX_PAGES = 1000  # Safety cap on pages fetched per run
+    ETL_API_CACHE_FOLDER = os.path.join('uploads', 'api_cache')  # Compressed copies of API responses
+    ETL_FRAME_CACHE_FOLDER = os.path.join('uploads', 'frame_cache')  # Parsed copies of CSV uploads
+    ETL_FRAME_CACHE_MAX_BYTES = 512 * 1024 * 1024  # Least recently used entries are evicted above this size
+    ETL_LOAD_BATCH_SIZE = 10000  # Rows per executemany batch when loading
+    ETL_LOAD_FAST_PATH = True  # Insert through the raw sqlite3 cursor on SQLite
+    ETL_STAGE_MEMORY = 'rss'  # Peak memory per stage: 'rss' (sampled), 'tracemalloc' (exact, slower) or None
+    ETL_RSS_SAMPLE_INTERVAL = 0.05  # Seconds between RSS samples
+    ETL_LOG_RETENTION_RUNS = 50  # Runs per job that keep their detailed logs (None = by age only)
+    ETL_LOG_RETENTION_DAYS = 30  # Runs younger than this keep their detailed logs (None = by count only)
+    ETL_LOG_RETENTION_BATCH_SIZE = 500  # Runs compacted per write transaction
+    # /metrics: with several web workers, set PROMETHEUS_MULTIPROC_DIR (read by prometheus_client) to an
+    # empty directory shared by the workers, or each scrape only sees the worker that answered it
+    METRICS_WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY') or 1)  # Web worker processes (gunicorn reads it too)
+    ETL_EXPORT_BATCH_SIZE = 5000  # Rows fetched per chunk (and per Parquet row group) when exporting
+    SQLITE_PRAGMAS = {  # Applied to every SQLite connection
+        'journal_mode': 'WAL',  # Readers are not blocked while a load is writing
+        'synchronous': 'NORMAL',
+        'busy_timeout': 30000,  # ms to wait for a lock before failing
+        'cache_size': -64000,  # Negative values are KiB (64 MB page cache)
+        'mmap_size': 256 * 1024 * 1024,
+    }
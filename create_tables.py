@@ -1,8 +1,10 @@
 from app import create_app, db
+from app.schema import upgrade_schema
 from app.models import User, Job, DataSource, ETLRun, ETLLog
 
 app = create_app()
 
 with app.app_context():
-    db.create_all()
+    for column in upgrade_schema(db):
+        print(f"Added column {column}")
     print("All tables created successfully!")
\ No newline at end of file
@@ -1,4 +1,5 @@
 from app import create_app, db
+from app.schema import upgrade_schema
 from app.models import User, Job, DataSource, ETLRun, ETLLog
 
 app = create_app()
@@ -10,5 +11,5 @@ def make_shell_context():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
+        upgrade_schema(db)
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -117,6 +117,1201 @@ def test_etl_modules():
         return False
 
 
+def _make_test_app():
+    """Create an app bound to a throwaway SQLite database"""
+    import tempfile
+    from app import create_app, db
+    from config import Config
+    
+    tmp_dir = tempfile.mkdtemp()
+    
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmp_dir, 'test.db')
+        UPLOAD_FOLDER = os.path.join(tmp_dir, 'uploads')
+        ETL_FRAME_CACHE_FOLDER = os.path.join(tmp_dir, 'frame_cache')
+        ETL_HEARTBEAT_FOLDER = os.path.join(tmp_dir, 'heartbeats')
+        ETL_SCHEDULER_ENABLED = False
+        ETL_EXECUTOR = 'sync'
+        TESTING = True
+    
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+    return app, tmp_dir
+
+
+def _pipeline_user():
+    """Return the user that owns the test jobs, creating it on first use"""
+    from app import db
+    from app.models import User
+    
+    user = User.query.filter_by(username='pipeline').first()
+    if not user:
+        user = User(username='pipeline', email='pipeline@test.com')
+        user.set_password('testpass123')
+        db.session.add(user)
+        db.session.flush()
+    return user
+
+
+def _create_csv_job(tmp_dir, rows=250, **job_fields):
+    """Create a user, CSV file and job in the current app context"""
+    from app import db
+    from app.models import Job, DataSource
+    
+    csv_path = os.path.join(tmp_dir, 'sample.csv')
+    with open(csv_path, 'w') as f:
+        f.write('First Name,Age (years)\n')
+        for i in range(rows):
+            # Every 10th row is completely empty and should be dropped
+            f.write(',\n' if i % 10 == 0 else f'user{i},{i}\n')
+    
+    job = Job(name='Pipeline Test', user_id=_pipeline_user().id, **job_fields)
+    db.session.add(job)
+    db.session.flush()
+    job.table_name = f'etl_data_pipeline_test_{job.id}'
+    db.session.add(DataSource(job_id=job.id, source_type='csv', file_path=csv_path))
+    db.session.commit()
+    return job
+
+
+def _create_api_job(api_url, **job_fields):
+    """Create a user and a JSON API job in the current app context"""
+    from app import db
+    from app.models import Job, DataSource
+    
+    job = Job(name='API Test', user_id=_pipeline_user().id, **job_fields)
+    db.session.add(job)
+    db.session.flush()
+    job.table_name = f'etl_data_api_test_{job.id}'
+    db.session.add(DataSource(job_id=job.id, source_type='api', api_url=api_url, api_format='json'))
+    db.session.commit()
+    return job
+
+
+def _serve_api(routes):
+    """Serve JSON on localhost from routes ({path: {'body': text, 'etag': tag}}).
+    
+    A request whose If-None-Match matches the route's ETag gets a 304. A route
+    may also give a 'status' and 'headers', or be a function of the query
+    parameters returning the route. Returns the server and its base URL;
+    routes can be changed while it runs.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qsl
+    import threading
+    
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path, _, query = self.path.partition('?')
+            route = routes.get(self.path) or routes[path]
+            if callable(route):
+                route = route(dict(parse_qsl(query)))
+            if route.get('etag') and self.headers.get('If-None-Match') == route['etag']:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = route['body'].encode('utf-8')
+            self.send_response(route.get('status', 200))
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if route.get('etag'):
+                self.send_header('ETag', route['etag'])
+            for name, value in route.get('headers', {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def test_schema_upgrade():
+    """Test that a database from an earlier version gains the new columns and indexes"""
+    print("✓ Testing schema upgrade...")
+    try:
+        from app import db
+        from app.schema import upgrade_schema
+        from sqlalchemy import text, inspect
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            # Turn etl_runs back into an older shape, with a run in it
+            with db.engine.begin() as conn:
+                conn.execute(text('DROP INDEX ix_etl_runs_status_started'))
+                conn.execute(text('ALTER TABLE etl_runs DROP COLUMN heartbeat_at'))
+                conn.execute(text('ALTER TABLE etl_runs DROP COLUMN cancel_requested'))
+                conn.execute(text("INSERT INTO etl_runs (job_id, status) VALUES (1, 'success')"))
+            
+            assert sorted(upgrade_schema(db)) == ['etl_runs.cancel_requested', 'etl_runs.heartbeat_at']
+            inspector = inspect(db.engine)
+            assert 'ix_etl_runs_status_started' in [index['name'] for index in inspector.get_indexes('etl_runs')]
+            row = db.session.execute(text('SELECT heartbeat_at, cancel_requested FROM etl_runs')).one()
+            assert row.heartbeat_at is None and row.cancel_requested == 0
+            assert upgrade_schema(db) == []
+        
+        print("  ✓ Older databases are upgraded in place")
+        return True
+    except Exception as e:
+        print(f"  ✗ Schema upgrade test failed: {e}")
+        return False
+
+
+def test_background_executor():
+    """Test that runs are queued on the worker pool and polled through the status endpoint"""
+    print("✓ Testing background executor...")
+    try:
+        import time
+        from app import db
+        from app.models import ETLRun
+        from app.etl.executor import executor
+        from app.etl.locks import acquire_table_lock
+        
+        app, tmp_dir = _make_test_app()
+        app.config.update(ETL_EXECUTOR='thread', ETL_TABLE_LOCK_POLL=0.05)
+        executor.init_app(app)
+        client = app.test_client()
+        try:
+            with app.app_context():
+                job = _create_csv_job(tmp_dir, rows=20)
+                # Another run holds the table, so the new run stays queued until it is released
+                holder = ETLRun(job_id=job.id, status='running')
+                db.session.add(holder)
+                db.session.commit()
+                assert acquire_table_lock(db, job.table_name, holder.id) == holder.id
+                job_id, holder_id, user_id = job.id, holder.id, job.user_id
+            with client.session_transaction() as session:
+                session['_user_id'] = str(user_id)
+            
+            # The request returns straight away with the queued run
+            response = client.post(f'/etl/run/{job_id}', json={})
+            assert response.status_code == 202
+            run = response.get_json()['run']
+            assert run['status'] == 'queued'
+            status = client.get(response.get_json()['status_url']).get_json()
+            assert status['status'] == 'queued' and status['active']
+            
+            with app.app_context():
+                db.session.get(ETLRun, holder_id).status = 'success'
+                db.session.commit()
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                status = client.get(f'/etl/status/{run["id"]}').get_json()
+                if not status['active']:
+                    break
+                time.sleep(0.05)
+            assert status['status'] == 'success' and not status['active'], status
+            assert status['rows_loaded'] == 18
+        finally:
+            executor.shutdown()
+        
+        print("  ✓ Runs execute in the background and report their status")
+        return True
+    except Exception as e:
+        print(f"  ✗ Background executor test failed: {e}")
+        return False
+
+
+def test_run_logger():
+    """Test that run logs are buffered and written in bulk"""
+    print("✓ Testing run logger...")
+    try:
+        import time
+        from app import db
+        from app.models import ETLRun, ETLLog
+        from app.etl.runlog import RunLogger, get_run_logger
+        from sqlalchemy import text
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            job = _create_csv_job(tmp_dir, rows=20)
+            etl_run = ETLRun(job_id=job.id, status='running')
+            db.session.add(etl_run)
+            db.session.commit()
+            assert get_run_logger(etl_run, db) is get_run_logger(etl_run, db)
+            
+            def written():
+                with db.engine.connect() as conn:
+                    return conn.execute(text('SELECT COUNT(*) FROM etl_logs WHERE etl_run_id = :id'),
+                                        {'id': etl_run.id}).scalar()
+            
+            # Records stay buffered until a flush, and keep the time they were logged at
+            log = RunLogger(etl_run, db, flush_interval=3600)
+            log.info('extract', 'first')
+            time.sleep(0.05)
+            log.warning('extract', 'second')
+            assert written() == 0
+            log.flush()
+            assert written() == 2
+            first, second = ETLLog.query.filter_by(etl_run_id=etl_run.id).order_by(ETLLog.id).all()
+            assert (second.timestamp - first.timestamp).total_seconds() >= 0.05
+            assert second.log_level == 'warning'
+            
+            # Errors are written straight away, except while a load holds the write lock
+            log.info('load', 'third')
+            log.error('load', 'failed')
+            assert written() == 4
+            with log.hold():
+                log.error('load', 'held')
+                assert written() == 4
+            log.flush()
+            assert written() == 5
+            
+            # Once the flush interval has passed, the next record writes the buffer
+            log = RunLogger(etl_run, db, flush_interval=0)
+            log.info('transform', 'interval')
+            assert written() == 6
+        
+        print("  ✓ Run logs are buffered and flushed in bulk")
+        return True
+    except Exception as e:
+        print(f"  ✗ Run logger test failed: {e}")
+        return False
+
+
+def test_sqlite_tuning():
+    """Test that pooled SQLite connections are tuned for concurrent loads"""
+    print("✓ Testing SQLite tuning...")
+    try:
+        from app import db
+        from app.etl.load import begin_write
+        from sqlalchemy import text
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            # Every connection the pool opens gets the pragmas, not just the first one
+            with db.engine.connect() as first, db.engine.connect() as second:
+                for conn in (first, second):
+                    assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+                    assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1  # NORMAL
+                    assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 30000
+                    assert conn.exec_driver_sql('PRAGMA cache_size').scalar() == -64000
+                
+                # With WAL a reader is not blocked by an open write transaction
+                begin_write(first)
+                first.execute(text("INSERT INTO users (username, email, password_hash) VALUES ('w', 'w@test.com', 'x')"))
+                second.exec_driver_sql('PRAGMA busy_timeout = 0')
+                assert second.execute(text('SELECT COUNT(*) FROM users')).scalar() == 0
+                first.commit()
+                assert second.execute(text('SELECT COUNT(*) FROM users')).scalar() == 1
+        
+        print("  ✓ SQLite connections use WAL and the configured pragmas")
+        return True
+    except Exception as e:
+        print(f"  ✗ SQLite tuning test failed: {e}")
+        return False
+
+
+def test_run_overviews():
+    """Test the SQL-side statistics and keyset pages of the dashboard and logs overview"""
+    print("✓ Testing run overviews...")
+    try:
+        from app import db
+        from app.models import ETLRun
+        from datetime import datetime, timedelta
+        from flask import template_rendered
+        from sqlalchemy import event
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            jobs = [_create_csv_job(tmp_dir, rows=20) for _ in range(25)]
+            start = datetime(2024, 1, 1)
+            for i in range(80):
+                db.session.add(ETLRun(job_id=jobs[i % 25].id, status='success' if i % 4 else 'failed',
+                                      started_at=start + timedelta(minutes=i // 2)))
+            db.session.commit()
+            user_id, job_id = jobs[0].user_id, jobs[1].id
+        
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        rendered, statements = [], []
+        
+        def on_render(sender, template, context, **extra):
+            rendered.append(context)
+        
+        def on_execute(*args):
+            statements.append(args[2])
+        
+        template_rendered.connect(on_render, app)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', on_execute)
+        
+        assert client.get('/dashboard').status_code == 200
+        assert rendered[-1]['total_jobs'] == 25 and rendered[-1]['successful_runs'] == 60
+        
+        # Statistics cover every run; the rows come a page at a time without a query per run
+        statements.clear()
+        assert client.get('/etl/logs').status_code == 200
+        page = rendered[-1]
+        assert (page['total_runs'], page['successful_runs'], page['failed_runs']) == (80, 60, 20)
+        assert len(page['etl_runs']) == 50 and page['next_cursor']
+        assert len(statements) < 15, len(statements)
+        
+        assert client.get(f'/etl/logs?after={page["next_cursor"]}').status_code == 200
+        rest = rendered[-1]
+        assert len(rest['etl_runs']) == 30 and rest['next_cursor'] is None
+        seen = [run.id for run in page['etl_runs'] + rest['etl_runs']]
+        assert len(set(seen)) == 80
+        
+        # Filters narrow the statistics as well as the rows
+        assert client.get('/etl/logs?status=failed').status_code == 200
+        assert rendered[-1]['total_runs'] == 20 and rendered[-1]['successful_runs'] == 0
+        assert client.get(f'/etl/logs?job_id={job_id}').status_code == 200
+        assert rendered[-1]['total_runs'] == 4 and rendered[-1]['failed_runs'] == 1
+        
+        print("  ✓ Run statistics are aggregated in SQL and paged by cursor")
+        return True
+    except Exception as e:
+        print(f"  ✗ Run overview test failed: {e}")
+        return False
+
+
+def test_streaming_pipeline():
+    """Test that chunked streaming mode loads the same rows as a full load"""
+    print("✓ Testing streaming pipeline...")
+    try:
+        from app import db
+        from app.models import ETLRun
+        from app.etl import run_pipeline
+        from app.etl.load import table_exists, staging_table_name
+        from app.etl.indexes import index_name
+        from sqlalchemy import text, inspect
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            for chunk_size in (None, 40):
+                job = _create_csv_job(tmp_dir, chunk_size=chunk_size, index_specs='age_years')
+                etl_run = ETLRun(job_id=job.id, status='running')
+                db.session.add(etl_run)
+                db.session.commit()
+                
+                stage, error = run_pipeline(job, etl_run, db)
+                assert error is None, error
+                assert etl_run.rows_extracted == 250
+                assert etl_run.rows_transformed == 225
+                assert etl_run.rows_loaded == 225
+                assert etl_run.rows_per_second > 0
+                assert [metric.stage for metric in etl_run.stage_metrics] == ['extract', 'transform', 'load']
+                assert etl_run.stage_metrics[-1].rows == 225
+                loaded = db.session.execute(text(f'SELECT COUNT(*) FROM "{job.table_name}"')).scalar()
+                assert loaded == 225
+                assert job.row_count == 225
+                assert not table_exists(db, staging_table_name(job.table_name))
+                indexes = [index['name'] for index in inspect(db.engine).get_indexes(job.table_name)]
+                assert indexes == [index_name(job.table_name, ('age_years',))]
+                
+                # Keyset pages walk the whole table once in sort order, both ways
+                from app.etl.query import fetch_page
+                with db.engine.connect() as conn:
+                    seen, after = [], None
+                    while True:
+                        page = fetch_page(conn, job.table_name, sort='age_years', descending=True,
+                                          after=after, limit=100)
+                        seen.extend(page['rows'])
+                        if not page['next_cursor']:
+                            break
+                        after = page['next_cursor']
+                    assert len(seen) == 225
+                    back = fetch_page(conn, job.table_name, sort='age_years', descending=True,
+                                      before=page['prev_cursor'], limit=100)
+                    assert back['rows'] == seen[100:200]
+                
+                # The query API streams a filtered page as it reads it
+                client = app.test_client()
+                with client.session_transaction() as session:
+                    session['_user_id'] = str(job.user_id)
+                response = client.get(f'/etl/api/data/{job.id}?columns=age_years&sort=-age_years'
+                                      f'&filter=age_years:lt:50&limit=10')
+                assert response.is_streamed
+                page = response.get_json()
+                assert [row['age_years'] for row in page['data']] == [age for age in range(49, 0, -1) if age % 10][:10]
+                assert page['next_cursor'] and page['prev_cursor'] is None
+                assert client.get(f'/etl/api/data/{job.id}?columns=nope').status_code == 400
+                
+                # Exports stream the same rows back out
+                import gzip
+                from app.etl.export import export_table
+                body = b''.join(export_table(db.engine, job.table_name, 'ndjson', compress=True, batch_size=100))
+                assert len(gzip.decompress(body).splitlines()) == 225
+                
+                # CSV is sent one chunk per batch, with the header in the first one
+                import io
+                import pandas as pd
+                from app.etl.export import available_formats
+                chunks = list(export_table(db.engine, job.table_name, 'csv', batch_size=50))
+                assert len(chunks) == 5 and chunks[0].startswith(b'first_name,')
+                app.config['ETL_EXPORT_BATCH_SIZE'] = 50
+                response = client.get(f'/etl/export/{job.id}?format=csv')
+                assert response.is_streamed and response.mimetype == 'text/csv'
+                exported = pd.read_csv(io.BytesIO(response.get_data()))
+                columns = [column['name'] for column in inspect(db.engine).get_columns(job.table_name)]
+                assert len(exported) == 225 and list(exported.columns) == columns
+                
+                # Parquet needs pyarrow; without it the format is refused
+                response = client.get(f'/etl/export/{job.id}?format=parquet')
+                if 'parquet' in available_formats():
+                    import pyarrow.parquet as pq
+                    parquet = pq.ParquetFile(io.BytesIO(response.get_data()))
+                    assert parquet.metadata.num_rows == 225 and parquet.num_row_groups == 5
+                else:
+                    assert response.status_code == 302
+                    try:
+                        export_table(db.engine, job.table_name, 'parquet')
+                        assert False, 'parquet export without pyarrow'
+                    except ValueError:
+                        pass
+            
+            # A failing stream must not leave a partial table behind
+            job.data_source.file_path = os.path.join(tmp_dir, 'missing.csv')
+            db.session.commit()
+            etl_run = ETLRun(job_id=job.id, status='running')
+            db.session.add(etl_run)
+            db.session.commit()
+            stage, error = run_pipeline(job, etl_run, db)
+            assert stage == 'extract' and error
+            loaded = db.session.execute(text(f'SELECT COUNT(*) FROM "{job.table_name}"')).scalar()
+            assert loaded == 225
+
+            # Progress is committed chunk by chunk, and no write lock is held while a chunk is read
+            import pandas as pd
+            from app.etl.load import load_chunks
+            etl_run = ETLRun(job_id=job.id, status='running')
+            db.session.add(etl_run)
+            db.session.commit()
+            progress = []
+
+            def chunks():
+                for start in range(0, 90, 30):
+                    with db.engine.connect() as conn:
+                        conn.exec_driver_sql('PRAGMA busy_timeout = 100')
+                        progress.append(conn.execute(text('SELECT rows_loaded FROM etl_runs WHERE id = :id'),
+                                                     {'id': etl_run.id}).scalar())
+                        conn.execute(text('UPDATE jobs SET description = :d WHERE id = :id'),
+                                     {'d': f'chunk {start}', 'id': job.id})
+                        conn.commit()
+                    yield pd.DataFrame({'n': range(start, start + 30)})
+
+            load_chunks(chunks(), job.table_name, etl_run, db)
+            assert progress == [0, 30, 60]
+            assert etl_run.rows_loaded == 90
+            loaded = db.session.execute(text(f'SELECT COUNT(*) FROM "{job.table_name}"')).scalar()
+            assert loaded == 90
+
+        print("  ✓ Streaming pipeline working correctly")
+        return True
+    except Exception as e:
+        print(f"  ✗ Streaming pipeline test failed: {e}")
+        return False
+
+
+def test_api_sources():
+    """Test loading JSON API sources, in full and streamed in chunks, and conditional fetches"""
+    print("✓ Testing API sources...")
+    try:
+        from app import db
+        from app.models import ETLRun
+        from app.etl import run_pipeline
+        from app.etl.control import RunControl, request_cancel
+        from sqlalchemy import inspect, text
+        import json
+        
+        def rows_body(count):
+            return json.dumps({'data': [{'id': i, 'name': f'n{i}'} for i in range(count)]})
+        
+        routes = {}
+        server, base_url = _serve_api(routes)
+        app, tmp_dir = _make_test_app()
+        try:
+            with app.app_context():
+                for chunk_size in (None, 2):
+                    job = _create_api_job(f'{base_url}/rows', chunk_size=chunk_size, index_specs='id')
+                    
+                    def run(cancel=False):
+                        etl_run = ETLRun(job_id=job.id, status='running')
+                        db.session.add(etl_run)
+                        db.session.commit()
+                        with RunControl(etl_run, db) as control:
+                            etl_run._run_control = control
+                            if cancel:
+                                request_cancel(etl_run.id)
+                            stage, error = run_pipeline(job, etl_run, db)
+                        assert error == (control.message if cancel else None), error
+                        return etl_run
+                    
+                    def table_rows():
+                        return db.session.execute(text(f'SELECT COUNT(*) FROM "{job.table_name}"')).scalar()
+                    
+                    routes['/rows'] = {'body': rows_body(5)}
+                    assert run().rows_loaded == 5
+                    
+                    # A replace load of an empty response empties the table but keeps it
+                    routes['/rows'] = {'body': json.dumps({'data': []})}
+                    assert run().rows_loaded == 0
+                    assert table_rows() == 0
+                    assert [column['name'] for column in inspect(db.engine).get_columns(job.table_name)] == ['id', 'name']
+                    assert len(inspect(db.engine).get_indexes(job.table_name)) == 1
+                    assert job.row_count == 0
+                    
+                    # An unchanged source (HTTP 304) is not loaded again
+                    routes['/rows'] = {'body': rows_body(5), 'etag': '"v1"'}
+                    assert run().rows_loaded == 5
+                    unchanged = run()
+                    assert unchanged.status == 'unchanged' and unchanged.rows_loaded == 0
+                    
+                    # A new ETag is only stored with the data it describes
+                    routes['/rows'] = {'body': rows_body(50), 'etag': '"v2"'}
+                    run(cancel=True)
+                    db.session.refresh(job.data_source)
+                    assert job.data_source.etag == '"v1"' and table_rows() == 5
+                    assert run().rows_loaded == 50
+                    db.session.refresh(job.data_source)
+                    assert job.data_source.etag == '"v2"' and table_rows() == 50
+                
+                # Paginated sources are fetched concurrently, back off on a 429 and only
+                # stop on an empty page or the reported total, even if the server caps pages
+                rows = [{'id': i} for i in range(95)]
+                limited = set()
+                
+                def page(params, report_total):
+                    if params['offset'] == '30' and not limited:
+                        limited.add(params['offset'])
+                        return {'status': 429, 'headers': {'Retry-After': '0'}, 'body': '{}'}
+                    start = int(params['offset'])
+                    body = {'data': rows[start:start + min(int(params['limit']), 30)]}
+                    if report_total:
+                        body['meta'] = {'total': len(rows)}
+                    return {'body': json.dumps(body)}
+                
+                routes['/pages'] = lambda params: page(params, report_total=True)
+                routes['/unsized'] = lambda params: page(params, report_total=False)
+                for path, max_pages, expected in (('/pages', None, 95), ('/unsized', None, 95), ('/unsized', 2, 60)):
+                    limited.clear()
+                    job = _create_api_job(f'{base_url}{path}')
+                    job.data_source.pagination_type = 'offset'
+                    job.data_source.page_size = 50
+                    job.data_source.max_pages = max_pages
+                    db.session.commit()
+                    etl_run = ETLRun(job_id=job.id, status='running')
+                    db.session.add(etl_run)
+                    db.session.commit()
+                    stage, error = run_pipeline(job, etl_run, db)
+                    assert error is None, error
+                    assert etl_run.rows_loaded == expected, (path, etl_run.rows_loaded)
+                    assert sorted(row[0] for row in db.session.execute(
+                        text(f'SELECT id FROM "{job.table_name}"'))) == list(range(expected))
+                    warnings = [entry.message for entry in etl_run.logs if entry.log_level == 'warning']
+                    assert any('rate limited 1 request' in message for message in warnings), warnings
+                    assert any('limit of 2 pages' in message for message in warnings) == (max_pages == 2), warnings
+        finally:
+            server.shutdown()
+        
+        print("  ✓ API sources loaded in full, in chunks and only when changed")
+        return True
+    except Exception as e:
+        print(f"  ✗ API source test failed: {e}")
+        return False
+
+
+def test_source_fingerprint():
+    """Test that unchanged CSV sources are skipped unless forced and parsed data is cached"""
+    print("✓ Testing source fingerprinting...")
+    try:
+        from app import db
+        from app.models import ETLRun
+        from app.etl import run_pipeline
+        from app.etl.frame_cache import frame_cache_path, evict_frames
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            job = _create_csv_job(tmp_dir)
+            
+            def run(force=False):
+                etl_run = ETLRun(job_id=job.id, status='running')
+                db.session.add(etl_run)
+                db.session.commit()
+                stage, error = run_pipeline(job, etl_run, db, force=force)
+                assert error is None, error
+                return etl_run
+            
+            assert run().rows_loaded == 225
+            cache_path = frame_cache_path(job.data_source.content_hash)
+            assert os.path.exists(cache_path)
+            skipped = run()
+            assert skipped.status == 'unchanged' and skipped.rows_loaded == 0
+            assert run(force=True).rows_loaded == 225
+            
+            # Once over the size cap the least recently used entries are evicted
+            evict_frames(1)
+            assert not os.path.exists(cache_path)
+            
+            # Changing the load mode or the file contents triggers a reload
+            job.load_mode = 'append'
+            db.session.commit()
+            assert run().rows_loaded == 225
+            _create_csv_job(tmp_dir, rows=100)
+            assert run().rows_loaded == 90
+            
+            # Jobs with identical files share a cache entry; it outlives deleting one of them
+            jobs = []
+            for name in ('first', 'second'):
+                os.makedirs(os.path.join(tmp_dir, name))
+                job = _create_csv_job(os.path.join(tmp_dir, name), rows=50)
+                jobs.append(job)
+                assert run().rows_loaded == 45
+            cache_path = frame_cache_path(job.data_source.content_hash)
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(job.user_id)
+            first_id, second_id = (job.id for job in jobs)
+            client.post(f'/jobs/{first_id}/delete')
+            assert os.path.exists(cache_path)
+            client.post(f'/jobs/{second_id}/delete')
+            assert not os.path.exists(cache_path)
+            
+            # Runs caching the same file at once each write their own temporary file
+            import threading
+            import pandas as pd
+            from app.etl.frame_cache import store_frame, load_cached_frame
+            df = pd.DataFrame({'a': range(50000), 'b': ['x'] * 50000})
+            
+            def store():
+                with app.app_context():
+                    store_frame('shared', df)
+            
+            threads = [threading.Thread(target=store) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert load_cached_frame('shared').equals(df)
+            assert not [name for name in os.listdir(os.path.dirname(frame_cache_path('shared')))
+                        if name.endswith('.tmp')]
+        
+        print("  ✓ Source fingerprinting working correctly")
+        return True
+    except Exception as e:
+        print(f"  ✗ Source fingerprint test failed: {e}")
+        return False
+
+
+def test_merge_load():
+    """Test that merge mode upserts on the key columns and counts the changes"""
+    print("✓ Testing merge load mode...")
+    try:
+        from app import db
+        from app.models import ETLRun
+        from app.etl import run_pipeline
+        from app.etl.indexes import merge_index_name
+        from app.etl.load import staging_table_name, swap_in_staging
+        from sqlalchemy import inspect, text
+        import pandas as pd
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            job = _create_csv_job(tmp_dir, rows=100, load_mode='merge', key_columns='first_name')
+            
+            def run():
+                etl_run = ETLRun(job_id=job.id, status='running')
+                db.session.add(etl_run)
+                db.session.commit()
+                stage, error = run_pipeline(job, etl_run, db, force=True)
+                assert error is None, error
+                return etl_run.rows_inserted, etl_run.rows_updated, etl_run.rows_unchanged
+            
+            assert run() == (90, 0, 0)
+            assert run() == (0, 0, 90)
+            
+            # Change three records and add two new ones
+            df = pd.read_csv(job.data_source.file_path)
+            df.loc[1:3, 'Age (years)'] = 999
+            df = pd.concat([df, pd.DataFrame({'First Name': ['new1', 'new2'], 'Age (years)': [1, 2]})])
+            df.to_csv(job.data_source.file_path, index=False)
+            assert run() == (2, 3, 87)
+            
+            # A replace swap retires the table without its merge key index, so the next merge recreates it
+            with db.engine.begin() as conn:
+                conn.execute(text(f'CREATE TABLE "{staging_table_name(job.table_name)}" AS '
+                                  f'SELECT * FROM "{job.table_name}"'))
+                retired = swap_in_staging(conn, job.table_name, 0)
+                assert inspect(conn).get_indexes(retired) == []
+            assert run() == (0, 0, 92)
+            
+            # Changing the key columns replaces the index merges upsert against
+            job.key_columns = 'first_name, age_years'
+            db.session.commit()
+            run()
+            assert [index['name'] for index in inspect(db.engine).get_indexes(job.table_name)] == \
+                [merge_index_name(job.table_name, ('first_name', 'age_years'))]
+        
+        print("  ✓ Merge load mode working correctly")
+        return True
+    except Exception as e:
+        print(f"  ✗ Merge load test failed: {e}")
+        return False
+
+
+def test_log_retention():
+    """Test that runs past the retention window have their logs compacted"""
+    print("✓ Testing log retention...")
+    try:
+        from app import db
+        from app.models import ETLRun, ETLLog
+        from app.etl.retention import apply_retention
+        from datetime import datetime, timedelta
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            job = _create_csv_job(tmp_dir, rows=10)
+            now = datetime.utcnow()
+            for day in range(40):
+                # Every finished status is compacted
+                status = ETLRun.FINISHED_STATUSES[day % len(ETLRun.FINISHED_STATUSES)]
+                etl_run = ETLRun(job_id=job.id, status=status, started_at=now - timedelta(days=day))
+                db.session.add(etl_run)
+                db.session.flush()
+                db.session.add(ETLLog(etl_run_id=etl_run.id, stage='load', message='done'))
+                db.session.add(ETLLog(etl_run_id=etl_run.id, stage='load', message='odd', log_level='warning'))
+            db.session.commit()
+            
+            # The 5 newest runs and those under 20 days old keep their logs
+            assert apply_retention(db, job.id, keep_runs=5, keep_days=20, batch_size=7) == 20
+            assert ETLLog.query.count() == 40
+            oldest = ETLRun.query.order_by(ETLRun.started_at.asc()).first()
+            assert (oldest.log_count, oldest.warning_count, oldest.error_count) == (2, 1, 0)
+            assert oldest.compacted_at is not None
+            assert apply_retention(db, job.id, keep_runs=5, keep_days=20) == 0
+        
+        print("  ✓ Old runs compacted into summaries")
+        return True
+    except Exception as e:
+        print(f"  ✗ Log retention test failed: {e}")
+        return False
+
+
+def test_scheduler():
+    """Test schedule parsing and the missed-fire policies"""
+    print("✓ Testing scheduler...")
+    try:
+        from app import db
+        from app.etl.schedule import parse_schedule
+        from app.etl.scheduler import dispatch_due_job
+        from datetime import datetime, timedelta
+        
+        start = datetime(2026, 3, 6, 17, 59)  # A Friday
+        assert parse_schedule('0 6 * * 1-5').next_after(start) == datetime(2026, 3, 9, 6, 0)
+        assert parse_schedule('*/15 * * * *').next_after(start) == datetime(2026, 3, 6, 18, 0)
+        assert parse_schedule('every 2h').next_after(start) == start + timedelta(hours=2)
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            job = _create_csv_job(tmp_dir, rows=10, schedule='every 10m')
+            now = datetime(2026, 1, 1, 12, 0)
+            
+            # Four fires were missed; each policy handles them differently
+            expected = {'skip': (0, now + timedelta(minutes=10)),
+                        'coalesce': (1, now + timedelta(minutes=10)),
+                        'run-all': (4, now + timedelta(minutes=5))}
+            for policy, (run_count, next_run_at) in expected.items():
+                job.catchup_policy = policy
+                job.next_run_at = now - timedelta(minutes=35)
+                db.session.commit()
+                runs = 0
+                while job.next_run_at <= now:
+                    etl_run = dispatch_due_job(job, now)
+                    if etl_run is not None:
+                        runs += 1
+                        etl_run.status = 'success'
+                        db.session.commit()
+                assert (runs, job.next_run_at) == (run_count, next_run_at), policy
+            
+            # A job with a run in progress does not get a second one
+            job.next_run_at = now
+            etl_run = dispatch_due_job(job, now)
+            assert dispatch_due_job(job, now) is None
+            assert etl_run.trigger == 'schedule'
+            
+            # A run left queued by a process that died does not block the job's fires
+            from app.models import ETLRun
+            etl_run.status = 'success'
+            job.next_run_at = now
+            orphan = ETLRun(job_id=job.id, status='queued', queued_at=now - timedelta(hours=2),
+                            started_at=now - timedelta(hours=2))
+            db.session.add(orphan)
+            db.session.commit()
+            assert dispatch_due_job(job, now) is not None
+            assert orphan.status == 'failed'
+        
+        print("  ✓ Schedules and missed-run policies working")
+        return True
+    except Exception as e:
+        print(f"  ✗ Scheduler test failed: {e}")
+        return False
+
+
+def test_run_cancellation():
+    """Test cancelling runs and failing abandoned ones"""
+    print("✓ Testing run cancellation...")
+    try:
+        from app import db
+        from app.models import ETLRun
+        from app.etl.executor import execute_run
+        from app.etl import run_pipeline
+        from app.etl.control import RunControl, request_cancel, fail_stale_runs
+        from datetime import datetime, timedelta
+        from sqlalchemy import text
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            job = _create_csv_job(tmp_dir, rows=20)
+            etl_run = ETLRun(job_id=job.id, status='queued')
+            db.session.add(etl_run)
+            db.session.commit()
+            assert execute_run(etl_run.id) == 'success'
+            assert etl_run.heartbeat_at is not None
+            
+            # A cancelled streaming run stops at the next chunk and rolls back its load
+            job.chunk_size = 5
+            job.load_mode = 'append'
+            etl_run = ETLRun(job_id=job.id, status='running')
+            db.session.add(etl_run)
+            db.session.commit()
+            with RunControl(etl_run, db) as control:
+                etl_run._run_control = control
+                assert request_cancel(etl_run.id)
+                stage, error = run_pipeline(job, etl_run, db, force=True)
+            assert error == control.message, error
+            assert db.session.execute(text(f'SELECT COUNT(*) FROM "{job.table_name}"')).scalar() == 18
+            
+            # Only runs without a recent heartbeat are failed
+            long_ago = datetime.utcnow() - timedelta(hours=2)
+            alive = ETLRun(job_id=job.id, status='running', started_at=long_ago, heartbeat_at=datetime.utcnow())
+            dead = ETLRun(job_id=job.id, status='running', started_at=long_ago, heartbeat_at=long_ago)
+            db.session.add_all([alive, dead])
+            db.session.commit()
+            assert fail_stale_runs(db) == [dead]
+            assert alive.status == 'running'
+            
+            # A fresh heartbeat file keeps a run alive while its row heartbeat waits for the write lock
+            from app.etl.control import heartbeat_path
+            waiting = ETLRun(job_id=job.id, status='running', started_at=long_ago, heartbeat_at=long_ago)
+            db.session.add(waiting)
+            db.session.commit()
+            os.makedirs(os.path.dirname(heartbeat_path(waiting.id)), exist_ok=True)
+            open(heartbeat_path(waiting.id), 'w').close()
+            assert fail_stale_runs(db) == []
+            os.utime(heartbeat_path(waiting.id), (0, 0))
+            assert fail_stale_runs(db) == [waiting]
+            assert not os.path.exists(heartbeat_path(waiting.id))
+            
+            # After a restart, runs and pipeline runs queued by the old process are failed
+            from app.models import PipelineRun
+            from app.etl.scheduler import scheduler
+            pipeline_run = PipelineRun(job_id=job.id, status='running', queued_at=long_ago, started_at=long_ago)
+            db.session.add(pipeline_run)
+            db.session.commit()
+            orphan = ETLRun(job_id=job.id, status='queued', queued_at=long_ago, started_at=long_ago,
+                            pipeline_run_id=pipeline_run.id)
+            fresh = ETLRun(job_id=job.id, status='queued', queued_at=datetime.utcnow())
+            elsewhere = ETLRun(job_id=job.id, status='queued', queued_at=long_ago, started_at=long_ago)
+            db.session.add_all([orphan, fresh, elsewhere])
+            db.session.commit()
+            # Another live process heartbeats the run waiting in its queue
+            open(heartbeat_path(elsewhere.id), 'w').close()
+            scheduler.init_app(app)
+            scheduler.sweep()
+            assert orphan.status == 'failed' and 'queued' in orphan.error_message
+            assert pipeline_run.status == 'failed' and 'coordinator' in pipeline_run.error_message
+            assert fresh.status == 'queued' and elsewhere.status == 'queued'
+        
+        print("  ✓ Cancelled runs roll back and abandoned runs are failed")
+        return True
+    except Exception as e:
+        print(f"  ✗ Run cancellation test failed: {e}")
+        return False
+
+
+def test_table_locks():
+    """Test that only one run at a time holds a target table"""
+    print("✓ Testing table locks...")
+    try:
+        from app import db
+        from app.models import ETLRun
+        from app.etl.executor import execute_run
+        from app.etl.locks import acquire_table_lock, table_lock_holder
+        from datetime import datetime
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            job = _create_csv_job(tmp_dir, rows=20)
+            holder = ETLRun(job_id=job.id, status='running')
+            waiting = ETLRun(job_id=job.id, status='queued')
+            db.session.add_all([holder, waiting])
+            db.session.commit()
+            
+            assert acquire_table_lock(db, job.table_name, holder.id) == holder.id
+            assert acquire_table_lock(db, job.table_name, waiting.id) == holder.id
+            assert table_lock_holder(db, job.table_name) == holder.id
+            
+            # An expired lease is kept while its run's heartbeat file is fresh
+            from app.etl.control import RunControl
+            from app.models import TableLock
+            TableLock.query.filter_by(etl_run_id=holder.id).update({'expires_at': datetime(2000, 1, 1)})
+            db.session.commit()
+            with RunControl(holder, db, interval=60):
+                assert acquire_table_lock(db, job.table_name, waiting.id) == holder.id
+                assert table_lock_holder(db, job.table_name) == holder.id
+            assert table_lock_holder(db, job.table_name) is None
+            assert acquire_table_lock(db, job.table_name, waiting.id) == waiting.id
+            from app.etl.locks import release_table_lock
+            release_table_lock(db, job.table_name, waiting.id)
+            assert acquire_table_lock(db, job.table_name, holder.id) == holder.id
+            
+            # With the 'reject' policy a run for a busy table is not started
+            app.config['ETL_TABLE_LOCK_POLICY'] = 'reject'
+            assert execute_run(waiting.id) == 'rejected'
+            
+            # The lease of a finished run is taken over
+            holder.status = 'success'
+            db.session.commit()
+            assert table_lock_holder(db, job.table_name) is None
+            retry = ETLRun(job_id=job.id, status='queued')
+            db.session.add(retry)
+            db.session.commit()
+            assert execute_run(retry.id) == 'success'
+            assert table_lock_holder(db, job.table_name) is None
+            
+            # A run waiting for a busy table gives up its worker to runs of other jobs
+            from app.etl.executor import RunExecutor
+            app.config.update(ETL_EXECUTOR='thread', ETL_MAX_WORKERS=1, ETL_TABLE_LOCK_POLICY='queue',
+                              ETL_TABLE_LOCK_POLL=0.05)
+            pool = RunExecutor(app)
+            other_job = _create_csv_job(tmp_dir, rows=20)
+            blocker = ETLRun(job_id=job.id, status='running')
+            behind = ETLRun(job_id=job.id, status='queued', force=True)
+            other = ETLRun(job_id=other_job.id, status='queued')
+            db.session.add_all([blocker, behind, other])
+            db.session.commit()
+            assert acquire_table_lock(db, job.table_name, blocker.id) == blocker.id
+            try:
+                behind_future = pool.submit(behind.id)
+                assert pool.submit(other.id).result(timeout=30) == 'success'
+                assert not behind_future.done() and pool.is_active(behind.id)
+                blocker.status = 'success'
+                db.session.commit()
+                assert behind_future.result(timeout=30) == 'success'
+            finally:
+                pool.shutdown()
+            waits = [log.message for log in behind.logs if log.message.startswith('Waiting for run')]
+            assert waits == [f'Waiting for run #{blocker.id} to finish loading table {job.table_name}']
+        
+        print("  ✓ Table leases serialize runs of the same job")
+        return True
+    except Exception as e:
+        print(f"  ✗ Table lock test failed: {e}")
+        return False
+
+
+def test_batch_runner():
+    """Test job selection and runs of the command-line batch runner"""
+    print("✓ Testing batch runner...")
+    try:
+        from app.etl.__main__ import select_jobs, run_jobs
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            first, second = (_create_csv_job(tmp_dir, rows=20) for _ in range(2))
+            
+            assert [job.id for job in select_jobs([second.id])] == [second.id]
+            assert [job.id for job in select_jobs(username='pipeline')] == [first.id, second.id]
+            try:
+                select_jobs([second.id + 1])
+                raise AssertionError("Unknown job id was accepted")
+            except ValueError:
+                pass
+            
+            runs = list(run_jobs(select_jobs(all_jobs=True)))
+            assert [run.status for run in runs] == ['success', 'success']
+            assert all(run.trigger == 'cli' and run.rows_loaded == 18 for run in runs)
+        
+        print("  ✓ Batch runner records a run per selected job")
+        return True
+    except Exception as e:
+        print(f"  ✗ Batch runner test failed: {e}")
+        return False
+
+
+def test_job_dependencies():
+    """Test pipeline ordering, cycle detection and skipping after a failure"""
+    print("✓ Testing job dependencies...")
+    try:
+        from app import db
+        from app.models import PipelineRun
+        from app.etl.dag import build_pipeline, CycleError
+        from app.etl.executor import execute_pipeline_run
+        
+        app, tmp_dir = _make_test_app()
+        with app.app_context():
+            # b and c both read a; d reads b and c
+            a, b, c, d = (_create_csv_job(tmp_dir, rows=20) for _ in range(4))
+            b.upstream_jobs = [a]
+            c.upstream_jobs = [a]
+            d.upstream_jobs = [b, c]
+            db.session.commit()
+            
+            jobs, graph, levels = build_pipeline(d)
+            assert levels == [[a.id], sorted([b.id, c.id]), [d.id]]
+            try:
+                build_pipeline(a, [d])
+                assert False, 'cycle not detected'
+            except CycleError:
+                pass
+            
+            pipeline_run = PipelineRun(job_id=d.id, status='queued')
+            db.session.add(pipeline_run)
+            db.session.commit()
+            assert execute_pipeline_run(pipeline_run.id) == 'success'
+            assert [run.job_id for run in pipeline_run.etl_runs][0] == a.id
+            assert [run.job_id for run in pipeline_run.etl_runs][-1] == d.id
+            
+            # A failed job skips everything downstream of it
+            b.data_source.file_path = os.path.join(tmp_dir, 'missing.csv')
+            pipeline_run = PipelineRun(job_id=d.id, status='queued', force=True)
+            db.session.add(pipeline_run)
+            db.session.commit()
+            assert execute_pipeline_run(pipeline_run.id) == 'failed'
+            statuses = {run.job_id: run.status for run in pipeline_run.etl_runs}
+            assert statuses == {a.id: 'success', b.id: 'failed', c.id: 'success', d.id: 'skipped'}, statuses
+        
+        print("  ✓ Pipelines run in dependency order")
+        return True
+    except Exception as e:
+        print(f"  ✗ Job dependency test failed: {e}")
+        return False
+
+
+def test_metrics_endpoint():
+    """Test that /metrics reports runs and request latency"""
+    print("✓ Testing metrics endpoint...")
+    try:
+        app, tmp_dir = _make_test_app()
+        client = app.test_client()
+        client.get('/auth/login')
+        body = client.get('/metrics').get_data(as_text=True)
+        
+        assert 'etl_queue_depth 0' in body
+        assert 'etl_http_request_duration_seconds_count{endpoint="auth.login",method="GET"}' in body
+        assert '# TYPE etl_runs counter' in body or '# TYPE etl_runs_total counter' in body
+
+        # A run executed by a worker process is counted in this process
+        import time
+        from app import db
+        from app.models import ETLRun
+        from app.etl.executor import RunExecutor
+
+        def successful_runs():
+            for line in client.get('/metrics').get_data(as_text=True).splitlines():
+                if line.startswith('etl_runs_total{status="success"}'):
+                    return float(line.split()[-1])
+            return 0.0
+
+        before = successful_runs()
+        app.config['ETL_EXECUTOR'] = 'process'
+        app.config['ETL_MAX_WORKERS'] = 1
+        pool = RunExecutor(app)
+        with app.app_context():
+            job = _create_csv_job(tmp_dir, rows=20)
+            etl_run = ETLRun(job_id=job.id, status='queued')
+            db.session.add(etl_run)
+            db.session.commit()
+            run_id = etl_run.id
+        try:
+            future = pool.submit(run_id)
+            assert future.result(timeout=60) == 'success'
+            # The outcome is recorded by a done-callback, before the run is forgotten
+            deadline = time.monotonic() + 10
+            while pool.is_active(run_id) and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            pool.shutdown()
+        assert successful_runs() == before + 1
+
+        # Several web workers without a multiprocess directory only report themselves
+        import logging
+        from flask import Flask
+        from app.monitoring import Monitoring
+        warnings = []
+        for workers, expected in ((1, 0), (2, 0 if os.environ.get('PROMETHEUS_MULTIPROC_DIR') else 1)):
+            probe = Flask(f'metrics_probe_{workers}')
+            probe.config['METRICS_WEB_WORKERS'] = workers
+            handler = logging.Handler()
+            handler.emit = warnings.append
+            probe.logger.addHandler(handler)
+            Monitoring(probe)
+            assert len(warnings) == expected, warnings
+            warnings.clear()
+
+        print("  ✓ Metrics exposed in Prometheus format")
+        return True
+    except Exception as e:
+        print(f"  ✗ Metrics endpoint test failed: {e}")
+        return False
+
+
+def test_pagination_helpers():
+    """Test API pagination helpers"""
+    print("✓ Testing API pagination helpers...")
+    try:
+        from app.etl.pagination import find_records, lookup_path, with_query_params
+        
+        assert find_records([{'a': 1}]) == ([{'a': 1}], None)
+        assert find_records({'results': [{'a': 1}], 'count': 1}) == ([{'a': 1}], 'results')
+        assert find_records({'a': 1}) == ([{'a': 1}], None)
+        assert lookup_path({'meta': {'next': 'abc'}}, 'meta.next') == 'abc'
+        assert lookup_path({'meta': None}, 'meta.next') is None
+        assert with_query_params('https://api.test/x?offset=0&q=1', {'offset': 200, 'limit': 100}) == \
+            'https://api.test/x?q=1&offset=200&limit=100'
+        
+        # The streaming parser must cope with records split across chunks
+        from app.etl.json_stream import JSONRecordStream
+        body = b'{"count": 3, "results": [{"a": 1}, {"a": "x,]"}, {"a": 12345}], "next": null}'
+        for size in (1, 5, len(body)):
+            chunks = [body[i:i + size] for i in range(0, len(body), size)]
+            assert list(JSONRecordStream(chunks)) == [{'a': 1}, {'a': 'x,]'}, {'a': 12345}]
+        
+        # Records are taken from the same key find_records prefers, wherever it is in the document
+        import json
+        for document in ({'meta': [{'page': 1}], 'data': [{'a': 1}]},
+                         {'items': [{'i': 1}], 'meta': {'total': 2}, 'results': [{'r': 1}, {'r': 2}]},
+                         {'items': [{'i': 1}], 'data': [{'d': 1}]},
+                         {'meta': [{'page': 1}]}):
+            body = json.dumps(document).encode('utf-8')
+            stream = JSONRecordStream(body[i:i + 4] for i in range(0, len(body), 4))
+            assert (list(stream), stream.record_key) == find_records(document), document
+        
+        # Query API filters are checked against the table and bound as parameters
+        from app.etl.query import parse_filter, compile_filters
+        filters = [parse_filter('city:in:a,b'), parse_filter('note:eq:x:y'), parse_filter('age:null')]
+        assert compile_filters(filters, ['city', 'note', 'age']) == (
+            '"city" IN (:filter_0, :filter_1) AND "note" = :filter_2 AND "age" IS NULL',
+            {'filter_0': 'a', 'filter_1': 'b', 'filter_2': 'x:y'})
+        try:
+            compile_filters([parse_filter('"x" OR 1:eq:1')], ['city'])
+            assert False, 'unknown column accepted'
+        except ValueError:
+            pass
+        
+        print("  ✓ Pagination helpers working correctly")
+        return True
+    except Exception as e:
+        print(f"  ✗ Pagination helper test failed: {e}")
+        return False
+
+
 def test_routes():
     """Test that all routes are registered"""
     print("✓ Testing route registration...")
@@ -229,6 +1424,23 @@ def main():
     
     results.append(("Utility Functions", test_utility_functions()))
     results.append(("ETL Modules", test_etl_modules()))
+    results.append(("SQLite Tuning", test_sqlite_tuning()))
+    results.append(("Schema Upgrade", test_schema_upgrade()))
+    results.append(("Run Logger", test_run_logger()))
+    results.append(("Streaming Pipeline", test_streaming_pipeline()))
+    results.append(("API Sources", test_api_sources()))
+    results.append(("Source Fingerprint", test_source_fingerprint()))
+    results.append(("Merge Load", test_merge_load()))
+    results.append(("Log Retention", test_log_retention()))
+    results.append(("Scheduler", test_scheduler()))
+    results.append(("Background Executor", test_background_executor()))
+    results.append(("Run Cancellation", test_run_cancellation()))
+    results.append(("Table Locks", test_table_locks()))
+    results.append(("Job Dependencies", test_job_dependencies()))
+    results.append(("Batch Runner", test_batch_runner()))
+    results.append(("Run Overviews", test_run_overviews()))
+    results.append(("Metrics Endpoint", test_metrics_endpoint()))
+    results.append(("API Pagination", test_pagination_helpers()))
     results.append(("Route Registration", test_routes()))
     results.append(("Templates", test_templates()))
     